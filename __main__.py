@@ -1,56 +1,71 @@
-from data_connector import Pair
-from tws_connection import ib, build_connection
-import execution_model
+from data_connector import Pair, connect_pairs, wait_for_quotes
+from tws_connection import build_connection
 import alpha_model
+import atexit
+import datetime
+import bar_cache
+import checkpoint
+import os
+import pair_screening
+import tick_recorder
 import logger as log
-from constants import PAIRS_TRADED, BUDGET, CURRENCY, THRESHOLD
+from constants import PAIRS_TRADED, BUDGET, CURRENCY
+from constants import EVALUATION_MODE, POLLING_INTERVAL, DEBOUNCE_WINDOW, UNIVERSE_PATH, SCREENING_TOP_PAIRS
+from constants import SHARD_WORKERS, TICK_PATH, CALIBRATION_DAYS, CALIBRATION_BAR_SIZE
 from personal_constants import ACCOUNT_NUMBER
 from portfolio_model import Portfolio
+from trading_loop import run_polling, run_event_driven
+from sharding import run_sharded
 
-if not ib.isConnected():
-    build_connection()
-
-# For all Pairs a subscription to the data from TWS has to be made when the program start.
-def connect_pairs(pairs):
-    for pair in pairs:
-        pair.connect_data()
 
 if __name__ == "__main__":
     # The log will not be pushed to the repo so it must be ensured that it exists, before the program can start.
     log.initialize_logger()
-    ib.sleep(5)
+    # ib_insync returns from connect once the positions and the portfolio of the account are synchronized.
+    build_connection()
 
     portfolio = Portfolio(account_number=ACCOUNT_NUMBER, slots=PAIRS_TRADED, budget=BUDGET)
+    # The last state is written when the program ends, in addition to the periodic checkpoints of the trading loop.
+    atexit.register(checkpoint.save, portfolio)
 
-    # TODO: The test data obviously has to be replaced by real data.
     # For further explaination about the Pairs class, please refer to the data_connector module.
-    test_pairs = [Pair(("AAPL", "MSFT"), CURRENCY, (1,1)),
-                  Pair(("GM", "TSLA"), CURRENCY, (1,1)),
-                  Pair(("AMZN", "CPNG"), CURRENCY, (1,1))]
-
-    connect_pairs(test_pairs)
-    ib.sleep(3)
-
-    while True:
-        """
-        The logic follows iteratively that same pattern.
-
-        1. Generate new Signals for each of the Pairs that are currently traded.
-        2. The Signals generated in 1. have to be evaulated by the portfolio.analyze_signals method.
-        3. During the analysis, instructions about what the new positions should look like, were created.
-           Those will be directed to the Execution Model in the next step.
-        4. In the last step, current positions and Signals that could not be followed, because the maximum amount of trades 
-           we want to be in at the same time was reached, will be analyzed and the portfolio adjusted if a position fullfilled its
-           predicted potential or if the position is blocking a better opportunity.
-
-        """
-        ib.sleep(10)
-        signals = alpha_model.generate_signals(test_pairs, threshold=THRESHOLD)
-        portfolio_changes = portfolio.analyze_signals(signals) 
-        execution_model.execute_portfolio_adjustments(portfolio, portfolio_changes)
-        new_adjustments = portfolio.optimize()
-        execution_model.execute_portfolio_adjustments(portfolio, new_adjustments)
+    if os.path.exists(UNIVERSE_PATH):
+        test_pairs = pair_screening.screen_universe(UNIVERSE_PATH, top=SCREENING_TOP_PAIRS)
+    else:
+        # Without a universe to screen, the demonstration Pairs are traded.
+        test_pairs = [Pair(("AAPL", "MSFT"), CURRENCY, (1,1)),
+                      Pair(("GM", "TSLA"), CURRENCY, (1,1)),
+                      Pair(("AMZN", "CPNG"), CURRENCY, (1,1))]
+
+    if CALIBRATION_DAYS > 0:
+        # The equations are re-fitted on the recent history, which is mostly served from the local bar cache.
+        today = datetime.date.today()
+        pair_screening.calibrate_pairs(test_pairs, bar_cache.BarCache(), today - datetime.timedelta(days=CALIBRATION_DAYS),
+                                       today, CALIBRATION_BAR_SIZE)
+
+    if SHARD_WORKERS > 0:
+        # The worker processes subscribe to and evaluate their share of the Pairs (see sharding.py).
+        run_sharded(portfolio, test_pairs, SHARD_WORKERS)
+    else:
+        # All quotes of the session are recorded in the background (see tick_recorder.py).
+        if TICK_PATH:
+            recorder = tick_recorder.TickRecorder()
+            recorder.start()
+            atexit.register(recorder.stop)
+
+        # For all Pairs a subscription to the data from TWS has to be made when the program start.
+        # The contracts are qualified concurrently and the trading starts as soon as all stocks have quotes.
+        test_pairs = connect_pairs(test_pairs)
+        wait_for_quotes(test_pairs)
+
+        # The SignalEngine evaluates all Pairs in one vectorized pass (see alpha_model.py).
+        signal_engine = alpha_model.SignalEngine(test_pairs)
+        signal_engine.refresh_quotes()
+
+        if EVALUATION_MODE == "POLLING":
+            run_polling(signal_engine, portfolio, POLLING_INTERVAL)
+        else:
+            run_event_driven(signal_engine, portfolio, DEBOUNCE_WINDOW)
 
 else:
     raise ImportError("THE MODULE __main__.py IS NOT INTENDED TO BE IMPORTED")
-
@@ -2,14 +2,14 @@
 This Module contains the functions that are need to determine if a 
 trading opportunity based on the strategy is present.
 """
-import copy
+import logging
 import math
+import numpy as np
+import instrumentation
 import logger as log
-from tws_connection import ib, build_connection
+from signal_store import Signal, QuoteSnapshot
 
-# Check if a connection exists already
-if not ib.isConnected():
-    build_connection()
+console = log.get_console("ALPHA MODEL")
 
 
 def generate_signals(pairs, threshold):
@@ -21,36 +21,226 @@ def generate_signals(pairs, threshold):
     pairs_traded = {}
 
     for pair in pairs:
-        const, slope = pair.equation
-        estimate = const + slope * pair.quotes_b.dict()["ask"]
+        equation = pair.equation
+        quotes = pair.quotes
+        estimate = equation[0]
+        for leg in range(1, len(equation)):
+            estimate += equation[leg] * quotes[leg].ask
 
         # Calculate the Divergence from the estimation and Ask-price to get the residual and divide by estimate.
-        delta = (pair.quotes_a.dict()["ask"] - estimate) / estimate
+        delta = (quotes[0].ask - estimate) / estimate
 
         if delta > threshold:
 
             # Assign priority based on strength of deviation.
             deviation = abs(delta)
-            print(f"\033[32mALPHA MODEL\033[0m : Deviation = {deviation}; Stock_a = {pair.quotes_a}; Stock_b = {pair.quotes_b};")
+            console.debug("Deviation = %s; Stocks = %s;", deviation, quotes)
 
             # We safe the sign to find the correct trade diraction later.
             sign = math.copysign(1, delta)
-            ticker_a, ticker_b = pair.tickers
 
-            pairs_traded[ticker_a] = pair
-            pairs_traded[ticker_b] = pair
+            for ticker in pair.tickers:
+                pairs_traded[ticker] = pair
 
             # new_signals will contain all the information for future evalutation of the Signal.
-            new_signals[pair.tickers] = (deviation,
-                                         sign,
-                                         pair,
-                                         {
-                                             ticker_a: copy.copy(pair.quotes_a),
-                                             ticker_b: copy.copy(pair.quotes_b)
-                                         },
-                                         const,
-                                         slope,
-                                         threshold)
+            new_signals[pair.tickers] = Signal(deviation,
+                                               sign,
+                                               pair,
+                                               tuple(map(QuoteSnapshot.from_ticker, quotes)),
+                                               equation,
+                                               threshold)
 
     return new_signals, pairs_traded
 
+
+class SignalEngine:
+    """
+    Batch version of generate_signals for a large universe of Pairs and Baskets.
+
+    Every symbol of the universe gets one column in the price arrays, no matter in how many Baskets it appears.
+    Each Basket is a row that points with target to the column of its first stock and with hedge_legs to the
+    columns of the others. Baskets with fewer legs than the largest one are padded with a column whose price is
+    always 0 and a coefficient of 0. The estimates of all Baskets are then one product of the coefficient matrix
+    with the gathered prices per row, so the delta and sign of all Baskets are computed in one vectorized pass
+    and Python objects are only touched for the Baskets that actually cross the threshold.
+
+    The Baskets have to be connected (Basket.connect_data) before they are handed to the SignalEngine.
+    """
+
+    def __init__(self, pairs):
+
+        self.pairs = list(pairs)
+        self.symbols = []
+        self.columns = {}  # symbol -> column in the price arrays
+        self.quotes = []  # One ib_insync Ticker per column.
+
+        self.column_rows = []  # column -> rows of the Pairs that contain the symbol
+        self.dirty_rows = set()  # Rows whose quotes changed since the last evaluation.
+        self.first_tick = None  # perf_counter_ns of the first tick since the last evaluation.
+
+        legs = []
+        for row, pair in enumerate(self.pairs):
+            columns = []
+            for symbol, quotes in zip(pair.tickers, pair.quotes):
+                if symbol not in self.columns:
+                    self.columns[symbol] = len(self.symbols)
+                    self.symbols.append(symbol)
+                    self.quotes.append(quotes)
+                    self.column_rows.append([])
+                columns.append(self.columns[symbol])
+                self.column_rows[self.columns[symbol]].append(row)
+            legs.append(columns)
+
+        # The last column of the price arrays is the padding of the Baskets with fewer legs.
+        padding = len(self.symbols)
+        hedges = max((len(columns) - 1 for columns in legs), default=1)
+        self.target = np.array([columns[0] for columns in legs], dtype=np.intp)
+        self.hedge_legs = np.full((len(self.pairs), hedges), padding, dtype=np.intp)
+        self.const = np.zeros(len(self.pairs))
+        self.coefficients = np.zeros((len(self.pairs), hedges))
+        for row, (pair, columns) in enumerate(zip(self.pairs, legs)):
+            self.hedge_legs[row, :len(columns) - 1] = columns[1:]
+            self.const[row] = pair.equation[0]
+            self.coefficients[row, :len(columns) - 1] = pair.equation[1:]
+        self.ask = np.full(len(self.symbols) + 1, np.nan)
+        self.bid = np.full(len(self.symbols) + 1, np.nan)
+        self.ask[padding] = self.bid[padding] = 0.0
+        # Rolling residual statistics of each Pair, copied from Pair.history whenever the Pair records quotes.
+        self.residual_mean = np.full(len(self.pairs), np.nan)
+        self.residual_std = np.full(len(self.pairs), np.nan)
+
+    def refresh_quotes(self):
+        """
+        Copy the latest ask and bid of every symbol into the price arrays.
+        """
+        self.ask[:-1] = [quotes.ask for quotes in self.quotes]
+        self.bid[:-1] = [quotes.bid for quotes in self.quotes]
+        self.record_history(range(len(self.pairs)))
+
+    def update_quotes(self, tickers):
+        """
+        Copy the latest ask and bid of the given ib_insync Tickers into the price arrays.
+        Tickers of symbols that are not part of the universe are skipped.
+        :param tickers: Iterable of ib_insync Tickers, e.g. the content of ib.pendingTickersEvent.
+        :return: List of the columns that were updated.
+        """
+        updated = []
+        for ticker in tickers:
+            column = self.columns.get(ticker.contract.symbol)
+            if column is None:
+                continue
+            self.ask[column] = ticker.ask
+            self.bid[column] = ticker.bid
+            updated.append(column)
+        return updated
+
+    def on_pending_tickers(self, tickers):
+        """
+        Handler for ib.pendingTickersEvent. Updates the price arrays and marks every Pair with a leg
+        that ticked as dirty, so the next evaluation only has to look at those Pairs.
+        :param tickers: Set of ib_insync Tickers that received new data.
+        """
+        rows = set()
+        for column in self.update_quotes(tickers):
+            rows.update(self.column_rows[column])
+        if rows and not self.dirty_rows:
+            self.first_tick = instrumentation.now()
+        self.record_history(rows)
+        self.dirty_rows |= rows
+
+    def record_history(self, rows):
+        """
+        Add the current quotes to the history of the Baskets in the given rows and copy their residual statistics.
+        The cost is constant per Basket and tick.
+        """
+        for row in rows:
+            pair = self.pairs[row]
+            pair.record_quotes()
+            residuals = pair.history.residuals
+            self.residual_mean[row] = residuals.mean if residuals.count else np.nan
+            self.residual_std[row] = residuals.std
+
+    def update_estimates(self, rows):
+        """
+        Let the Baskets in the given rows learn the quotes recorded since their last evaluation and copy the
+        new equations. Called after the evaluation, so delta is the same residual the history recorded.
+        """
+        for row in rows:
+            pair = self.pairs[row]
+            if pair.update_estimate():
+                equation = pair.equation
+                self.const[row] = equation[0]
+                for leg in range(1, len(equation)):
+                    self.coefficients[row, leg - 1] = equation[leg]
+
+    def pop_dirty_rows(self):
+        """
+        Return the rows of all dirty Pairs as an array and reset the dirty set.
+        The time of the first tick of those rows stays in first_tick for the latency measurement.
+        """
+        rows = np.fromiter(self.dirty_rows, dtype=np.intp, count=len(self.dirty_rows))
+        self.dirty_rows.clear()
+        return rows
+
+    def generate_signals(self, threshold, rows=None, zscore=False):
+        """
+        Vectorized counterpart of generate_signals with the same output format.
+        :param threshold: Minimum delta a Pair needs to generate a Signal.
+        :param rows: Optional array of Pair rows to evaluate. By default the whole universe is evaluated.
+        :param zscore: If True the threshold is compared with the z-score of the delta instead of the delta itself,
+                       so the threshold adapts to the residual volatility of each Pair.
+        :return: Tuple of new signals and pairs traded as in generate_signals.
+        """
+        with instrumentation.Span("generate_signals"):
+            signals = self._generate_signals(threshold, rows, zscore)
+        self.update_estimates(range(len(self.pairs)) if rows is None else np.asarray(rows).tolist())
+        return signals
+
+    def _generate_signals(self, threshold, rows, zscore):
+        if rows is None:
+            rows = np.arange(len(self.pairs))
+        else:
+            rows = np.asarray(rows, dtype=np.intp)
+
+        const = self.const[rows]
+        coefficients = self.coefficients[rows]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Row by row product of the coefficients with the prices of the hedge legs.
+            estimate = const + np.einsum("ij,ij->i", coefficients, self.ask[self.hedge_legs[rows]])
+            delta = (self.ask[self.target[rows]] - estimate) / estimate
+
+            if zscore:
+                score = (delta - self.residual_mean[rows]) / self.residual_std[rows]
+            else:
+                score = delta
+
+        # NaN scores (missing quotes or not enough history) compare False and are skipped.
+        hits = np.flatnonzero(score > threshold)
+
+        new_signals = {}
+        pairs_traded = {}
+        if hits.size == 0:
+            return new_signals, pairs_traded
+
+        deviations = np.abs(delta[hits])
+        signs = np.sign(delta[hits])
+        verbose = console.isEnabledFor(logging.DEBUG)
+        for hit, deviation, sign, hit_const, hit_coefficients in zip(hits.tolist(), deviations.tolist(), signs.tolist(),
+                                                                     const[hits].tolist(), coefficients[hits].tolist()):
+            pair = self.pairs[rows[hit]]
+            if verbose:
+                console.debug("Deviation = %s; Stocks = %s;", deviation, pair.quotes)
+
+            for ticker in pair.tickers:
+                pairs_traded[ticker] = pair
+
+            # The padding of the coefficients is cut off again.
+            new_signals[pair.tickers] = Signal(deviation,
+                                               sign,
+                                               pair,
+                                               tuple(map(QuoteSnapshot.from_ticker, pair.quotes)),
+                                               (hit_const, *hit_coefficients[:len(pair.tickers) - 1]),
+                                               threshold,
+                                               zscore)
+
+        return new_signals, pairs_traded
@@ -0,0 +1,238 @@
+"""
+This module keeps a local cache of historical bars, so the equations of the Pairs can be calibrated without
+downloading the same history from TWS every day.
+
+The bars of a symbol and bar size are stored as one NumPy column per field in BAR_CACHE_PATH/<bar size>/<symbol>.npz,
+together with the time ranges that were already fetched. A request for a range only fetches the parts that are
+not covered yet and merges them into the file. Ranges without any bars (weekends, holidays) are covered as well,
+so they are not requested again. Only completed bars are cached; the running period is fetched again next time.
+
+The bars are fetched by a fetcher, a callable (symbol, bar_size, start, end) -> array of BAR_DTYPE with the bars
+in [start, end). IBFetcher wraps ib.reqHistoricalData and keeps to the pacing limits of IB. In offline mode the
+cache never fetches and serves what it has, which also allows to use any other fetcher, e.g. in a test.
+"""
+import datetime
+import os
+import tempfile
+import time
+import ib_insync
+import numpy as np
+import logger as log
+from tws_connection import ib
+from constants import CURRENCY, BAR_CACHE_PATH, BAR_CACHE_OFFLINE, HISTORICAL_WHAT_TO_SHOW
+from constants import HISTORICAL_REQUESTS_PER_WINDOW, HISTORICAL_PACING_WINDOW
+
+console = log.get_console("BAR CACHE")
+
+BAR_DTYPE = np.dtype([("time", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8"),
+                      ("volume", "<f8")])
+
+# Bar size of reqHistoricalData -> (seconds per bar, maximum days per request).
+BAR_SIZES = {
+    "1 min": (60, 1),
+    "5 mins": (300, 7),
+    "15 mins": (900, 14),
+    "30 mins": (1800, 30),
+    "1 hour": (3600, 30),
+    "1 day": (86400, 365),
+}
+
+DAY = 86400
+
+
+def to_seconds(moment):
+    """
+    UNIX time in seconds of a date (midnight UTC), a datetime (naive ones are taken as UTC) or a number.
+    """
+    if isinstance(moment, datetime.datetime):
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=datetime.timezone.utc)
+        return int(moment.timestamp())
+    if isinstance(moment, datetime.date):
+        return int(datetime.datetime(moment.year, moment.month, moment.day, tzinfo=datetime.timezone.utc).timestamp())
+    return int(moment)
+
+
+def missing_ranges(covered, start: int, end: int):
+    """
+    :param covered: Array (n x 2) of sorted, disjoint ranges [start, end) that are cached.
+    :return: List of the ranges [start, end) within [start, end) that are not covered.
+    """
+    gaps = []
+    cursor = start
+    for covered_start, covered_end in covered.tolist():
+        if covered_end <= cursor:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > cursor:
+            gaps.append((cursor, covered_start))
+        cursor = max(cursor, covered_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def merge_ranges(covered, ranges):
+    """
+    :return: Array (n x 2) of the union of the covered ranges and the new ranges, sorted and disjoint.
+    """
+    merged = []
+    for range_start, range_end in sorted(covered.tolist() + [list(r) for r in ranges]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return np.array(merged, dtype=np.int64).reshape(-1, 2)
+
+
+class IBFetcher:
+    """
+    Fetches bars with ib.reqHistoricalData in chunks of the maximum duration of the bar size.
+    At most requests_per_window requests are sent within window seconds (IB allows 60 in 10 minutes).
+    """
+
+    def __init__(self,
+                 what_to_show: str = HISTORICAL_WHAT_TO_SHOW,
+                 requests_per_window: int = HISTORICAL_REQUESTS_PER_WINDOW,
+                 window: float = HISTORICAL_PACING_WINDOW,
+                 use_rth: bool = True):
+
+        self.what_to_show = what_to_show
+        self.requests_per_window = requests_per_window
+        self.window = window
+        self.use_rth = use_rth
+        self.contracts = {}  # symbol -> qualified Contract
+        self.requests = []  # monotonic times of the requests within the last window
+
+    def contract(self, symbol):
+        contract = self.contracts.get(symbol)
+        if contract is None:
+            contract = ib_insync.contract.Stock(symbol, "SMART", CURRENCY)
+            ib.qualifyContracts(contract)
+            self.contracts[symbol] = contract
+        return contract
+
+    def _pace(self):
+        now = time.monotonic()
+        self.requests = [sent for sent in self.requests if now - sent < self.window]
+        if len(self.requests) >= self.requests_per_window:
+            wait = self.window - (now - self.requests[0])
+            console.info("Pacing limit of historical data reached - waiting %.0f seconds;", wait)
+            ib.sleep(wait)
+        self.requests.append(time.monotonic())
+
+    def __call__(self, symbol: str, bar_size: str, start: int, end: int):
+        contract = self.contract(symbol)
+        chunk = BAR_SIZES[bar_size][1] * DAY
+        parts = []
+        # The requests go backwards from the end, as reqHistoricalData counts the duration back from endDateTime.
+        chunk_end = end
+        while chunk_end > start:
+            days = -(-(chunk_end - max(start, chunk_end - chunk)) // DAY)
+            self._pace()
+            bars = ib.reqHistoricalData(contract,
+                                        endDateTime=datetime.datetime.fromtimestamp(chunk_end, datetime.timezone.utc),
+                                        durationStr=f"{days} D", barSizeSetting=bar_size,
+                                        whatToShow=self.what_to_show, useRTH=self.use_rth, formatDate=2)
+            parts.append(np.array([(to_seconds(bar.date), bar.open, bar.high, bar.low, bar.close, bar.volume)
+                                   for bar in bars], dtype=BAR_DTYPE))
+            chunk_end -= days * DAY
+        bars = np.concatenate(parts) if parts else np.empty(0, dtype=BAR_DTYPE)
+        return bars[(bars["time"] >= start) & (bars["time"] < end)]
+
+
+class BarCache:
+    """
+    Historical bars per symbol and bar size, fetched incrementally and stored locally.
+
+    :param path: Directory of the cache.
+    :param fetcher: Callable (symbol, bar_size, start, end) -> bars, by default an IBFetcher.
+    :param offline: Serve only from the cache and never fetch.
+    :param clock: Function returning the current UNIX time. Bars after the last completed bar are not cached.
+    """
+
+    def __init__(self, path: str = BAR_CACHE_PATH, fetcher=None, offline: bool = BAR_CACHE_OFFLINE, clock=time.time):
+        self.path = path
+        self.fetcher = fetcher if fetcher is not None else IBFetcher()
+        self.offline = offline
+        self.clock = clock
+        self.fetched = 0  # amount of fetcher calls, e.g. to check that a second request is served from the cache
+
+    def file(self, symbol: str, bar_size: str):
+        return os.path.join(self.path, bar_size.replace(" ", ""), f"{symbol}.npz")
+
+    def load(self, symbol: str, bar_size: str):
+        """
+        :return: Tuple of the cached bars and the covered ranges.
+        """
+        path = self.file(symbol, bar_size)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=BAR_DTYPE), np.empty((0, 2), dtype=np.int64)
+        with np.load(path) as columns:
+            bars = np.empty(len(columns["time"]), dtype=BAR_DTYPE)
+            for field in BAR_DTYPE.names:
+                bars[field] = columns[field]
+            return bars, columns["covered"]
+
+    def store(self, symbol: str, bar_size: str, bars, covered):
+        """
+        Write the bars and covered ranges of a symbol atomically.
+        """
+        path = self.file(symbol, bar_size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npz")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                np.savez(file, covered=covered, **{field: bars[field] for field in BAR_DTYPE.names})
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def get(self, symbol: str, start, end, bar_size: str = "1 day"):
+        """
+        The bars of a symbol in [start, end). Missing ranges are fetched and cached first, unless offline.
+        :param start: date, datetime or UNIX time of the first bar.
+        :param end: date, datetime or UNIX time after the last bar.
+        :return: Array of BAR_DTYPE sorted by time.
+        """
+        start, end = to_seconds(start), to_seconds(end)
+        bars, covered = self.load(symbol, bar_size)
+
+        # Only completed bars are cached, so the range of the running bar is never marked as covered.
+        seconds = BAR_SIZES[bar_size][0]
+        completed = int(self.clock()) // seconds * seconds
+        gaps = missing_ranges(covered, start, min(end, completed))
+        if gaps and self.offline:
+            console.warning("%s ranges of %s (%s) are not cached - offline mode serves the cached bars only;",
+                            len(gaps), symbol, bar_size)
+        elif gaps:
+            fetched = [self.fetcher(symbol, bar_size, gap_start, gap_end) for gap_start, gap_end in gaps]
+            self.fetched += len(gaps)
+            bars = np.concatenate([bars] + fetched)
+            # A bar that was fetched twice is kept once, the later fetch wins.
+            _, last = np.unique(bars["time"][::-1], return_index=True)
+            bars = bars[len(bars) - 1 - last]
+            covered = merge_ranges(covered, gaps)
+            self.store(symbol, bar_size, bars, covered)
+            console.debug("%s ranges of %s (%s) fetched;", len(gaps), symbol, bar_size)
+
+        return bars[(bars["time"] >= start) & (bars["time"] < end)]
+
+    def closes(self, symbols, start, end, bar_size: str = "1 day"):
+        """
+        Price matrix of the close prices of several symbols, e.g. for pair_screening.score_pairs.
+        Only the bar times that all symbols have are kept.
+        :return: Tuple of the bar times and the price matrix (bars x symbols).
+        """
+        series = [self.get(symbol, start, end, bar_size) for symbol in symbols]
+        if not series:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0))
+        times = series[0]["time"]
+        for bars in series[1:]:
+            times = np.intersect1d(times, bars["time"], assume_unique=True)
+        prices = np.empty((len(times), len(series)))
+        for column, bars in enumerate(series):
+            prices[:, column] = bars["close"][np.searchsorted(bars["time"], times)]
+        return times, prices
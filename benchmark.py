@@ -0,0 +1,194 @@
+"""
+This module benchmarks the hot paths of the trading loop on synthetic data.
+
+Usage: python benchmark.py [--sizes 10 1000 10000] [--save baseline.json] [--compare baseline.json]
+
+alpha_model.generate_signals, SignalEngine.generate_signals, Portfolio.analyze_signals and Portfolio.optimize
+are called with synthetic Pairs, quotes and positions. The connection to TWS is replaced by a SimulatedIB
+(see replay.py), so ib.portfolio() returns the synthetic positions. For each function and universe size the
+latency percentiles of the calls and the peak memory allocated by one call are reported. Results can be
+saved as a baseline and compared with a later run to spot changes in how the functions scale.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import time
+import tracemalloc
+import replay
+
+# The models can only be imported after the simulation is installed.
+simulated_ib = replay.install_simulation()
+import alpha_model
+import constants
+import logger as log
+from data_connector import Pair
+from portfolio_model import Portfolio
+
+# Repetitions per universe size. Larger universes are called less often to keep the run short.
+REPEATS = {10: 200, 1000: 30, 10000: 5}
+
+
+class FakeTicker:
+    """
+    Stand-in for an ib_insync Ticker with the fields the models read.
+    """
+    __slots__ = ("contract", "bid", "ask", "last", "time")
+
+    def __init__(self, contract, price):
+        self.contract = contract
+        self.bid = price - 0.01
+        self.ask = price + 0.01
+        self.last = price
+        self.time = None
+
+
+class FakeContract:
+    __slots__ = ("symbol", "currency", "secType")
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.currency = constants.CURRENCY
+        self.secType = "STK"
+
+
+def synthetic_pairs(size: int, seed: int = 0):
+    """
+    Create size Pairs of distinct symbols with the equation (0, 1). About half of them deviate above the threshold 0.
+    """
+    generator = random.Random(seed)
+    pairs = []
+    for number in range(size):
+        pair = Pair((f"A{number}", f"B{number}"), constants.CURRENCY, (0.0, 1.0), online=False)
+        price_b = generator.uniform(10, 200)
+        pair.contract_a = FakeContract(pair.ticker_a)
+        pair.contract_b = FakeContract(pair.ticker_b)
+        pair.quotes_a = FakeTicker(pair.contract_a, price_b * (1 + generator.uniform(-0.05, 0.05)))
+        pair.quotes_b = FakeTicker(pair.contract_b, price_b)
+        pairs.append(pair)
+    return pairs
+
+
+def held_portfolio(pairs, signals, held: int, seed: int = 0):
+    """
+    Create a Portfolio that follows the first held signals and ignored all others. The SimulatedIB reports
+    positions with a random unrealized PnL for the followed signals.
+    """
+    generator = random.Random(seed)
+    simulated_ib.reset([])
+    portfolio = Portfolio(account_number=simulated_ib.account, slots=held, budget=constants.BUDGET)
+    adjustments = portfolio.analyze_signals(signals)
+    for ticker, shares in adjustments.items():
+        pair = portfolio.pairs_traded[ticker]
+        contract = pair.contract_a if pair.ticker_a == ticker else pair.contract_b
+        quotes = pair.quotes_a if pair.ticker_a == ticker else pair.quotes_b
+        average_cost = quotes.last * (1 + generator.uniform(-0.02, 0.02))
+        simulated_ib.positions_[ticker] = [contract, float(shares), average_cost, 0.0]
+        simulated_ib.latest[ticker] = (0.0, ticker, quotes.bid, quotes.ask, quotes.last, 100.0, 100.0)
+    portfolio.position_book.stop()
+    portfolio.position_book.sync(simulated_ib.portfolio())
+    return portfolio
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Disable the INFO and DEBUG messages of the models, so neither formatting nor writing them is measured.
+    """
+    previous = logging.root.manager.disable
+    logging.disable(logging.INFO)
+    try:
+        yield
+    finally:
+        logging.disable(previous)
+
+
+def measure(function, setup, repeats: int):
+    """
+    Call function(*setup()) repeats times. Only the call itself is timed.
+    :return: Dictionary with the latency percentiles in microseconds and the peak allocation of one call in bytes.
+    """
+    samples = []
+    with quiet():
+        for _ in range(repeats):
+            arguments = setup()
+            start = time.perf_counter_ns()
+            function(*arguments)
+            samples.append((time.perf_counter_ns() - start) / 1000)
+
+        arguments = setup()
+        tracemalloc.start()
+        function(*arguments)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    samples.sort()
+    return {
+        "calls": repeats,
+        "p50_us": samples[len(samples) // 2],
+        "p90_us": samples[int(len(samples) * 0.9)],
+        "p99_us": samples[min(int(len(samples) * 0.99), len(samples) - 1)],
+        "max_us": samples[-1],
+        "mean_us": sum(samples) / len(samples),
+        "peak_bytes": peak,
+    }
+
+
+def run(sizes):
+    results = {}
+    for size in sizes:
+        repeats = REPEATS.get(size, 10)
+        pairs = synthetic_pairs(size)
+        signal_engine = alpha_model.SignalEngine(pairs)
+        signal_engine.refresh_quotes()
+        with quiet():
+            signals = signal_engine.generate_signals(threshold=0)
+        held = max(1, len(signals[0]) // 5)
+
+        results[f"generate_signals[{size}]"] = measure(
+            alpha_model.generate_signals, lambda: (pairs, 0), repeats)
+        results[f"SignalEngine.generate_signals[{size}]"] = measure(
+            lambda threshold: signal_engine.generate_signals(threshold=threshold), lambda: (0,), repeats)
+        results[f"Portfolio.analyze_signals[{size}]"] = measure(
+            lambda portfolio, output: portfolio.analyze_signals(output),
+            lambda: (Portfolio(account_number=simulated_ib.account, slots=held, budget=constants.BUDGET),
+                     signal_engine.generate_signals(threshold=0)),
+            repeats)
+        results[f"Portfolio.optimize[{size}]"] = measure(
+            lambda portfolio: portfolio.optimize(),
+            lambda: (held_portfolio(pairs, signal_engine.generate_signals(threshold=0), held),),
+            repeats)
+    return results
+
+
+def report(results, baseline=None):
+    for name, result in results.items():
+        line = (f"{name:<42} p50 {result['p50_us']:>12.1f} us  p99 {result['p99_us']:>12.1f} us  "
+                f"max {result['max_us']:>12.1f} us  peak {result['peak_bytes'] / 1024:>10.1f} KiB")
+        if baseline and name in baseline:
+            line += f"  p50 x{result['p50_us'] / baseline[name]['p50_us']:.2f} vs baseline"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the signal, sizing and optimization hot paths.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 1000, 10000], help="Amounts of Pairs")
+    parser.add_argument("--save", help="Write the results as a baseline JSON file")
+    parser.add_argument("--compare", help="Compare the results with a baseline JSON file")
+    arguments = parser.parse_args()
+
+    os.makedirs(constants.PATH, exist_ok=True)
+    log.initialize_logger()
+    results = run(arguments.sizes)
+
+    baseline = None
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            baseline = json.load(file)
+    report(results, baseline)
+
+    if arguments.save:
+        with open(arguments.save, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,190 @@
+"""
+This module writes the state of the Portfolio to a local checkpoint file and reads it back on a restart.
+
+A checkpoint contains the positions, the followed and the ignored Signals (with their age) and the equations of
+their Pairs and Baskets, including the state of the RecursiveLeastSquares estimators. It is a pickle of plain
+Python values behind a short header with the format version. The file is first written to a temporary file
+in the same directory and then moved over the old checkpoint with os.replace, so a crash never leaves a half written
+checkpoint behind.
+
+On a restart TWS is the truth about the positions. The checkpoint is reconciled with ib.portfolio(): followed
+Signals without any remaining position are dropped and positions without a followed Signal are left to the
+recovery from the trading log, see Portfolio.__init__. The empty slots are not part of the checkpoint; the Portfolio
+counts them from the Signals and positions that are left after this reconciliation.
+"""
+import os
+import pickle
+import struct
+import tempfile
+import time
+import logger as log
+from data_connector import create_basket
+from signal_store import Signal, QuoteSnapshot
+from constants import PATH, CHECKPOINT_NAME, CHECKPOINT_INTERVAL
+
+console = log.get_console("CHECKPOINT")
+
+MAGIC = b"PAIRSCKP"
+
+# Increase with every change of the content of snapshot, older checkpoints are ignored then.
+FORMAT_VERSION = 2
+
+HEADER = struct.Struct("<8sH")
+
+_last_save = time.monotonic()
+
+
+def checkpoint_path():
+    """
+    :return: Path of the checkpoint file or None if checkpoints are disabled (CHECKPOINT_NAME = None).
+    """
+    return PATH + CHECKPOINT_NAME if CHECKPOINT_NAME else None
+
+
+def _quote_state(quote):
+    return None if quote is None else (quote.bid, quote.ask, quote.last, quote.time)
+
+
+def _signal_state(signal, now):
+    age = now - signal.created if signal.created is not None else 0.0
+    quotes = None if signal.quotes is None else tuple(_quote_state(quote) for quote in signal.quotes)
+    return (signal.tickers, signal.deviation, signal.sign, quotes, signal.equation, signal.threshold, signal.zscore, age)
+
+
+def _pair_state(pair):
+    estimator = pair.estimator
+    covariance = None if estimator is None else (estimator.p00, estimator.p01, estimator.p11)
+    return pair.currency, pair.equation, covariance
+
+
+def snapshot(portfolio):
+    """
+    :return: The state of the Portfolio as plain Python values.
+    """
+    now = portfolio.ignored_signals.clock()
+    followed = {id(signal): signal for signal in portfolio.followed_signals.values()}
+    ignored = portfolio.ignored_signals.values()
+    pairs = {signal.pair.tickers: signal.pair for signal in list(followed.values()) + ignored}
+    return {
+        "saved": time.time(),
+        "account": portfolio.profile,
+        "portfolio": dict(portfolio.portfolio),
+        "pairs": {tickers: _pair_state(pair) for tickers, pair in pairs.items()},
+        "followed": [_signal_state(signal, now) for signal in followed.values()],
+        # The oldest first, as in the SignalBook.
+        "ignored": [_signal_state(signal, now) for signal in ignored],
+    }
+
+
+def save(portfolio, path: str = None):
+    """
+    Write the checkpoint of the Portfolio atomically.
+    """
+    global _last_save
+    path = path or checkpoint_path()
+    if path is None:
+        return
+    state = snapshot(portfolio)
+    directory = os.path.dirname(path) or "."
+    descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".checkpoint-")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    _last_save = time.monotonic()
+
+
+def save_if_due(portfolio):
+    """
+    Write the checkpoint if CHECKPOINT_INTERVAL seconds have passed since the last one.
+    """
+    if time.monotonic() - _last_save >= CHECKPOINT_INTERVAL:
+        save(portfolio)
+
+
+def load(path: str = None):
+    """
+    Read a checkpoint in one go.
+    :return: The state as written by snapshot or None if there is no usable checkpoint.
+    """
+    path = path or checkpoint_path()
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, "rb") as file:
+        data = file.read()
+    try:
+        magic, version = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            console.warning("Checkpoint %s has an unknown format - it is ignored;", path)
+            return None
+        return pickle.loads(data[HEADER.size:])
+    except (struct.error, pickle.UnpicklingError, EOFError, ValueError) as e:
+        console.warning("Checkpoint %s could not be read - it is ignored; %s", path, e)
+        return None
+
+
+def _restore_signal(state, pairs, now, downtime):
+    tickers, deviation, sign, quotes, equation, threshold, zscore, age = state
+    if quotes is not None:
+        quotes = tuple(None if quote is None else QuoteSnapshot(*quote) for quote in quotes)
+    signal = Signal(deviation, sign, pairs[tickers], quotes, equation, threshold, zscore)
+    # The time the program was not running counts towards the age of the Signal.
+    signal.created = now - age - downtime
+    return signal
+
+
+def restore(portfolio, state):
+    """
+    Load a checkpoint into a Portfolio whose positions were already taken from TWS.
+    :param portfolio: The Portfolio, with portfolio.portfolio filled from ib.portfolio().
+    :param state: The state returned by load.
+    :return: Dictionary tickers -> Pair of all restored Pairs. They still have to be connected.
+    """
+    if state["account"] != portfolio.profile:
+        console.warning("Checkpoint belongs to account %s - it is ignored;", state["account"])
+        return {}
+
+    pairs = {}
+    for tickers, (currency, equation, covariance) in state["pairs"].items():
+        pair = create_basket(tickers, currency, equation, online=covariance is not None)
+        if covariance is not None:
+            pair.estimator.p00, pair.estimator.p01, pair.estimator.p11 = covariance
+        pairs[tickers] = pair
+
+    positions = portfolio.portfolio
+    for ticker, shares in state["portfolio"].items():
+        if positions.get(ticker, 0) != shares:
+            console.warning("Position of %s changed from %s to %s since the checkpoint;",
+                            ticker, shares, positions.get(ticker, 0))
+
+    now = portfolio.ignored_signals.clock()
+    downtime = max(time.time() - state["saved"], 0.0)
+    for signal_state in state["followed"]:
+        signal = _restore_signal(signal_state, pairs, now, downtime)
+        # A followed Signal is only kept while at least one of its stocks is still held.
+        if not any(positions.get(ticker, 0) != 0 for ticker in signal.tickers):
+            console.info("Followed Signal of %s dropped - no position left;", " and ".join(signal.tickers))
+            continue
+        for ticker in signal.tickers:
+            portfolio.followed_signals[ticker] = signal
+            portfolio.pairs_traded[ticker] = signal.pair
+
+    for signal_state in state["ignored"]:
+        signal = _restore_signal(signal_state, pairs, now, downtime)
+        created = signal.created
+        portfolio.ignored_signals.add(signal)
+        signal.created = created
+        for ticker in signal.tickers:
+            portfolio.pairs_traded.setdefault(ticker, signal.pair)
+    portfolio.ignored_signals.expire()
+
+    console.info("Checkpoint from %s restored with %s followed and %s ignored Signals;",
+                 time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(state["saved"])),
+                 len({id(signal) for signal in portfolio.followed_signals.values()}), len(portfolio.ignored_signals))
+    return pairs
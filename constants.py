@@ -17,10 +17,149 @@ PATH = "./pairs-trading/dbs/"
 
 DATABASE_NAME = "trading_log.db"
 
+# Database used instead of DATABASE_NAME when quotes are replayed (see replay.py).
+REPLAY_DATABASE_NAME = "replay_log.db"
+
+# Checkpoint of the Portfolio in PATH, from which a restart continues (see checkpoint.py). None disables checkpoints.
+CHECKPOINT_NAME = "portfolio.checkpoint"
+
+# Seconds between two checkpoints.
+CHECKPOINT_INTERVAL = 30
+
+# Directory the quotes of all subscribed stocks are recorded to (see tick_recorder.py). None disables the recording.
+TICK_PATH = "./pairs-trading/ticks/"
+
+# Records per segment file of the tick recording, 48 bytes each. A full segment is continued in a new file.
+TICK_SEGMENT_RECORDS = 1_000_000
+
+# Seconds between two syncs of the recorded quotes to disk.
+TICK_FLUSH_INTERVAL = 5
+
 THRESHOLD = 0
 
+# Either "ABSOLUTE" to compare the delta with THRESHOLD or "ZSCORE" to compare the z-score of the delta,
+# based on the rolling residual statistics of each Pair, with Z_SCORE_THRESHOLD.
+THRESHOLD_MODE = "ABSOLUTE"
+
+Z_SCORE_THRESHOLD = 2.0
+
+# Amount of observations kept in the rolling history of each Pair.
+HISTORY_LENGTH = 500
+
+# Re-estimate const and slope of each Pair with every tick (recursive least squares).
+ONLINE_HEDGE_RATIO = True
+
+# Weight of the previous observations in each update. 1 never forgets, smaller values adapt faster.
+RLS_FORGETTING = 0.999
+
+# Initial variance of the const and slope estimates. Higher values let the first ticks move the estimate more.
+RLS_UNCERTAINTY = 1000.0
+
+# The logger writes its rows in batches of this size ...
+LOG_BATCH_SIZE = 100
+
+# ... or at the latest after this many seconds.
+LOG_FLUSH_INTERVAL = 1.0
+
+# Messages below this level are not printed to the terminal (DEBUG, INFO, WARNING or ERROR).
+CONSOLE_LOG_LEVEL = "INFO"
+
+# Seconds between two exports of the latency percentiles to the table Latency.
+METRICS_EXPORT_INTERVAL = 60
+
 MARKET_DATA_TYPE = 3
 
+# Either "EVENT" to evaluate Pairs as soon as their quotes tick or "POLLING" to evaluate all Pairs periodically.
+EVALUATION_MODE = "EVENT"
+
+# Seconds between two evaluations in POLLING mode.
+POLLING_INTERVAL = 10
+
+# Seconds ticks are collected after the first one arrived, before the dirty Pairs are evaluated in EVENT mode.
+DEBOUNCE_WINDOW = 0.25
+
+# Seconds an ignored Signal is kept as a possible replacement in Portfolio.optimize.
+SIGNAL_TTL = 300
+
+# Maximum amount of ignored Signals. If there are more, the oldest ones are dropped.
+MAX_IGNORED_SIGNALS = 1000
+
+# Ignored Signals older than this many seconds are checked against the live quotes before they replace a position.
+SIGNAL_REVALIDATION_AGE = 10
+
+# Seconds a batch of orders may take to be filled before the remaining orders are cancelled.
+ORDER_TIMEOUT = 30
+
+# "MARKET" sends Market-Orders and waits for their fills. "LIMIT" hands the orders to the OrderManager,
+# which works them as Limit-Orders from the mid price towards the touch without blocking the trading loop.
+ORDER_TYPE = "MARKET"
+
+# Seconds between two repricings of an open Limit-Order.
+ORDER_REPRICE_INTERVAL = 5
+
+# Amount of repricings until a Limit-Order reaches the touch (ask for buys, bid for sells).
+ORDER_MAX_REPRICES = 4
+
+# Seconds after its placement an open Limit-Order is cancelled.
+ORDER_STALE_AFTER = 60
+
+# Prices of Limit-Orders are rounded to this tick size.
+ORDER_TICK_SIZE = 0.01
+
+# Maximum amount of contract detail requests that are outstanding at the same time during the start.
+SUBSCRIPTION_CONCURRENCY = 32
+
+# Seconds the start waits for the first quotes of all stocks before the trading begins anyway.
+QUOTE_TIMEOUT = 10
+
+# Client id of the main process at TWS. The shard workers use the following ids (CLIENT_ID + 1, CLIENT_ID + 2, ...).
+CLIENT_ID = 15
+
+# Amount of worker processes that evaluate a share of the Pairs each. 0 evaluates all Pairs in the main process.
+SHARD_WORKERS = 0
+
+# Seconds the coordinator and the shard workers wait for updates before they check their queue or stop flag again.
+SHARD_POLL_INTERVAL = 0.05
+
+# Pair Screening
+# --------------
+
+# Price matrix of the universe that is screened for Pairs at start. Without this file the demonstration Pairs are used.
+UNIVERSE_PATH = "./pairs-trading/data/universe.csv"
+
+# Amount of the best Pairs of the screening that are traded.
+SCREENING_TOP_PAIRS = 100
+
+# Candidates with a lower correlation of their prices are not regressed at all.
+SCREENING_MIN_CORRELATION = 0.7
+
+# Upper bound for the Dickey-Fuller statistic of the residual (5% Engle-Granger critical value for two variables).
+SCREENING_CRITICAL_VALUE = -3.34
+
+# Maximum half-life of the residual in days.
+SCREENING_MAX_HALF_LIFE = 30
+
+# Days of history the equations of the Pairs are re-fitted on at start (see pair_screening.calibrate_pairs).
+# 0 keeps the equations of the screening or of the demonstration Pairs.
+CALIBRATION_DAYS = 0
+
+# Bar size of the history used for the calibration, one of bar_cache.BAR_SIZES.
+CALIBRATION_BAR_SIZE = "1 day"
+
+# Local cache of the historical bars (see bar_cache.py).
+BAR_CACHE_PATH = "./pairs-trading/bars/"
+
+# Serve historical bars only from the local cache and never request them from TWS.
+BAR_CACHE_OFFLINE = False
+
+# Prices the historical bars are built from, see whatToShow of reqHistoricalData.
+HISTORICAL_WHAT_TO_SHOW = "TRADES"
+
+# Pacing of the historical data requests: at most this many requests within HISTORICAL_PACING_WINDOW seconds.
+HISTORICAL_REQUESTS_PER_WINDOW = 60
+
+HISTORICAL_PACING_WINDOW = 600
+
 # Trading Cost
 # ------------
 """
@@ -38,7 +177,7 @@ MINIMUM_TRADE_COST = 1.00
 # Per Order max cost is 1% of the trade value
 MAX_TRADE_COST_PCT = 0.01
 
-# Max absolute value per trade in USD
+# Max absolute value per trade in USD of the FINRA Trading Activity Fee below.
 # However in case of partial execution each execution is considered one trade.
 MAX_TRADE_COST_ABS = 8.30
 
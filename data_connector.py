@@ -1,17 +1,259 @@
 """
-This module contains the Pairs class to effectively access the data 
-and related operations of each Pair that is traded.
+This module contains the Basket and Pairs classes to effectively access the data
+and related operations of each Basket or Pair that is traded.
 """
+import asyncio
+import math
+import time
 import ib_insync
-from tws_connection import ib, build_connection
-from constants import MARKET_DATA_TYPE
+import logger as log
+from tws_connection import ib
+from constants import MARKET_DATA_TYPE, HISTORY_LENGTH, ONLINE_HEDGE_RATIO, RLS_FORGETTING, RLS_UNCERTAINTY
+from constants import SUBSCRIPTION_CONCURRENCY, QUOTE_TIMEOUT
+from pair_statistics import BasketHistory, PairHistory, RecursiveLeastSquares
 
-if not ib.isConnected():
-    build_connection()
+console = log.get_console("DATA CONNECTOR")
 
+# Registry of all market data subscriptions: symbol -> {"contract", "quotes", "references"}.
+# Each symbol is only qualified and subscribed once, no matter in how many Pairs it appears.
 all_data = dict()
 
-class Pair:
+
+def _add_subscription(contract):
+    # Please change the respective constant in the constants.py file.
+    # More information about the different settings: https://ib-insync.readthedocs.io/api.html#ib_insync.ib.IB.reqMarketDataType
+    if not all_data:
+        ib.reqMarketDataType(MARKET_DATA_TYPE)
+    quotes = ib.reqMktData(contract)
+    entry = {"contract": contract, "quotes": quotes, "references": 0}
+    all_data[contract.symbol] = entry
+    return entry
+
+
+def subscribe(ticker, currency):
+    """
+    Hand out the shared Contract and Ticker of a symbol and subscribe to its market data on first use.
+    :param ticker: The ticker symbol of the stock.
+    :param currency: The currency the stock is traded in.
+    :return: Tuple of the ib_insync Ticker with the live quotes and the qualified Contract.
+    """
+    entry = all_data.get(ticker)
+    if entry is None:
+
+        # First we connect the ticker to TWS to receive Market Data.
+        contract = ib_insync.contract.Stock(ticker, "SMART", currency)
+        ib.qualifyContracts(contract)
+        entry = _add_subscription(contract)
+
+    entry["references"] += 1
+    return entry["quotes"], entry["contract"]
+
+
+async def _qualify_all(contracts, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def qualify(contract):
+        async with semaphore:
+            await ib.qualifyContractsAsync(contract)
+
+    await asyncio.gather(*(qualify(contract) for contract in contracts))
+
+
+def subscribe_many(tickers, currency, concurrency: int = SUBSCRIPTION_CONCURRENCY):
+    """
+    Qualify and subscribe all symbols that are not subscribed yet at once. The contract details are requested
+    concurrently with at most concurrency requests in flight, instead of one blocking round trip per symbol.
+    The references are still counted by subscribe, when the Pairs connect.
+    :param tickers: Iterable of ticker symbols, duplicates are allowed.
+    :param currency: The currency the stocks are traded in.
+    :param concurrency: Maximum amount of outstanding contract detail requests.
+    :return: List of the symbols that could not be qualified.
+    """
+    contracts = [ib_insync.contract.Stock(ticker, "SMART", currency)
+                 for ticker in dict.fromkeys(tickers) if ticker not in all_data]
+    if contracts:
+        ib.run(_qualify_all(contracts, concurrency))
+
+    failed = []
+    for contract in contracts:
+        if not contract.conId:
+            failed.append(contract.symbol)
+            continue
+        # reqMktData only sends a request and does not wait for an answer.
+        _add_subscription(contract)
+    return failed
+
+
+def release(ticker):
+    """
+    Drop one reference to the subscription of a symbol. The market data is cancelled once no Pair uses it anymore.
+    :param ticker: The ticker symbol of the stock.
+    """
+    entry = all_data.get(ticker)
+    if entry is None:
+        return
+
+    entry["references"] -= 1
+    if entry["references"] <= 0:
+        ib.cancelMktData(entry["contract"])
+        del all_data[ticker]
+
+
+def connect_pairs(pairs):
+    """
+    Subscribe to the market data of all Pairs. The contracts of all new symbols are qualified concurrently
+    and symbols shared by several Pairs are only subscribed once.
+    :param pairs: Iterable of Pair objects.
+    :return: List of the connected Pairs. Pairs with a stock whose contract could not be qualified are skipped.
+    """
+    pairs = list(pairs)
+    tickers_by_currency = {}
+    for pair in pairs:
+        tickers_by_currency.setdefault(pair.currency, []).extend(pair.tickers)
+
+    failed = set()
+    for currency, tickers in tickers_by_currency.items():
+        failed.update(subscribe_many(tickers, currency))
+
+    connected = []
+    for pair in pairs:
+        if failed.intersection(pair.tickers):
+            console.warning("%s not connected - no contract found for %s;",
+                            " and ".join(pair.tickers), ", ".join(failed.intersection(pair.tickers)))
+            continue
+        pair.connect_data()
+        connected.append(pair)
+
+    # The partners of stocks that could not be qualified were subscribed without being used.
+    if failed:
+        for tickers in tickers_by_currency.values():
+            for ticker in tickers:
+                entry = all_data.get(ticker)
+                if entry is not None and entry["references"] == 0:
+                    ib.cancelMktData(entry["contract"])
+                    del all_data[ticker]
+    return connected
+
+
+def wait_for_quotes(pairs, timeout: float = QUOTE_TIMEOUT):
+    """
+    Wait until every stock of the connected Pairs received its first ask, instead of sleeping for a fixed time.
+    :param pairs: Iterable of connected Pair objects.
+    :param timeout: Maximum seconds to wait, e.g. if the market is closed.
+    :return: List of the symbols that did not receive quotes in time.
+    """
+    waiting = {}
+    for pair in pairs:
+        waiting.update(zip(pair.tickers, pair.quotes))
+
+    deadline = time.monotonic() + timeout
+    while True:
+        waiting = {symbol: quotes for symbol, quotes in waiting.items() if math.isnan(quotes.ask)}
+        remaining = deadline - time.monotonic()
+        if not waiting or remaining <= 0:
+            break
+        ib.waitOnUpdate(timeout=remaining)
+
+    if waiting:
+        console.warning("No quotes received within %s seconds for %s;", timeout, ", ".join(waiting))
+    return list(waiting)
+
+
+class Basket:
+    """
+    This class stores the data of a group of stocks that is traded together.
+
+    The first stock is estimated by the other stocks with a linear equation
+    (const, coefficient_1, ..., coefficient_n) in the format
+
+    tickers[0] = const + coefficient_1 * tickers[1] + ... + coefficient_n * tickers[n]
+
+    A Basket with more than two legs keeps the given equation for the whole session. A Pair is the Basket
+    of two legs that can also re-estimate its equation online.
+    """
+
+    estimator = None
+
+    def __init__(self,
+                 tickers: tuple,
+                 currency: str,
+                 equation: tuple):
+
+        if len(tickers) < 2 or len(equation) != len(tickers):
+            raise ValueError(f"A Basket of {tickers} needs at least two legs and one coefficient per leg after the first")
+
+        self.tickers: tuple = tuple(tickers)
+        self.contracts: list = [None] * len(tickers)
+        self.quotes: list = [None] * len(tickers)  # One ib_insync Ticker per leg.
+        self.equation = equation  # (const, coefficient_1, ..., coefficient_n)
+        self.history = BasketHistory(HISTORY_LENGTH)  # Recent residuals with their rolling statistics.
+        self.currency: str = currency
+
+    @property
+    def equation(self):
+        return self._equation
+
+    @equation.setter
+    def equation(self, equation: tuple):
+        self._equation = tuple(equation)
+
+    @property
+    def res_vol(self):
+        # The volatility of the residual over the last HISTORY_LENGTH observations.
+        return self.history.residuals.std
+
+    def leg(self, ticker):
+        """
+        :return: Tuple of the Contract and the ib_insync Ticker of one of the stocks.
+        """
+        index = self.tickers.index(ticker)
+        return self.contracts[index], self.quotes[index]
+
+    def record_quotes(self):
+        """
+        Add the current ask prices of all legs to the history of the Basket.
+        :return: The residual of the observation or NaN if the quotes were not valid.
+        """
+        const, *coefficients = self.equation
+        return self.history.record([quotes.ask for quotes in self.quotes], const, coefficients)
+
+    def update_estimate(self):
+        """
+        The equation of a Basket with more than two legs is fixed.
+        :return: True if the equation changed.
+        """
+        return False
+
+    @staticmethod
+    def _collect_data(ticker, currency):
+        # The registry makes sure that each symbol is only subscribed once.
+        return subscribe(ticker, currency)
+
+    def connect_data(self):
+        if self.quotes[0] is not None:
+            return
+        for index, ticker in enumerate(self.tickers):
+            self.quotes[index], self.contracts[index] = self._collect_data(ticker, self.currency)
+
+    def disconnect_data(self):
+        if self.quotes[0] is None:
+            return
+        for index, ticker in enumerate(self.tickers):
+            release(ticker)
+            self.quotes[index] = None
+            self.contracts[index] = None
+
+    def export_essentials(self):
+        return self.tickers, self.currency
+
+
+def _leg_attribute(name: str, index: int):
+    # ticker_a and ticker_b of a Pair are the first and the second entry of the leg lists of the Basket.
+    return property(lambda self: getattr(self, name)[index],
+                    lambda self, value: getattr(self, name).__setitem__(index, value))
+
+
+class Pair(Basket):
     """
     This class stores the data of each stock that is currently traded.
 
@@ -24,47 +266,74 @@ class Pair:
 
     We can correctly determine under- or overvalutation, independend of the mapping
     as long as the equation is set up correctly.
+
+    If online is True the given equation is only the starting point. const and slope are then
+    re-estimated with every recorded quote by a RecursiveLeastSquares estimator and the equation
+    attribute always returns the live estimate.
     """
 
+    contract_a = _leg_attribute("contracts", 0)
+    contract_b = _leg_attribute("contracts", 1)
+    quotes_a = _leg_attribute("quotes", 0)
+    quotes_b = _leg_attribute("quotes", 1)
+
     def __init__(self,
                  tickers: tuple,
                  currency: str,
-                 equation: tuple):
- 
-        a, b = tickers
-
-        self.tickers: tuple = tickers
-        self.ticker_a: str = a
-        self.ticker_b: str = b
-        self.contract_a: ib_insync.contract.Stock = None
-        self.contract_b: ib_insync.contract.Stock = None
-        self.quotes_a = None
-        self.quotes_b = None
-        self.equation: tuple = equation  # (const, slope)
-        self.res_vol = float  # This is not used yet but could contain the volatility of the ratio of the prices.
-        self.currency: str = currency
+                 equation: tuple,
+                 online: bool = ONLINE_HEDGE_RATIO):
 
-    @staticmethod
-    def _collect_data(ticker, currency):
+        self.estimator = RecursiveLeastSquares(*equation, RLS_FORGETTING, RLS_UNCERTAINTY) if online else None
+        super().__init__(tickers, currency, equation)  # (const, slope)
+        self.ticker_a, self.ticker_b = self.tickers
+        self.history = PairHistory(HISTORY_LENGTH)  # Recent prices and residuals with their rolling statistics.
+        self.observations = []  # (price_b, price_a) recorded since the last update_estimate.
 
-        # First we connect the ticker to TWS to receive Market Data.
-        # Please change the respective constant in the constants.py file.
-        # More information about the different settings: https://ib-insync.readthedocs.io/api.html#ib_insync.ib.IB.reqMarketDataType
+    @property
+    def equation(self):
+        if self.estimator is not None:
+            return self.estimator.const, self.estimator.slope
+        return self._equation
 
-        contract = ib_insync.contract.Stock(ticker, "SMART", currency)
-        ib.qualifyContracts(contract)
-        ib.reqMarketDataType(MARKET_DATA_TYPE)
-        data = ib.reqMktData(contract)
-        return data, contract
+    @equation.setter
+    def equation(self, equation: tuple):
+        self._equation = tuple(equation)
+        if self.estimator is not None:
+            self.estimator.const, self.estimator.slope = equation
 
-    def connect_data(self):
-        data_a, contract_a = self._collect_data(self.ticker_a, self.currency)
-        data_b, contract_b = self._collect_data(self.ticker_b, self.currency)
-        self.quotes_a = data_a
-        self.quotes_b = data_b
-        self.contract_a = contract_a
-        self.contract_b = contract_b
+    def record_quotes(self):
+        """
+        Add the current ask prices of both legs to the history of the Pair. The online estimate of the equation
+        only learns the observation in update_estimate, after the Signal of the Pair was evaluated. Otherwise the
+        equation would already be fitted to the quote it is supposed to judge.
+        :return: The residual of the observation or NaN if the quotes were not valid.
+        """
+        const, slope = self.equation
+        quotes_a, quotes_b = self.quotes
+        price_a = quotes_a.ask
+        price_b = quotes_b.ask
+        residual = self.history.record(price_a, price_b, const, slope)
+        if self.estimator is not None and residual == residual:
+            self.observations.append((price_b, price_a))
+        return residual
+
+    def update_estimate(self):
+        """
+        Update the online estimate of the equation with the observations recorded since the last call.
+        :return: True if the equation changed.
+        """
+        if not self.observations:
+            return False
+        for price_b, price_a in self.observations:
+            self.estimator.update(price_b, price_a)
+        self.observations.clear()
+        return True
 
-    def export_essentials(self):
-        return self.tickers, self.currency
 
+def create_basket(tickers, currency: str, equation, online: bool = ONLINE_HEDGE_RATIO):
+    """
+    :return: A Pair for two tickers, a Basket with a fixed equation for more.
+    """
+    if len(tickers) == 2:
+        return Pair(tuple(tickers), currency, equation, online)
+    return Basket(tuple(tickers), currency, equation)
@@ -1,31 +1,90 @@
 """
 This Module contains the functions necessary to size and place orders on behalf of the Alpha Model. 
 """
-import copy
+import functools
+import time
 import ib_insync
+import instrumentation
 import portfolio_model
 import logger as log
-from tws_connection import ib, build_connection
+from order_manager import OrderManager
+from tws_connection import ib
+from constants import ORDER_TIMEOUT, ORDER_TYPE
 
+console = log.get_console("EXECUTION MODEL")
 
-# Check if a connection exists already
-if not ib.isConnected():
-    build_connection()
+# Works the Limit-Orders if ORDER_TYPE is "LIMIT". It is started with the first Limit-Order.
+order_manager = OrderManager()
 
 
-def stock_limit_order(contract: ib_insync.contract.Stock, limit_price: int, action: str, quantity: int):
+def submit_market_orders(orders: list):
     """
-    Wrapper for an ib_insync Limit-Order.
-    :param contract: The ib_insync.contract.Stock Object, necessary for the exection of the order.
-    :param limit_price: The desired price.
-    :param action: Intention to "BUY" or "SELL".
-    :param quantity: The quantity of shares to be bought or sold.
-    :return:
+    Place all Market-Orders at once without waiting for any of them to be filled.
+    :param orders: List of tuples (contract, action, quantity).
+    :return: List of the ib_insync Trades in the same order.
+    """
+    trades = []
+    for contract, action, quantity in orders:
+        with instrumentation.Span("place_order"):
+            trades.append(ib.placeOrder(contract, ib_insync.MarketOrder(action, quantity)))
+    return trades
+
+
+def wait_for_fills(trades: list, timeout: float = ORDER_TIMEOUT):
+    """
+    Wait until all trades are done or the timeout is reached. The waiting is driven by ib.orderStatusEvent,
+    so the event loop keeps processing quotes in the meantime.
+    Orders that are still working after the timeout will be cancelled to avoid unknown position sizes.
+    :param trades: List of ib_insync Trades.
+    :param timeout: Seconds for the whole batch.
+    :return: List of the trades that were not completely filled.
+    """
+    submitted = instrumentation.now()
+    pending = {id(trade): trade for trade in trades}
+
+    def on_order_status(trade):
+        if trade.isDone() and pending.pop(id(trade), None) is not None:
+            instrumentation.record("order_to_fill", instrumentation.now() - submitted)
+            instrumentation.since_cycle("tick_to_fill")
+
+    # Orders can already be done when they are handed over, e.g. rejected orders or fills during placeOrder.
+    for trade in trades:
+        on_order_status(trade)
+
+    ib.orderStatusEvent += on_order_status
+    deadline = time.monotonic() + timeout
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            ib.waitOnUpdate(timeout=remaining)
+    finally:
+        ib.orderStatusEvent -= on_order_status
+
+    for trade in pending.values():
+        console.warning("%s Order for %s timed out with %s of %s shares filled - remaining order cancelled;",
+                        trade.order.action, trade.contract.symbol, trade.filled(), trade.order.totalQuantity)
+        ib.cancelOrder(trade.order)
+
+    return [trade for trade in trades if trade.filled() < trade.order.totalQuantity]
+
+
+def report_fill(trade):
+    """
+    Print and log the filled part of a Market-Order.
+    :param trade: The ib_insync Trade of the order.
+    :return: The amount of shares that were filled.
     """
-    order = ib_insync.LimitOrder(action, quantity, limit_price)
-    ib.placeOrder(contract, order)
-    print(f"\033[32mEXECUTION MODEL\033[0m : Limit {action} Order for {quantity} shares of {contract} placed;")
-    ib.sleep(1)
+    filled = trade.filled()
+    if filled == 0:
+        return 0
+    symbol = trade.contract.symbol
+    action = trade.order.action
+    price = trade.orderStatus.avgFillPrice
+    console.info("Market %s Order for %s shares of %s filled for %s;", action, filled, symbol, price)
+    log.log_trade("MARKET", action, filled, symbol, price)
+    return filled
 
 
 def stock_market_order(contract: ib_insync.contract.Stock, action: str, quantity: int) :
@@ -34,65 +93,99 @@ def stock_market_order(contract: ib_insync.contract.Stock, action: str, quantity
     :param contract: The ib_insync.contract.Stock Object, necessary for the exection of the order.
     :param action: Intention to "BUY" or "SELL".
     :param quantity: The quantity of shares to be bought or sold.
-    :return:
+    :return: The amount of shares that were filled.
     """
-    order = ib_insync.MarketOrder(action, quantity)
-    trade = ib.placeOrder(contract, order)
-    while trade.orderStatus.status != 'Filled':
-        ib.sleep(0.5)
-    fill = trade.fills[-1]
-    print(f"\033[32mEXECUTION MODEL\033[0m : Market {action} Order for {quantity} shares of {fill.contract.symbol}"
-          f" filled for {fill.execution.avgPrice};")
-    log.log_trade("MARKET", action, quantity, fill.contract.symbol, fill.execution.avgPrice)
+    trades = submit_market_orders([(contract, action, quantity)])
+    wait_for_fills(trades)
+    return report_fill(trades[0])
 
 
-def execute_portfolio_adjustments(portfolio_class: portfolio_model.Portfolio, portfolio_adjustments: dict):
+def net_adjustments(*portfolio_adjustments):
+    """
+    Merge the adjustments of one cycle, so every ticker gets a single order.
+    The adjustments are target position sizes, therefore a later target of a ticker replaces an earlier one
+    and execute_portfolio_adjustments sends only the difference to the current position.
+    :param portfolio_adjustments: Dictionaries with ticker strings as Keys and Position Size as values, oldest first.
+    :return: One dictionary with the final target of each ticker.
+    """
+    netted = {}
+    for adjustments in portfolio_adjustments:
+        for ticker, ideal_position_size in adjustments.items():
+            if ticker in netted and netted[ticker] != ideal_position_size:
+                console.debug("Target of %s changed from %s to %s within the cycle - orders netted;",
+                              ticker, netted[ticker], ideal_position_size)
+            netted[ticker] = ideal_position_size
+    return netted
+
+
+def execute_portfolio_adjustments(portfolio_class: portfolio_model.Portfolio, portfolio_adjustments: dict,
+                                  order_type: str = None):
     """
     Execution of the portfolio_adjustments, give as preferred new position sizes.
+    All orders of the adjustments are sent at once, so both legs of a Pair are working at the same time.
     :param portfolio_class: The class of the current Portfolio from the Module portfolio_model.py.
     :param portfolio_adjustments: Dictionary with ticker strings as Keys and Position Size as values.
+    :param order_type: "MARKET" or "LIMIT", by default ORDER_TYPE from constants.py.
     :return: 
     """
     if portfolio_adjustments == {}:
-        print("\033[32mEXECUTION MODEL\033[0m : No portfolio adjustments received.")
+        console.debug("No portfolio adjustments received.")
         return 
 
+    limit = (order_type or ORDER_TYPE) == "LIMIT"
+    if limit:
+        order_manager.start()
+
+    orders = []
+    tickers = []
     for ticker, ideal_position_size in portfolio_adjustments.items():
 
-        try: old_position_size = portfolio_class.portfolio[ticker]
-        except KeyError:
-            old_position_size = 0
+        old_position_size = portfolio_class.position_book.quantity(ticker)
         # The position_size variable determines the amount of shares of the next trade and the type of action. An action is a buy or a sell.
         # If the position_size is below zero, the old_position_size is too big compared to the ideal_position_size ==> we need a sell. (Equal vice versa).
         position_size = ideal_position_size - old_position_size
 
-        # We have to find out if the involved ticker is ticker_a or ticker_b of the Pair class (for more on Pair class visit data_connector.py)
-        pair = portfolio_class.pairs_traded[ticker]
-        if pair.ticker_a == ticker:
-            contract = pair.contract_a
-        else:
-            contract = pair.contract_b
-
-        if position_size < 0:
-            stock_market_order(contract, "SELL", quantity=abs(position_size))
-            try:
-                portfolio_class.portfolio[ticker] += position_size
-            except KeyError:
-                portfolio_class.portfolio[ticker] = copy.copy(position_size)
-            continue
-        elif position_size > 0:
-            # Caution: If the Model should work with a more complex execution Algorithm Limit-Orders
-            # that might need to be canceled, it CAN'T be assumed that the positions size is always completely executed.
-            stock_market_order(contract, "BUY", quantity=position_size)
-
-            # If there is not yet a Position size we can safely assign it. If there is one we have to add the size,
-            # because sell orders have a negative sign. Buy orders have a positive sign.
-            try:
-                portfolio_class.portfolio[ticker] += position_size
-            except KeyError:
-                portfolio_class.portfolio[ticker] = copy.copy(position_size)
+        if position_size == 0 and not (limit and order_manager.open_shares(ticker)):
+            console.debug("Zero positional change - no execution necessary for %s;", ticker)
             continue
-        else:
-            print(f"\033[32mEXECUTION MODEL\033[0m : Zero positional change - no execution necessary for {ticker};")
+
+        # We have to find out which leg of the Basket the involved ticker is (for more on the Basket class visit data_connector.py)
+        contract, quotes = portfolio_class.pairs_traded[ticker].leg(ticker)
+
+        if limit:
+            # The OrderManager modifies or replaces an open order of the ticker. Its fills are booked by the PositionBook.
+            # A stale or cancelled order is handed back to the Portfolio by release_order.
+            order_manager.adjust(ticker, contract, quotes, position_size,
+                                 on_cancel=functools.partial(release_order, portfolio_class, order_type="LIMIT"))
             continue
 
+        action = "SELL" if position_size < 0 else "BUY"
+        orders.append((contract, action, abs(position_size)))
+        tickers.append(ticker)
+
+    if not orders:
+        return
+
+    trades = submit_market_orders(orders)
+    wait_for_fills(trades)
+
+    # The PositionBook of the Portfolio booked the fills already as they arrived, partial fills included.
+    released = {}
+    for ticker, trade in zip(tickers, trades):
+        filled = report_fill(trade)
+        if filled < trade.order.totalQuantity:
+            console.warning("Partial fill for %s - %s of %s shares;", ticker, filled, trade.order.totalQuantity)
+            released.update(portfolio_class.release_signal(ticker))
+    # The Signals of orders that were not filled completely are given up and their filled legs are closed.
+    execute_portfolio_adjustments(portfolio_class, released, order_type)
+
+
+def release_order(portfolio_class: portfolio_model.Portfolio, ticker: str, order_type: str = None):
+    """
+    Hand an order back to the Portfolio that was closed before it was completely filled, e.g. a stale Limit-Order,
+    and execute the orders that close the Signal of the order.
+    :param portfolio_class: The class of the current Portfolio from the Module portfolio_model.py.
+    :param ticker: The ticker of the order.
+    :param order_type: "MARKET" or "LIMIT", by default ORDER_TYPE from constants.py.
+    """
+    execute_portfolio_adjustments(portfolio_class, portfolio_class.release_signal(ticker), order_type)
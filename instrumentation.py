@@ -0,0 +1,164 @@
+"""
+This Module measures the latency of the trading loop, from the first tick of a cycle until its orders are filled.
+
+Every stage records its durations in nanoseconds into a Histogram. A Histogram only increments a bucket counter,
+so recording is cheap enough for the hot path. Every METRICS_EXPORT_INTERVAL seconds the median, the 99th percentile
+and the maximum of each stage are written to the table Latency by the logger and the Histograms are reset.
+
+Stages:
+    tick_to_signal      first tick of a cycle until the signals are generated
+    generate_signals    SignalEngine.generate_signals
+    analyze_signals     Portfolio.analyze_signals
+    optimize            Portfolio.optimize
+    place_order         ib.placeOrder of a single order
+    order_to_fill       submission of a batch until an order of it is done
+    tick_to_fill        first tick of a cycle until an order of it is done
+"""
+import atexit
+import math
+import time
+from array import array
+import logger as log
+from constants import METRICS_EXPORT_INTERVAL
+
+# Every power of two is split into this many buckets, so a percentile is at most 1/8 above the true value.
+BUCKETS_PER_OCTAVE = 8
+
+# Enough buckets for durations up to 2**63 nanoseconds.
+BUCKETS = 64 * BUCKETS_PER_OCTAVE
+
+
+class Histogram:
+    """
+    Log-bucketed histogram of durations in nanoseconds.
+    """
+    __slots__ = ("counts", "count", "maximum")
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * BUCKETS))
+        self.count = 0
+        self.maximum = 0
+
+    def record(self, nanoseconds: int):
+        if nanoseconds < 1:
+            nanoseconds = 1
+        mantissa, exponent = math.frexp(nanoseconds)
+        self.counts[(exponent - 1) * BUCKETS_PER_OCTAVE + int((mantissa * 2 - 1) * BUCKETS_PER_OCTAVE)] += 1
+        self.count += 1
+        if nanoseconds > self.maximum:
+            self.maximum = nanoseconds
+
+    def percentile(self, fraction: float):
+        """
+        Upper bound of the bucket that contains the given fraction of all durations, capped at the maximum.
+        :param fraction: e.g. 0.99 for the 99th percentile.
+        """
+        if self.count == 0:
+            return math.nan
+        rank = max(math.ceil(fraction * self.count), 1)
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                octave, step = divmod(bucket, BUCKETS_PER_OCTAVE)
+                return min(math.ldexp(1 + (step + 1) / BUCKETS_PER_OCTAVE, octave), self.maximum)
+        return self.maximum
+
+    def reset(self):
+        for bucket in range(BUCKETS):
+            self.counts[bucket] = 0
+        self.count = 0
+        self.maximum = 0
+
+
+class Span:
+    """
+    Context manager that records the duration of its block into a stage, e.g.
+
+        with Span("analyze_signals"):
+            portfolio.analyze_signals(signals)
+    """
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.stage, time.perf_counter_ns() - self.start)
+        return False
+
+
+histograms = {}
+
+# perf_counter_ns of the first tick of the running cycle, see start_cycle.
+cycle_origin = None
+
+_last_export = time.monotonic()
+
+
+def now():
+    return time.perf_counter_ns()
+
+
+def record(stage: str, nanoseconds: int):
+    """
+    Record a duration of a stage.
+    """
+    try:
+        histogram = histograms[stage]
+    except KeyError:
+        histogram = histograms[stage] = Histogram()
+    histogram.record(nanoseconds)
+
+
+def start_cycle(origin: int = None):
+    """
+    Mark the start of a trading cycle. The tick_to_* stages are measured from here, see since_cycle.
+    :param origin: perf_counter_ns of the first tick that triggered the cycle. By default the current time.
+    """
+    global cycle_origin
+    cycle_origin = now() if origin is None else origin
+
+
+def since_cycle(stage: str):
+    """
+    Record the time since the start of the running cycle for a stage.
+    """
+    if cycle_origin is not None:
+        record(stage, now() - cycle_origin)
+
+
+def summary():
+    """
+    :return: Dictionary stage -> (count, p50, p99, max) with the latencies in microseconds.
+    """
+    return {stage: (histogram.count,
+                    histogram.percentile(0.50) / 1000,
+                    histogram.percentile(0.99) / 1000,
+                    histogram.maximum / 1000)
+            for stage, histogram in histograms.items() if histogram.count}
+
+
+def export(force: bool = False):
+    """
+    Write the percentiles of all stages to the database and reset the Histograms,
+    if METRICS_EXPORT_INTERVAL seconds have passed since the last export.
+    :param force: Export regardless of the interval.
+    """
+    global _last_export
+    if not force and time.monotonic() - _last_export < METRICS_EXPORT_INTERVAL:
+        return
+    for stage, (count, p50, p99, maximum) in summary().items():
+        log.log_latency(stage, count, p50, p99, maximum)
+    for histogram in histograms.values():
+        histogram.reset()
+    _last_export = time.monotonic()
+
+
+# Registered after the logger, so it runs before the writer thread is stopped.
+atexit.register(export, True)
@@ -1,13 +1,92 @@
 """
 This Module contains the Logger class, a integral for all logging operations in this project.
+
+Rows are not written on the calling thread. log_trade and log_signal only stamp the row and put it on a queue.
+A background writer thread owns one long-lived SQLite connection in WAL mode and writes the rows in batches
+with executemany, whenever LOG_BATCH_SIZE rows are waiting or LOG_FLUSH_INTERVAL seconds have passed.
+
+The messages for the terminal go through get_console, which returns a logging.Logger per component.
+Only messages at or above CONSOLE_LOG_LEVEL are formatted and printed.
 """
+import atexit
+import json
+import logging
+import queue
 import sqlite3
 import os
+import sys
+import threading
 import time
 from constants import PATH
 from constants import DATABASE_NAME
+from constants import LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, CONSOLE_LOG_LEVEL
+
+INSERTS = {
+    "Trades": "INSERT INTO Trades (Time, Type, Action, Quantity, Stock, Price) VALUES (?, ?, ?, ?, ?, ?)",
+    "Signals": "INSERT INTO Signals (rowid, Time, Deviation, Sign, Ticker_a, Ticker_b, Const, Slope, Threshold, Basket)"
+               " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "SignalLegs": "INSERT INTO SignalLegs (SignalId, Ticker) VALUES (?, ?)",
+    "Latency": "INSERT INTO Latency (Time, Stage, Count, P50, P99, Max) VALUES (?, ?, ?, ?, ?, ?)",
+}
+
+class _StdoutHandler(logging.StreamHandler):
+    """
+    Writes to the sys.stdout of the moment a message is emitted, not of the moment the module was imported,
+    so a redirect of sys.stdout (e.g. contextlib.redirect_stdout) also applies to the console messages.
+    """
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, stream):
+        pass
+
+
+_console_handler = _StdoutHandler()
+_console_handler.setFormatter(logging.Formatter("\033[32m%(name)s\033[0m : %(message)s"))
+
+
+def get_console(name: str):
+    """
+    Return the terminal logger of a component, e.g. get_console("ALPHA MODEL").
+    Pass the values as arguments (console.debug("Deviation = %s;", deviation)), so the message is only
+    formatted if its level is enabled.
+    """
+    console = logging.getLogger(name)
+    if not console.handlers:
+        console.addHandler(_console_handler)
+        console.setLevel(CONSOLE_LOG_LEVEL)
+        console.propagate = False
+    return console
+
+
+console = get_console("LOGGER")
+
+# Each entry upgrades the schema by one version. The version of a database is stored in PRAGMA user_version,
+# so every migration runs exactly once, also for databases that were created before it existed.
+MIGRATIONS = [
+    ("CREATE INDEX IF NOT EXISTS SignalsTickerA ON Signals (Ticker_a, Time);",
+     "CREATE INDEX IF NOT EXISTS SignalsTickerB ON Signals (Ticker_b, Time);",
+     "CREATE INDEX IF NOT EXISTS TradesStock ON Trades (Stock, Time);"),
+    # Latencies of the stages of the trading loop in microseconds, see instrumentation.py.
+    ("CREATE TABLE IF NOT EXISTS Latency(Time SmallDateTime, Stage char(31), Count int, P50 double, P99 double, Max double);",),
+    # All tickers and the equation of Signals of Baskets with more than two legs as JSON, NULL for Pairs.
+    ("ALTER TABLE Signals ADD COLUMN Basket text;",),
+    # One row per leg of every Signal, so each leg of a Basket can be looked up by its ticker.
+    ("CREATE TABLE IF NOT EXISTS SignalLegs(SignalId integer, Ticker char(15));",
+     "INSERT INTO SignalLegs (SignalId, Ticker) SELECT rowid, Ticker_a FROM Signals WHERE Basket IS NULL;",
+     "INSERT INTO SignalLegs (SignalId, Ticker) SELECT rowid, Ticker_b FROM Signals WHERE Basket IS NULL;",
+     "INSERT INTO SignalLegs (SignalId, Ticker) SELECT Signals.rowid, Leg.value FROM Signals, "
+     "json_each(Signals.Basket, '$.tickers') AS Leg WHERE Signals.Basket IS NOT NULL;",
+     "CREATE INDEX IF NOT EXISTS SignalLegsTicker ON SignalLegs (Ticker, SignalId);"),
+]
+
+_rows = queue.SimpleQueue()
+_writer = None
+_stop = object()
 
-current_time = time.strftime('%Y-%m-%d %H:%M:%S')
 
 def initialize_logger():
     if not os.path.exists(PATH + DATABASE_NAME):
@@ -20,12 +99,162 @@ def initialize_logger():
                 create_table2 = f"CREATE TABLE Trades(Time SmallDateTime, Type char(15), Action char(5), Quantity int, Stock char(15), Price double);"
                 cur.execute(create_table2)
                 log.commit()
-                print("\033[32mLOGGER\033[0m: Database was created with tables 'Trades' and 'Signals'")
+                console.info("Database was created with tables 'Trades' and 'Signals'")
             except sqlite3.OperationalError as e:
-                print("\033[32mLOGGER\033[0m: Something went wrong with the creation of tables or database itself.")
-                print(e)
+                console.error("Something went wrong with the creation of tables or database itself; %s", e)
     else:
-        print("\033[32mLOGGER\033[0m : Database ready;")
+        console.info("Database ready;")
+    migrate()
+    _start_writer()
+
+
+def migrate():
+    """
+    Apply all migrations the database has not seen yet.
+    """
+    try:
+        with sqlite3.connect(PATH + DATABASE_NAME) as log:
+            version = log.execute("PRAGMA user_version;").fetchone()[0]
+            for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    log.execute(statement)
+                log.execute(f"PRAGMA user_version = {number};")
+                console.info("Database migrated to version %s;", number)
+    except sqlite3.OperationalError as e:
+        console.error("Migration of the database not successful; %s", e)
+
+
+def fetch_latest_signals(tickers):
+    """
+    Retrieve the latest Signal that involved each of the given tickers with a single query.
+    :param tickers: Iterable of ticker symbols.
+    :return: Dictionary ticker -> (Time, Deviation, Sign, Ticker_a, Ticker_b, Const, Slope, Threshold, Basket).
+             Tickers without any Signal are missing. Basket is None for Pairs and otherwise the JSON of log_signal,
+             whose first two tickers are Ticker_a and Ticker_b. Every leg of a Basket is found, not only the first two.
+    """
+    tickers = list(tickers)
+    if not tickers:
+        return {}
+    placeholders = ", ".join("?" * len(tickers))
+
+    # The legs are looked up through the index of SignalLegs and the newest Signal per ticker is picked with a
+    # window function.
+    execution_command = f"""SELECT Ticker, Time, Deviation, Sign, Ticker_a, Ticker_b, Const, Slope, Threshold, Basket FROM (
+                                SELECT SignalLegs.Ticker, Signals.*, ROW_NUMBER() OVER (
+                                    PARTITION BY SignalLegs.Ticker ORDER BY Signals.Time DESC, Signals.rowid DESC) AS Position
+                                FROM SignalLegs JOIN Signals ON Signals.rowid = SignalLegs.SignalId
+                                WHERE SignalLegs.Ticker IN ({placeholders}))
+                            WHERE Position = 1;"""
+    with sqlite3.connect(PATH + DATABASE_NAME) as log:
+        rows = log.execute(execution_command, tickers).fetchall()
+    return {row[0]: row[1:] for row in rows}
+
+
+def _start_writer():
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        _writer = threading.Thread(target=_write_rows, name="logger", daemon=True)
+        _writer.start()
+
+
+def _number_signals(connection, tables):
+    """
+    Give every waiting Signal its rowid and add one row per leg to SignalLegs. The Signals are queued as
+    (tickers, row) and become the rows of the INSERT here. The writer thread is the only one writing to the database,
+    so the rowids can be taken from the largest one in use.
+    """
+    signals = tables["Signals"]
+    first = connection.execute("SELECT COALESCE(MAX(rowid), 0) + 1 FROM Signals;").fetchone()[0]
+    for number, (tickers, row) in enumerate(signals):
+        signals[number] = (first + number,) + row
+        tables["SignalLegs"].extend((first + number, ticker) for ticker in tickers)
+
+
+def _flush(connection, tables):
+    if not any(tables.values()):
+        return
+    try:
+        with connection:
+            if tables["Signals"]:
+                _number_signals(connection, tables)
+            for table, rows in tables.items():
+                if rows:
+                    connection.executemany(INSERTS[table], rows)
+        console.debug("%s Trades and %s Signals written to database;", len(tables["Trades"]), len(tables["Signals"]))
+    except sqlite3.Error as e:
+        # The rows of the batch are lost, but the writer thread keeps running for the following rows.
+        console.error("Writing data to database not successful; %s", e)
+    for rows in tables.values():
+        rows.clear()
+
+
+def _write_rows():
+    """
+    Body of the writer thread. Collects rows from the queue and writes them in batches.
+    """
+    connection = sqlite3.connect(PATH + DATABASE_NAME)
+    connection.execute("PRAGMA journal_mode=WAL;")
+    # In WAL mode NORMAL only syncs at checkpoints, which is safe against application crashes.
+    connection.execute("PRAGMA synchronous=NORMAL;")
+
+    tables = {table: [] for table in INSERTS}
+    waiting = 0
+    deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+    try:
+        while True:
+            try:
+                item = _rows.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+
+            if item is _stop:
+                break
+            if isinstance(item, threading.Event):
+                # Explicit flush request, see flush().
+                _flush(connection, tables)
+                waiting = 0
+                item.set()
+                continue
+            if item is not None:
+                table, row = item
+                tables[table].append(row)
+                waiting += 1
+
+            if waiting >= LOG_BATCH_SIZE or time.monotonic() >= deadline:
+                _flush(connection, tables)
+                waiting = 0
+                deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+    finally:
+        _flush(connection, tables)
+        connection.close()
+
+
+def flush(timeout: float = None):
+    """
+    Block until all rows that were logged so far are written to the database.
+    :param timeout: Maximum seconds to wait.
+    :return: True if the rows were written in time.
+    """
+    if _writer is None or not _writer.is_alive():
+        return True
+    done = threading.Event()
+    _rows.put(done)
+    return done.wait(timeout)
+
+
+@atexit.register
+def shutdown_logger():
+    """
+    Write all remaining rows and stop the writer thread. Called automatically when the program ends.
+    """
+    global _writer
+    if _writer is None:
+        return
+    # A writer thread that died is replaced, so the rows that are still waiting are written as well.
+    _start_writer()
+    _rows.put(_stop)
+    _writer.join()
+    _writer = None
 
 
 def log_trade(trade_type: str, action: str, quantity: int, stock_ticker: str, price: int):
@@ -37,36 +266,38 @@ def log_trade(trade_type: str, action: str, quantity: int, stock_ticker: str, pr
     :param stock_ticker: The ticker of the stock traded.
     :param price: The Price of the asset executed.
     """
-
-    try:
-        with sqlite3.connect(PATH + DATABASE_NAME) as log:
-            cur = log.cursor()
-            execution_command = f"INSERT INTO Trades (Time, Type, Action, Quantity, Stock, Price)"  \
-                                f"VALUES (?, ?, ?, ?, ?, ?)"""
-            values = (current_time, trade_type, action, quantity, stock_ticker, price)
-            cur.execute(execution_command, values)
-            log.commit()
-            print(f"LOG : New Trade of {stock_ticker} written in Table Trades;")
-    except sqlite3.OperationalError as e:
-        print("\033[32mLOGGER\033[0m : Writing trade data to database not successful;", e)
+    if _writer is None or not _writer.is_alive():
+        _start_writer()
+    _rows.put(("Trades", (time.strftime('%Y-%m-%d %H:%M:%S'), trade_type, action, quantity, stock_ticker, price)))
 
 
-def log_signal(deviation: float, sign: int, ticker_a: str, ticker_b: str, const: float, slope: float, threshold: float):
+def log_signal(deviation: float, sign: int, ticker_a: str, ticker_b: str, const: float, slope: float, threshold: float,
+               basket: tuple = None):
     """
     This function used by the alpha model logs all signals generated.
     :param deviation: The Deviation of the two stock prices from their equilibrium.
     :param sign: The sign of the deviation. This is separated to indicate the direction of the deviation.
     :param ticker_a: Ticker of the first Stock.
     :param ticker_b: Ticker of the second Stock.
+    :param basket: Tuple of all tickers and the equation of a Basket with more than two legs, None for a Pair.
     """
+    if _writer is None or not _writer.is_alive():
+        _start_writer()
+    tickers = basket[0] if basket is not None else (ticker_a, ticker_b)
+    basket = json.dumps({"tickers": list(basket[0]), "equation": list(basket[1])}) if basket is not None else None
+    _rows.put(("Signals", (tickers, (time.strftime('%Y-%m-%d %H:%M:%S'), deviation, sign, ticker_a, ticker_b, const,
+                                     slope, threshold, basket))))
 
-    try:
-        with sqlite3.connect(PATH + DATABASE_NAME) as log:
-            cur = log.cursor()
-            execution_command = f"INSERT INTO Signals (Time, Deviation, Sign, Ticker_a, Ticker_b, Const, Slope, Threshold)"  \
-                                    f"VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
-            cur.execute(execution_command, (current_time, deviation, sign, ticker_a, ticker_b, const, slope, threshold))
-            log.commit()
-            print(f"\033[32mLOGGER\033[0m : New Signal of {ticker_a}/{ticker_b} written in Table Signals;")
-    except sqlite3.OperationalError as e:
-        print("\033[32mLOGGER\033[0m : Writing signal data to database not successful;", e)
+
+def log_latency(stage: str, count: int, p50: float, p99: float, maximum: float):
+    """
+    This function used by the instrumentation logs the latency statistics of a stage of the trading loop.
+    :param stage: Name of the stage, e.g. "generate_signals".
+    :param count: Amount of measurements in the interval.
+    :param p50: Median latency in microseconds.
+    :param p99: 99th percentile of the latency in microseconds.
+    :param maximum: Maximum latency in microseconds.
+    """
+    if _writer is None or not _writer.is_alive():
+        _start_writer()
+    _rows.put(("Latency", (time.strftime('%Y-%m-%d %H:%M:%S'), stage, count, p50, p99, maximum)))
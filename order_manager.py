@@ -0,0 +1,275 @@
+"""
+This module contains the OrderManager, which works limit orders without blocking the trading loop.
+
+Every order is tracked by its orderId through the states
+
+    PENDING -> WORKING -> PARTIAL -> FILLED
+                  |          |
+                  +----------+----> CANCELLED
+
+which are derived from ib.orderStatusEvent. Fills are logged as they arrive through ib.execDetailsEvent,
+while the positions themselves are booked by the PositionBook of the Portfolio (see position_book.py),
+so partially filled orders keep the Portfolio consistent with TWS.
+
+A new order is placed at the mid price. Every ORDER_REPRICE_INTERVAL seconds it is modified (cancel/replace
+with the same orderId) to a price closer to the far touch, the ask for a buy and the bid for a sell, which it
+reaches after ORDER_MAX_REPRICES steps. Orders that are still open ORDER_STALE_AFTER seconds after their
+placement are cancelled. The schedule runs on ib.pendingTickersEvent, so no loop has to wait for it.
+An order that is closed before it was completely filled, because it went stale or was cancelled by TWS, is
+reported to its on_cancel function, so the Portfolio can give up the Signal of the order. An order that is only
+cancelled to be replaced by an order in the other direction is not reported.
+"""
+import math
+import time
+import ib_insync
+import logger as log
+from tws_connection import ib
+from constants import ORDER_REPRICE_INTERVAL, ORDER_MAX_REPRICES, ORDER_STALE_AFTER, ORDER_TICK_SIZE
+
+console = log.get_console("ORDER MANAGER")
+
+# Closed orders that are remembered for fills reported after the order was closed.
+CLOSED_ORDERS_KEPT = 1000
+
+PENDING = "PENDING"
+WORKING = "WORKING"
+PARTIAL = "PARTIAL"
+FILLED = "FILLED"
+CANCELLED = "CANCELLED"
+
+# ib_insync OrderStatus.status -> state of a ManagedOrder.
+STATES = {
+    "PendingSubmit": PENDING,
+    "ApiPending": PENDING,
+    "PreSubmitted": WORKING,
+    "Submitted": WORKING,
+    "PendingCancel": WORKING,
+    "Filled": FILLED,
+    "Cancelled": CANCELLED,
+    "ApiCancelled": CANCELLED,
+    "Inactive": CANCELLED,
+}
+
+
+class ManagedOrder:
+    """
+    A limit order of the OrderManager and everything needed to reprice and book it.
+    """
+    __slots__ = ("ticker", "contract", "quotes", "trade", "state", "placed", "repriced", "reprices",
+                 "executions", "on_fill", "on_cancel")
+
+    def __init__(self, ticker, contract, quotes, trade, placed, on_fill, on_cancel):
+        self.ticker = ticker
+        self.contract = contract
+        self.quotes = quotes  # ib_insync Ticker of the stock.
+        self.trade = trade
+        self.state = PENDING
+        self.placed = placed
+        self.repriced = placed
+        self.reprices = 0
+        self.executions = set()  # execIds that were booked already.
+        self.on_fill = on_fill
+        self.on_cancel = on_cancel
+
+    @property
+    def order(self):
+        return self.trade.order
+
+    @property
+    def remaining(self):
+        """
+        Signed amount of shares that is still open, negative for sales.
+        """
+        remaining = self.order.totalQuantity - self.trade.orderStatus.filled
+        return remaining if self.order.action == "BUY" else -remaining
+
+    def __repr__(self):
+        return f"ManagedOrder({self.ticker}, {self.order.action} {self.order.totalQuantity} @ {self.order.lmtPrice}, {self.state})"
+
+
+def limit_price(action: str, bid: float, ask: float, progress: float):
+    """
+    Price of a limit order between the mid price (progress 0) and the far touch (progress 1),
+    rounded to ORDER_TICK_SIZE in favour of the order.
+    :return: The price or NaN if there are no valid quotes.
+    """
+    if not (bid > 0 and ask > 0):
+        return math.nan
+    mid = (bid + ask) / 2
+    if action == "BUY":
+        ticks = math.floor((mid + (ask - mid) * progress) / ORDER_TICK_SIZE + 1e-9)
+    else:
+        ticks = math.ceil((mid - (mid - bid) * progress) / ORDER_TICK_SIZE - 1e-9)
+    return round(ticks * ORDER_TICK_SIZE, 10)
+
+
+class OrderManager:
+    """
+    Places, reprices and cancels limit orders and books their fills. There is at most one open order per ticker.
+
+    :param clock: Function returning the current time in seconds. The replay uses the simulated clock.
+    """
+
+    def __init__(self,
+                 reprice_interval: float = ORDER_REPRICE_INTERVAL,
+                 max_reprices: int = ORDER_MAX_REPRICES,
+                 stale_after: float = ORDER_STALE_AFTER,
+                 clock=time.monotonic):
+
+        self.reprice_interval = reprice_interval
+        self.max_reprices = max_reprices
+        self.stale_after = stale_after
+        self.clock = clock
+        self.orders = {}  # orderId -> ManagedOrder that is not done yet
+        self.by_ticker = {}  # ticker -> ManagedOrder that is not done yet
+        self.closed = {}  # orderId -> ManagedOrder that is filled or cancelled, oldest first
+        self.started = False
+
+    def start(self):
+        if self.started:
+            return
+        ib.orderStatusEvent += self.on_order_status
+        ib.execDetailsEvent += self.on_exec_details
+        ib.pendingTickersEvent += self.on_pending_tickers
+        self.started = True
+
+    def stop(self):
+        if not self.started:
+            return
+        ib.orderStatusEvent -= self.on_order_status
+        ib.execDetailsEvent -= self.on_exec_details
+        ib.pendingTickersEvent -= self.on_pending_tickers
+        self.started = False
+
+    def open_shares(self, ticker):
+        """
+        Signed amount of shares of the open order of a ticker, 0 without an open order.
+        """
+        managed = self.by_ticker.get(ticker)
+        return managed.remaining if managed is not None else 0
+
+    def adjust(self, ticker, contract, quotes, shares, on_fill=None, on_cancel=None):
+        """
+        Make the open order of a ticker buy or sell the given amount of shares on top of the current position.
+        An open order in the same direction is modified, an order in the other direction is cancelled.
+        :param ticker: The ticker of the stock.
+        :param contract: The qualified ib_insync Contract.
+        :param quotes: The ib_insync Ticker of the stock, used for the limit prices.
+        :param shares: Signed amount of shares that is still missing, negative for sales.
+        :param on_fill: Optional function (ticker, signed shares, price) called for every fill.
+        :param on_cancel: Optional function (ticker) called if the order is closed before it was completely filled.
+        """
+        managed = self.by_ticker.get(ticker)
+        if managed is not None:
+            if shares != 0 and (shares > 0) == (managed.remaining > 0):
+                if shares != managed.remaining:
+                    managed.order.totalQuantity = managed.trade.orderStatus.filled + abs(shares)
+                    ib.placeOrder(contract, managed.order)
+                    console.debug("Order for %s resized to %s shares;", ticker, managed.order.totalQuantity)
+                return
+            self.cancel(managed)
+
+        if shares == 0:
+            return
+        self.submit(ticker, contract, quotes, shares, on_fill, on_cancel)
+
+    def submit(self, ticker, contract, quotes, shares, on_fill=None, on_cancel=None):
+        """
+        Place a new limit order at the mid price.
+        :return: The ManagedOrder or None if there are no valid quotes.
+        """
+        action = "BUY" if shares > 0 else "SELL"
+        price = limit_price(action, quotes.bid, quotes.ask, 0)
+        if math.isnan(price):
+            console.warning("No valid quotes for %s - limit order not placed;", ticker)
+            return None
+        trade = ib.placeOrder(contract, ib_insync.LimitOrder(action, abs(shares), price))
+        managed = ManagedOrder(ticker, contract, quotes, trade, self.clock(), on_fill, on_cancel)
+        self.orders[trade.order.orderId] = managed
+        self.by_ticker[ticker] = managed
+        console.info("Limit %s Order for %s shares of %s placed at %s;", action, abs(shares), ticker, price)
+        # The order may have been answered already while it was placed.
+        self.on_order_status(trade)
+        for fill in list(trade.fills):
+            self.on_exec_details(trade, fill)
+        return managed
+
+    def cancel(self, managed):
+        if managed.state in (FILLED, CANCELLED):
+            return
+        # The order is closed first, so the confirmation of TWS is not taken for a cancellation by TWS.
+        self._close(managed, CANCELLED)
+        ib.cancelOrder(managed.order)
+
+    def on_order_status(self, trade):
+        managed = self.orders.get(trade.order.orderId)
+        if managed is None:
+            return
+        state = STATES.get(trade.orderStatus.status, managed.state)
+        if state == WORKING and trade.orderStatus.filled > 0:
+            state = PARTIAL
+        if state in (FILLED, CANCELLED):
+            self._close(managed, state)
+            if state == CANCELLED:
+                console.warning("Order for %s cancelled by TWS with %s of %s shares filled;",
+                                managed.ticker, trade.orderStatus.filled, managed.order.totalQuantity)
+                self._report_cancel(managed)
+        else:
+            managed.state = state
+
+    def on_exec_details(self, trade, fill):
+        # Fills can arrive after the order was closed, e.g. while it was being cancelled.
+        managed = self.orders.get(trade.order.orderId) or self.closed.get(trade.order.orderId)
+        execution = fill.execution
+        if managed is None or execution.execId in managed.executions:
+            return
+        managed.executions.add(execution.execId)
+        signed = execution.shares if execution.side == "BOT" else -execution.shares
+        log.log_trade("LIMIT", trade.order.action, execution.shares, managed.ticker, execution.price)
+        if managed.on_fill is not None:
+            managed.on_fill(managed.ticker, signed, execution.price)
+
+    def on_pending_tickers(self, tickers=None):
+        """
+        Reprice and cancel the open orders on schedule. Runs on every batch of ticks.
+        """
+        if not self.orders:
+            return
+        now = self.clock()
+        for managed in list(self.orders.values()):
+            if managed.state in (FILLED, CANCELLED):
+                # Closed by the on_cancel function of another order in the meantime.
+                continue
+            if now - managed.placed >= self.stale_after:
+                console.info("Stale order for %s cancelled with %s of %s shares filled;",
+                             managed.ticker, managed.trade.orderStatus.filled, managed.order.totalQuantity)
+                self.cancel(managed)
+                self._report_cancel(managed)
+            elif (managed.state != PENDING and managed.reprices < self.max_reprices
+                  and now - managed.repriced >= self.reprice_interval):
+                self.reprice(managed, now)
+
+    def reprice(self, managed, now):
+        managed.reprices += 1
+        managed.repriced = now
+        price = limit_price(managed.order.action, managed.quotes.bid, managed.quotes.ask,
+                            managed.reprices / self.max_reprices)
+        if math.isnan(price) or math.isclose(price, managed.order.lmtPrice):
+            return
+        managed.order.lmtPrice = price
+        ib.placeOrder(managed.contract, managed.order)
+        console.debug("Order for %s repriced to %s;", managed.ticker, price)
+
+    @staticmethod
+    def _report_cancel(managed):
+        if managed.trade.orderStatus.filled < managed.order.totalQuantity and managed.on_cancel is not None:
+            managed.on_cancel(managed.ticker)
+
+    def _close(self, managed, state):
+        managed.state = state
+        self.orders.pop(managed.order.orderId, None)
+        if self.by_ticker.get(managed.ticker) is managed:
+            del self.by_ticker[managed.ticker]
+        self.closed[managed.order.orderId] = managed
+        if len(self.closed) > CLOSED_ORDERS_KEPT:
+            del self.closed[next(iter(self.closed))]
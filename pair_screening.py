@@ -0,0 +1,203 @@
+"""
+This module contains the screening of a universe of stocks for Pairs that are worth trading.
+
+For a price matrix of N tickers all N * (N - 1) / 2 candidate pairs are scored. For each candidate
+ticker_a = const + slope * ticker_b is fitted with OLS and the residual is tested for stationarity with
+an Engle-Granger style Dickey-Fuller regression. All statistics of one ticker_a against all its
+candidates ticker_b are calculated as NumPy array operations and the rows of the matrix are spread
+over a process pool.
+"""
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import logger as log
+from constants import CURRENCY, SCREENING_MIN_CORRELATION, SCREENING_CRITICAL_VALUE, SCREENING_MAX_HALF_LIFE
+
+console = log.get_console("PAIR SCREENING")
+
+
+def load_prices(path: str):
+    """
+    Load a price matrix from a local file.
+
+    CSV files need a header with a date column followed by one column per ticker and one row per day.
+    Parquet files need one column per ticker and are only supported if pandas is installed.
+    Tickers with missing prices are dropped, because the statistics need the same days for all tickers.
+    :param path: Path of the .csv or .parquet file.
+    :return: Tuple of the list of tickers and the price matrix (days x tickers).
+    """
+    if path.endswith(".parquet"):
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError("Reading Parquet files requires pandas.")
+        frame = pd.read_parquet(path)
+        tickers = [str(column) for column in frame.columns]
+        prices = frame.to_numpy(dtype=np.float64)
+    else:
+        with open(path) as file:
+            header = file.readline().strip().split(",")
+        tickers = header[1:]
+        prices = np.genfromtxt(path, delimiter=",", skip_header=1, usecols=range(1, len(header)), ndmin=2)
+
+    complete = ~np.isnan(prices).any(axis=0)
+    if not complete.all():
+        console.warning("%s tickers dropped because of missing prices;", int((~complete).sum()))
+    return [ticker for ticker, keep in zip(tickers, complete) if keep], prices[:, complete]
+
+
+# State of each worker process, set once by _initialize_worker.
+_centered = None
+_means = None
+_variances = None
+
+
+def _initialize_worker(prices):
+    global _centered, _means, _variances
+    _means = prices.mean(axis=0)
+    _centered = prices - _means
+    _variances = np.einsum("ij,ij->j", _centered, _centered)
+
+
+def _score_rows(rows, min_correlation, critical_value, max_half_life):
+    """
+    Score every candidate (a, b) with a in rows and b > a.
+    :return: Tuple of arrays (a, b, correlation, const, slope, adf, half_life) of the candidates that passed.
+    """
+    days = _centered.shape[0]
+    results = []
+    for a in rows:
+        b = np.arange(a + 1, _centered.shape[1])
+        if b.size == 0:
+            continue
+        covariance = _centered[:, a] @ _centered[:, b]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = covariance / np.sqrt(_variances[a] * _variances[b])
+        keep = correlation >= min_correlation
+        if not keep.any():
+            continue
+        b = b[keep]
+        correlation = correlation[keep]
+        slope = covariance[keep] / _variances[b]
+        const = _means[a] - slope * _means[b]
+
+        # The residuals of all candidates of ticker a (days x candidates). They have zero mean by construction.
+        residuals = _centered[:, a, None] - _centered[:, b] * slope
+        lagged = residuals[:-1]
+        change = residuals[1:] - lagged
+
+        # Dickey-Fuller regression change = gamma * lagged without constant.
+        sum_squares = np.einsum("ij,ij->j", lagged, lagged)
+        gamma = np.einsum("ij,ij->j", lagged, change) / sum_squares
+        errors = change - gamma * lagged
+        sigma_squared = np.einsum("ij,ij->j", errors, errors) / (days - 2)
+        adf = gamma / np.sqrt(sigma_squared / sum_squares)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            half_life = np.where((gamma < 0) & (gamma > -1), -math.log(2) / np.log1p(gamma), np.inf)
+
+        passed = (adf < critical_value) & (half_life <= max_half_life)
+        if passed.any():
+            results.append((np.full(int(passed.sum()), a), b[passed], correlation[passed],
+                            const[passed], slope[passed], adf[passed], half_life[passed]))
+
+    if not results:
+        return tuple(np.empty(0) for _ in range(7))
+    return tuple(np.concatenate(column) for column in zip(*results))
+
+
+def score_pairs(prices,
+                min_correlation: float = SCREENING_MIN_CORRELATION,
+                critical_value: float = SCREENING_CRITICAL_VALUE,
+                max_half_life: float = SCREENING_MAX_HALF_LIFE,
+                workers: int = None):
+    """
+    Score all candidate pairs of a price matrix.
+    :param prices: Price matrix (days x tickers).
+    :param min_correlation: Candidates with a lower price correlation are skipped before the regression.
+    :param critical_value: The Dickey-Fuller statistic of the residual must be below this value.
+    :param max_half_life: Maximum half-life of the residual in days.
+    :param workers: Number of worker processes. Defaults to the number of CPUs.
+    :return: Tuple of arrays (a, b, correlation, const, slope, adf, half_life), sorted by adf ascending.
+    """
+    prices = np.ascontiguousarray(prices, dtype=np.float64)
+    tickers = prices.shape[1]
+    workers = workers or os.cpu_count() or 1
+    if tickers == 0:
+        return tuple(np.empty(0) for _ in range(7))
+
+    # Rows with a small index have more candidates, so the rows are dealt out round-robin to balance the chunks.
+    chunk_count = min(tickers, workers * 4)
+    chunks = [range(start, tickers, chunk_count) for start in range(chunk_count)]
+    arguments = (min_correlation, critical_value, max_half_life)
+
+    if workers == 1:
+        _initialize_worker(prices)
+        parts = [_score_rows(chunk, *arguments) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initialize_worker, initargs=(prices,)) as pool:
+            parts = list(pool.map(_score_rows, chunks, *([argument] * len(chunks) for argument in arguments)))
+
+    columns = [np.concatenate(column) for column in zip(*parts)]
+    order = np.argsort(columns[5], kind="stable")
+    return tuple(column[order] for column in columns)
+
+
+def screen_universe(path: str, top: int, workers: int = None):
+    """
+    Load a universe from a local file and return its best Pairs with fitted equations.
+    :param path: Path of the price file, see load_prices.
+    :param top: Maximum amount of Pairs returned.
+    :param workers: Number of worker processes.
+    :return: List of Pair objects, the most stationary residual first.
+    """
+    # Pair is imported here, so the worker processes do not need to import data_connector.
+    from data_connector import Pair
+
+    tickers, prices = load_prices(path)
+    a, b, correlation, const, slope, adf, half_life = score_pairs(prices, workers=workers)
+    console.info("%s candidates scored; %s passed;", len(tickers) * (len(tickers) - 1) // 2, len(adf))
+
+    pairs = []
+    for row in range(min(top, len(adf))):
+        pairs.append(Pair((tickers[int(a[row])], tickers[int(b[row])]), CURRENCY, (float(const[row]), float(slope[row]))))
+    return pairs
+
+
+def calibrate_pairs(pairs, bar_cache, start, end, bar_size: str = "1 day"):
+    """
+    Fit the equation of every Pair (ticker_a = const + slope * ticker_b) or Basket again with OLS on the close
+    prices of [start, end). Each symbol is loaded from the BarCache once, so only the bars it does not have yet are
+    requested from TWS.
+    :param pairs: Pair or Basket objects whose equations are replaced.
+    :param bar_cache: A bar_cache.BarCache.
+    :param start: date or datetime of the first bar.
+    :param end: date or datetime after the last bar.
+    :return: List of the Pairs that were calibrated. The others keep their equations.
+    """
+    bars = {}
+    calibrated = []
+    for pair in pairs:
+        for ticker in pair.tickers:
+            if ticker not in bars:
+                bars[ticker] = bar_cache.get(ticker, start, end, bar_size)
+        series = [bars[ticker] for ticker in pair.tickers]
+
+        # Only the bars all stocks have are compared.
+        times = series[0]["time"]
+        for leg in series[1:]:
+            times = np.intersect1d(times, leg["time"], assume_unique=True)
+        if len(times) <= len(series):
+            console.warning("Not enough history to calibrate %s - equation kept;", " and ".join(pair.tickers))
+            continue
+        prices = np.column_stack([leg["close"][np.searchsorted(leg["time"], times)] for leg in series])
+
+        # The first stock is regressed on a constant and the other stocks.
+        design = np.column_stack([np.ones(len(times)), prices[:, 1:]])
+        solution = np.linalg.lstsq(design, prices[:, 0], rcond=None)[0]
+        pair.equation = tuple(solution.tolist())
+        calibrated.append(pair)
+
+    console.info("%s of %s Pairs calibrated on %s bars;", len(calibrated), len(pairs), bar_size)
+    return calibrated
@@ -0,0 +1,185 @@
+"""
+This module contains the rolling statistics that are kept for each Pair while it is traded.
+
+All buffers are preallocated with a fixed size when the Pair is created. Updating them on a new tick
+is O(1), so neither memory nor the cost per tick grows over a trading session.
+"""
+import math
+from array import array
+
+
+class RollingWindow:
+    """
+    Ring buffer of the last size values with their rolling mean and variance.
+
+    The mean and the sum of squared deviations (m2) are maintained with Welford's algorithm.
+    When the buffer is full the oldest value is removed in the same step the new value is added.
+    """
+    __slots__ = ("size", "values", "index", "count", "mean", "m2")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.values = array("d", bytes(8 * size))
+        self.index = 0  # Position the next value is written to.
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def push(self, value: float):
+        if self.count < self.size:
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+        else:
+            oldest = self.values[self.index]
+            old_mean = self.mean
+            self.mean += (value - oldest) / self.size
+            self.m2 += (value - oldest) * (value - self.mean + oldest - old_mean)
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.size
+
+    def adopt(self, count: int, mean: float, m2: float):
+        """
+        Take over the statistics of a window that is kept elsewhere, e.g. by a shard worker.
+        The values themselves are not known, every stored value is set to the mean instead.
+        """
+        self.count = min(count, self.size)
+        self.mean = mean
+        self.m2 = m2
+        self.values = array("d", [mean]) * self.size
+        self.index = self.count % self.size
+
+    def statistics(self):
+        """
+        :return: Tuple (count, mean, m2) as taken by adopt.
+        """
+        return self.count, self.mean, self.m2
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return math.nan
+        # Rounding can push m2 slightly below zero when all values are equal.
+        return max(self.m2, 0.0) / (self.count - 1)
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def zscore(self, value: float):
+        std = self.std
+        if not std > 0:
+            return math.nan
+        return (value - self.mean) / std
+
+    def last(self):
+        if self.count == 0:
+            return math.nan
+        return self.values[self.index - 1]
+
+    def ordered(self):
+        """
+        Return the stored values from the oldest to the newest.
+        """
+        if self.count < self.size:
+            return self.values[:self.count]
+        return self.values[self.index:] + self.values[:self.index]
+
+
+class PairHistory:
+    """
+    Recent leg prices and residuals of a Pair.
+
+    The residual is the relative deviation of ticker_a from its estimate, the same delta the alpha_model uses:
+    (price_a - (const + slope * price_b)) / (const + slope * price_b)
+    """
+    __slots__ = ("prices_a", "prices_b", "residuals")
+
+    def __init__(self, size: int):
+        self.prices_a = RollingWindow(size)
+        self.prices_b = RollingWindow(size)
+        self.residuals = RollingWindow(size)
+
+    def record(self, price_a: float, price_b: float, const: float, slope: float):
+        """
+        Store a new observation of both legs. Observations without a valid price are skipped.
+        :return: The residual of the observation or NaN if it was skipped.
+        """
+        estimate = const + slope * price_b
+        if not (price_a > 0 and price_b > 0 and estimate != 0):
+            return math.nan
+        residual = (price_a - estimate) / estimate
+        self.prices_a.push(price_a)
+        self.prices_b.push(price_b)
+        self.residuals.push(residual)
+        return residual
+
+
+class BasketHistory:
+    """
+    Recent residuals of a Basket with any amount of legs.
+
+    The residual is the relative deviation of the first leg from its estimate by the other legs:
+    (price_0 - estimate) / estimate with estimate = const + coefficient_1 * price_1 + ... + coefficient_n * price_n
+    """
+    __slots__ = ("residuals",)
+
+    def __init__(self, size: int):
+        self.residuals = RollingWindow(size)
+
+    def record(self, prices, const: float, coefficients):
+        """
+        Store a new observation of all legs. Observations without a valid price are skipped.
+        :param prices: The prices of the legs, the first leg first.
+        :param coefficients: The coefficients of the legs after the first one.
+        :return: The residual of the observation or NaN if it was skipped.
+        """
+        estimate = const + sum(coefficient * price for coefficient, price in zip(coefficients, prices[1:]))
+        if not (all(price > 0 for price in prices) and estimate != 0):
+            return math.nan
+        residual = (prices[0] - estimate) / estimate
+        self.residuals.push(residual)
+        return residual
+
+
+class RecursiveLeastSquares:
+    """
+    Online estimate of the equation price_a = const + slope * price_b.
+
+    Each observation updates const and slope in O(1) with recursive least squares. Older observations are
+    discounted by the forgetting factor, so the estimate follows a relationship that drifts during the day.
+    A forgetting factor of 1 weights all observations equally, smaller values forget faster.
+    The 2x2 covariance matrix of the estimate is stored in its three distinct entries p00, p01 and p11.
+    """
+    __slots__ = ("const", "slope", "forgetting", "p00", "p01", "p11")
+
+    def __init__(self, const: float, slope: float, forgetting: float, uncertainty: float):
+        self.const = const
+        self.slope = slope
+        self.forgetting = forgetting
+        self.p00 = uncertainty
+        self.p01 = 0.0
+        self.p11 = uncertainty
+
+    def update(self, price_b: float, price_a: float):
+        """
+        Update the estimate with a new observation of both legs.
+        :return: The prediction error of the observation before the update.
+        """
+        # P * x with x = (1, price_b)
+        px0 = self.p00 + self.p01 * price_b
+        px1 = self.p01 + self.p11 * price_b
+        denominator = self.forgetting + px0 + price_b * px1
+        gain0 = px0 / denominator
+        gain1 = px1 / denominator
+
+        error = price_a - (self.const + self.slope * price_b)
+        self.const += gain0 * error
+        self.slope += gain1 * error
+
+        # P = (P - k * x' * P) / forgetting
+        self.p00 = (self.p00 - gain0 * px0) / self.forgetting
+        self.p01 = (self.p01 - gain0 * px1) / self.forgetting
+        self.p11 = (self.p11 - gain1 * px1) / self.forgetting
+        return error
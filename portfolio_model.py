@@ -3,13 +3,76 @@ This module contains the relevant functions to size the current positions that s
 according to the alpha_model properly.
 """
 import copy
+import json
+import logging
 import sqlite3
-from data_connector import Pair
-from tws_connection import ib, build_connection
-from constants import PATH, DATABASE_NAME, MINIMUM_TRADE_COST, COST_PER_SHARE, CURRENCY
+import numpy as np
+import checkpoint
+import logger as log
+from data_connector import connect_pairs, create_basket
+from position_book import PositionBook
+from signal_store import Signal, SignalBook, QuoteSnapshot
+from transaction_costs import CostModel
+from tws_connection import ib
+from constants import CURRENCY
+from constants import SIGNAL_TTL, MAX_IGNORED_SIGNALS, SIGNAL_REVALIDATION_AGE
+
+console = log.get_console("PORTFOLIO MODEL")
+
+
+def solve_shares(asks, equations, capital: float):
+    """
+    Solve the unsigned shares of the legs of many Baskets with the same amount of legs in one batched call.
+    The shares x of a Basket with the equation (const, coefficient_1, ..., coefficient_n) solve the linear system
+
+        asks · x = capital                                          (the capital of one slot is invested)
+        x_0 - coefficient_1 * x_1 - ... - coefficient_n * x_n = const    (the shares follow the equation)
+        coefficient_1 * x_i - coefficient_i * x_1 = 0 for i >= 2     (the hedge legs keep the ratio of their coefficients)
+
+    For a Pair this is the well known x_b = (capital - const * ask_a) / (slope * ask_a + ask_b), x_a = const + slope * x_b.
+    :param asks: Array (baskets x legs) of the ask prices.
+    :param equations: Array (baskets x legs) of the equations.
+    :param capital: Capital allocated to each Basket.
+    :return: Array (baskets x legs) of shares. Baskets without a unique solution, e.g. without valid quotes, are NaN.
+    """
+    count, legs = asks.shape
+    matrices = np.zeros((count, legs, legs))
+    matrices[:, 0, :] = asks
+    matrices[:, 1, 0] = 1.0
+    matrices[:, 1, 1:] = -equations[:, 1:]
+    for leg in range(2, legs):
+        matrices[:, leg, leg] = equations[:, 1]
+        matrices[:, leg, 1] = -equations[:, leg]
+    rhs = np.zeros((count, legs))
+    rhs[:, 0] = capital
+    rhs[:, 1] = equations[:, 0]
+
+    # Baskets without valid quotes get the identity instead, so they can not stop the batch, and NaN shares.
+    invalid = ~(np.isfinite(matrices).all(axis=(1, 2)) & np.isfinite(rhs).all(axis=1))
+    if invalid.any():
+        matrices[invalid] = np.eye(legs)
+        rhs[invalid] = 0.0
+    try:
+        shares = np.linalg.solve(matrices, rhs[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        # A single singular system fails the whole call, only then the determinants are needed to find it.
+        invalid |= np.linalg.det(matrices) == 0
+        matrices[invalid] = np.eye(legs)
+        rhs[invalid] = 0.0
+        shares = np.linalg.solve(matrices, rhs[..., None])[..., 0]
+    if invalid.any():
+        shares[invalid] = np.nan
+    return shares
+
+
+def _positions(shares, sign):
+    # A positive sign sells the first leg and buys the others, a negative sign the other way around.
+    return [int(-sign * int(shares[0]))] + [int(sign * int(leg_shares)) for leg_shares in shares[1:]]
+
+
+def _describe(tickers, positions):
+    return "; ".join(f"{ticker} with {position} shares" for ticker, position in zip(tickers, positions))
 
-if not ib.isConnected():
-    build_connection()
 
 class Portfolio:
     """
@@ -30,52 +93,89 @@ class Portfolio:
 
     def __init__(self, account_number,
                  slots,
-                 budget):
+                 budget,
+                 cost_model=None):
 
         self.profile = account_number
-        self.ignored_signals = {}
+        # The fees of all trades are calculated by the cost model, see transaction_costs.py.
+        self.cost_model = cost_model if cost_model is not None else CostModel()
+        # The ignored signals expire and are re-validated against the live quotes, see signal_store.py.
+        self.ignored_signals = SignalBook(ttl=SIGNAL_TTL, max_size=MAX_IGNORED_SIGNALS,
+                                          revalidate_after=SIGNAL_REVALIDATION_AGE)
         self.budget = budget
-        self.tws_positions = [] 
         self.pairs_traded = {}
-        self.portfolio = {}
         self.followed_signals = {}
-        if ib.portfolio():
-            for position in ib.portfolio():
-                ticker = position.contract.symbol
-                shares = position.position
-                self.portfolio[ticker] = shares
+        # The positions are read from TWS once and then kept up to date by the fill events, see position_book.py.
+        self.position_book = PositionBook(account_number)
+        self.position_book.sync(ib.portfolio())
+        self.position_book.start()
+
+        # The checkpoint restores followed and ignored Signals with their Pairs in one read, see checkpoint.py.
+        state = checkpoint.load()
+        restored_pairs = checkpoint.restore(self, state) if state is not None else {}
 
         if self.portfolio:
-            for ticker in list(self.portfolio.keys()):
-                # As we only log trades that were actually made we can use the SQLite file as our memory of positions that have
-                # been taken in the past.
-                try:
-                    with sqlite3.connect(PATH + DATABASE_NAME) as log:
-                        cur = log.cursor()
-                        execution_command = """SELECT * FROM Signals WHERE Ticker_a = ? OR Ticker_b = ?""" \
-                                            """ ORDER BY Time DESC LIMIT 1;"""
-                        cur.execute(execution_command, (ticker, ticker))
-                        data = cur.fetchone()
-                        if data is None:
-                            print(f"\033[32mPORTFOLIO MODEL\033[0m : No Signal to retrieve for {ticker};")
-                            self.followed_signals[ticker] = tuple()
-                        else:
-                            current_time, deviation, sign, ticker_a, ticker_b, const, slope, threshold = data
-                            pair = Pair((ticker_a, ticker_b), CURRENCY, (slope, const))
-                            pair.connect_data()
-                            self.followed_signals[ticker] = (deviation, sign, pair, {ticker_a: copy.copy(pair.quotes_a), ticker_b: copy.copy(pair.quotes_b)},
-                                                             const, slope, threshold)
-                            print(f"\033[32mPORTFOLIO MODEL\033[0m : Signal retrieval for {ticker} from {current_time} successful;")
-                except sqlite3.OperationalError as e:
-                    print("\033[32mPORTFOLIO MODEL\033[0m : Signal retrieval failed due to database error;")
-                    print(e)
+            # As we only log trades that were actually made we can use the SQLite file as our memory of positions that have
+            # been taken in the past. The latest Signal of all held tickers is retrieved at once.
+            # Only positions the checkpoint did not cover are looked up.
+            missing = [ticker for ticker in self.portfolio if ticker not in self.followed_signals]
+            try:
+                latest_signals = log.fetch_latest_signals(missing) if missing else {}
+            except sqlite3.OperationalError as e:
+                console.error("Signal retrieval failed due to database error; %s", e)
+                latest_signals = {}
+
+            recovered_pairs = dict(restored_pairs)
+            for ticker in missing:
+                if ticker in self.followed_signals:
+                    # A leg of a Signal that was already recovered for another leg.
+                    continue
+                data = latest_signals.get(ticker)
+                if data is None:
+                    console.warning("No Signal to retrieve for %s;", ticker)
+                    continue
+                current_time, deviation, sign, ticker_a, ticker_b, const, slope, threshold, basket = data
+                if basket is not None:
+                    basket = json.loads(basket)
+                    tickers, equation = tuple(basket["tickers"]), tuple(basket["equation"])
+                else:
+                    tickers, equation = (ticker_a, ticker_b), (const, slope)
+                # All legs of a Basket share the same Basket object and Signal. As after checkpoint.restore, the Signal
+                # is followed by every leg, also by those without a position.
+                if tickers not in recovered_pairs:
+                    recovered_pairs[tickers] = create_basket(tickers, CURRENCY, equation)
+                pair = recovered_pairs[tickers]
+                signal = Signal(deviation, sign, pair, None, equation, threshold)
+                for leg in tickers:
+                    self.pairs_traded[leg] = pair
+                    self.followed_signals.setdefault(leg, signal)
+                console.info("Signal retrieval for %s from %s successful;", ticker, current_time)
+
+            # The market data of all recovered Pairs is requested in bulk, before the quotes are attached to the Signals.
+            connect_pairs(recovered_pairs.values())
+            for signal in self.followed_signals.values():
+                if signal.quotes is None:
+                    signal.quotes = tuple(map(QuoteSnapshot.from_ticker, signal.pair.quotes))
         else:
-            self.followed_signals = {}
-            print("\033[32mPORTFOLIO MODEL\033[0m : No positions in tws detected - No followed signals should be loaded;")
+            connect_pairs(restored_pairs.values())
+            console.info("No positions in tws detected - No followed signals should be loaded;")
         self.all_slots = slots
-        initial_slot_value = self.all_slots - (len(self.portfolio.keys()) / 2)
-        print(f"\033[32mPORTFOLIO MODEL\033[0m : Slot value detected with {initial_slot_value};")
-        self.empty_slots = copy.copy(initial_slot_value) # Each signal involves two stocks.
+        # The slots are always counted here, also after a checkpoint was restored, because only the restored Signals
+        # and the positions reported by TWS are known to be current.
+        # Every followed Signal occupies one slot, also if only one of its legs is still held.
+        # Positions without a Signal are counted as half a slot, as if they were the legs of Pairs.
+        unfollowed = [ticker for ticker in self.portfolio if ticker not in self.followed_signals]
+        initial_slot_value = (self.all_slots - len({id(signal) for signal in self.followed_signals.values()})
+                              - len(unfollowed) / 2)
+        console.info("Slot value detected with %s;", initial_slot_value)
+        self.empty_slots = copy.copy(initial_slot_value)
+
+    @property
+    def portfolio(self):
+        """
+        Dictionary ticker -> amount of shares of all positions in the PositionBook.
+        """
+        return self.position_book.quantities()
 
 
     def analyze_signals(self, alpha_model_output):
@@ -96,124 +196,209 @@ class Portfolio:
         if signals == []:
             return {}
         
-        # Get a list of all ticker symbols that are already in the portfolio.
-        symbols = [pos for pos in self.portfolio if self.portfolio[pos] > 0]
+        # Get a set of all ticker symbols that are already in the portfolio, long or short.
+        # The legs of followed Signals count as well, their orders may not be filled yet.
+        symbols = self.position_book.positions.keys() | self.followed_signals.keys()
 
         # Store the pairs traded by the model to access market data.
         self.pairs_traded.update(pairs)
 
-        signals.sort(key=lambda a: a[0], reverse=True)
-        # Calculate the amounts of shares needed for each trade as long as there are still slots open.
-        for signal in signals:
+        signals.sort(key=lambda signal: signal.deviation, reverse=True)
+        # All signals are sized and costed at once. The loop below only distributes the slots.
+        all_shares, costs = self.size_signals(signals)
+        allocated_capital = self.budget / self.all_slots
 
-            deviation, sign, pair, quotes, const, slope, threshold = signal
-            ticker_a, ticker_b = pair.tickers
+        for signal, shares, cost in zip(signals, all_shares, costs.tolist()):
+
+            deviation, sign, pair = signal.deviation, signal.sign, signal.pair
+            tickers = pair.tickers
 
             # We want to skip signals that involve Stocks that are already in the portfolio.
             # Those signals should be added to the ignored signals immediately.
-            if not set(symbols).isdisjoint(set([ticker_a, ticker_b])):
-                self.ignored_signals[pair.export_essentials()[0][0]] = signal
-                self.ignored_signals[pair.export_essentials()[0][1]] = signal
-                print(f"""\033[32mPORTFOLIO MODEL\033[0m : Signal will be IGNORED - there is a similar trade in progress; """ \
-                      f"""ticker_a = {ticker_a}; ticker_b = {ticker_b};""")
+            if not symbols.isdisjoint(tickers):
+                self.ignored_signals.add(signal)
+                console.debug("Signal will be IGNORED - there is a similar trade in progress; tickers = %s;", tickers)
                 continue
 
-            # This formula is a result of a linear system of equations that was solved for each amount of shares.
-            shares_b = ((self.budget / self.all_slots - const * quotes[ticker_a].ask) *
-                        (1 / (slope * quotes[ticker_a].ask + quotes[ticker_b].ask)))
-            shares_a = const + slope * shares_b
+            # The expected return of the Signal has to pay for opening and closing all legs.
+            # Signals without valid quotes have NaN costs and are rejected here as well.
+            if not deviation * allocated_capital > cost:
+                console.debug("Signal will be REJECTED - expected return does not cover the costs of %s; tickers = %s;",
+                              cost, tickers)
+                continue
 
             if self.empty_slots > 0:
-                if sign > 0:
-                    portfolio_adjustment[ticker_a] = -1 * int(shares_a)
-                    portfolio_adjustment[ticker_b] = int(shares_b)
-                else:
-                    portfolio_adjustment[ticker_a] = int(shares_a)
-                    portfolio_adjustment[ticker_b] = -1 * int(shares_b)
-                self.followed_signals[pair.export_essentials()[0][0]] = signal
-                self.followed_signals[pair.export_essentials()[0][1]] = signal
+                positions = _positions(shares, sign)
+                for ticker, position in zip(tickers, positions):
+                    portfolio_adjustment[ticker] = position
+                    self.followed_signals[ticker] = signal
+                self.ignored_signals.remove(signal)
                 self.empty_slots -= 1
-                print(f"""\033[32mPORTFOLIO MODEL\033[0m : New Signal will be ADDED to the Portfolio; """ \
-                      f"""ticker_a = {ticker_a}, with {int(shares_a)} shares; ticker_b = {ticker_b}, with {int(shares_b)} shares;""")
+                # Later signals of this batch must not trade the same stocks.
+                symbols.update(tickers)
+                console.info("New Signal will be ADDED to the Portfolio; %s;", _describe(tickers, positions))
                 # Time will be logged by the logger function itself.
-                log.log_signal(deviation, sign, ticker_a, ticker_b, const, slope, threshold)
+                equation = pair.equation
+                log.log_signal(deviation, sign, tickers[0], tickers[1], equation[0], equation[1], signal.threshold,
+                               basket=(tickers, equation) if len(tickers) > 2 else None)
             else:
-                self.ignored_signals[pair.export_essentials()[0][0]] = signal
-                self.ignored_signals[pair.export_essentials()[0][1]] = signal
-                print(f"\033[32mPORTFOLIO MODEL\033[0m : New Signal will be IGNORED - No slot avaliable; ticker_a = {ticker_a}, with {int(shares_a)} shares;" \
-                                                                                    f"ticker_b = {ticker_b}, with {int(shares_b)} shares;")
+                self.ignored_signals.add(signal)
+                if console.isEnabledFor(logging.DEBUG):
+                    console.debug("New Signal will be IGNORED - No slot avaliable; %s;",
+                                  _describe(tickers, _positions(shares, sign)))
         return portfolio_adjustment
 
-    def optimize(self):
-        print("\033[32mPORTFOLIO MODEL\033[0m : Start Portfolio optimization;")
-        portfolio_adjustment = {}
+    def release_signal(self, ticker):
+        """
+        Give up the followed Signal of a ticker whose order was closed before it was completely filled, e.g. a stale
+        Limit-Order or a Market-Order that timed out. The slot of the Signal is free again and all of its legs are
+        closed, so no filled leg is left without its hedge.
+        :param ticker: The ticker of the order.
+        :return: Execution update like analyze_signals.
+        """
+        signal = self.followed_signals.get(ticker)
+        if signal is None:
+            # E.g. a position that was liquidated by optimize and could not be closed completely.
+            if self.position_book.quantity(ticker):
+                console.warning("Order for %s was not filled - the position of %s shares has no Signal;",
+                                ticker, self.position_book.quantity(ticker))
+            return {}
 
-        # First we gather the current positions directly from TWS if any exist.
-        if ib.portfolio() == []:
-            print("\033[32mPORTFOLIO MODEL\033[0m : No Portfolio detected;")
-            return {}  # This is crucial because the execution_model requires a dict as input and the output of this method is supposed to flow into it.
+        for leg in signal.tickers:
+            if self.followed_signals.get(leg) is signal:
+                del self.followed_signals[leg]
+        self.empty_slots += 1
+        held = [leg for leg in signal.tickers if self.position_book.quantity(leg)]
+        console.warning("Signal of %s given up because the order for %s was not filled;%s",
+                        " and ".join(signal.tickers), ticker,
+                        f" {' and '.join(held)} will be closed;" if held else "")
+        return {leg: 0 for leg in signal.tickers}
+
+    def size_signals(self, signals):
+        """
+        Size the trades of all signals at once and calculate their round-trip costs with the cost model.
+        The shares are sized with the live estimate of the equation, which may have moved since the Signal.
+        A positive sign sells the first leg and buys the others, a negative sign the other way around.
+        :param signals: List of Signals.
+        :return: Tuple of the list with the unsigned shares of each Signal (one entry per leg)
+                 and the array of the costs in USD.
+        """
+        count = len(signals)
+        if not count:
+            return [], np.empty(0)
+        lengths = [len(signal.quotes) for signal in signals]
+        # Usually all Signals have the same amount of legs (e.g. only Pairs) and are solved in a single call.
+        # Otherwise there is one batched call per amount of legs.
+        if lengths.count(lengths[0]) == count:
+            groups = {lengths[0]: range(count)}
         else:
-            self.tws_positions = ib.portfolio()
-
-        symbols = [pos.contract.symbol for pos in self.tws_positions]
+            groups = {}
+            for index, legs in enumerate(lengths):
+                groups.setdefault(legs, []).append(index)
+
+        shares = [None] * count
+        costs = np.empty(count)
+        for legs, indices in groups.items():
+            group = signals if len(indices) == count else [signals[index] for index in indices]
+            size = len(group)
+            asks = np.fromiter((quote.ask for signal in group for quote in signal.quotes),
+                               dtype=np.float64, count=size * legs).reshape(size, legs)
+            equations = np.fromiter((value for signal in group for value in signal.pair.equation),
+                                    dtype=np.float64, count=size * legs).reshape(size, legs)
+            sign = np.fromiter((signal.sign for signal in group), dtype=np.float64, count=size)
+            group_shares = solve_shares(asks, equations, self.budget / self.all_slots)
+
+            signed = np.trunc(group_shares) * sign[:, None]
+            signed[:, 0] *= -1
+            group_costs = self.cost_model.round_trip(signed, asks).sum(axis=1)
+            if size == count:
+                return group_shares.tolist(), group_costs
+            costs[indices] = group_costs
+            for index, row in zip(indices, group_shares.tolist()):
+                shares[index] = row
+        return shares, costs
+
+    def optimize(self, pending: dict = None):
+        """
+        Close positions that fulfilled their expected return or that block a better ignored Signal.
+        :param pending: Target positions of this cycle that were not executed yet, e.g. the output of analyze_signals.
+                        Their stocks count as held, so no replacement trades them a second time.
+        :return: Execution update like analyze_signals.
+        """
+        console.debug("Start Portfolio optimization;")
+        portfolio_adjustment = {}
 
-        current_ignored_signals = list(copy.copy(list(self.ignored_signals.values())))
-        # We sort the ignored_signals in descending order (biggest element first) after their "deviation" parameter, the expected return.
-        current_ignored_signals.sort(key=lambda a: a[0], reverse=True)
+        # The positions come from the PositionBook, which the fills keep up to date.
+        positions = self.position_book.positions
+        if not positions:
+            console.debug("No Portfolio detected;")
+            return {}  # This is crucial because the execution_model requires a dict as input and the output of this method is supposed to flow into it.
 
-        if current_ignored_signals == []:
-            print("\033[32mPORTFOLIO MODEL\033[0m : No signals detected that were ignored;")
+        # Signals that were ignored too long ago are not considered anymore.
+        self.ignored_signals.expire()
+        if not self.ignored_signals:
+            console.debug("No signals detected that were ignored;")
             return {}
 
         signals_to_follow = []
 
+        # Entries of the heap that involve stocks of the portfolio. They are pushed back after the optimization.
+        blocked = []
+        held = positions.keys() | {ticker for ticker, size in (pending or {}).items() if size != 0}
+
+        # The cost of closing each position is calculated for all positions at once.
+        closing_costs = dict(zip(positions, self.cost_model.order_cost(
+            -np.fromiter((position.quantity for position in positions.values()), dtype=np.float64, count=len(positions)),
+            np.fromiter((position.market_price for position in positions.values()), dtype=np.float64,
+                        count=len(positions))).tolist()))
+
+        # Every position takes at most one replacement, so the replacements the loop can hand out are known in
+        # advance and are sized and costed at once.
+        replacements = self.ignored_signals.best_replacements(
+            held, blocked, len({id(signal) for signal in self.followed_signals.values()}))
+        replacement_costs = dict(zip(replacements, self.size_signals(replacements)[1].tolist()))
+
         # We create a set to skip symbols from the symbols list we already looked at.
         visited_symbols = set() 
 
-        for symbol in symbols:
+        for symbol in positions:
             if symbol in visited_symbols:
                 continue
 
-            signal_for_symbol = self.followed_signals[symbol]
+            signal_for_symbol = self.followed_signals.get(symbol)
+            if signal_for_symbol is None:
+                # Positions without a known signal (e.g. opened by hand) can not be evaluated.
+                continue
 
-            deviation, sign, pair, quotes, const, slope, threshold = signal_for_symbol
-            tickers = tuple(quotes.keys())
+            deviation = signal_for_symbol.deviation
+            tickers = signal_for_symbol.tickers
 
             absolute_earnings = 0.00
             allocated_capital = self.budget / self.all_slots
 
-            ignored_signals_index = 0
-            ticker_a, ticker_b = tickers
-            replacement_signal = current_ignored_signals[ignored_signals_index]
-            ignored_ticker_a, ignored_ticker_b = tuple(replacement_signal[3].keys())
-            opportunity_cost = replacement_signal[0]
-
             # Signals should only be those considered that involve stocks that are not in the portfolio already.
             # Otherwise we could run into the situation that we try to replace a position with itself.
             # In this case we set the opportunity cost to 0.
-            for signal in current_ignored_signals:
-                replacement_signal = current_ignored_signals[ignored_signals_index]
-                ignored_ticker_a, ignored_ticker_b = tuple(signal[3].keys())
-                if set(symbols).isdisjoint(set([ignored_ticker_a, ignored_ticker_b])):
-                    break
+            replacement_signal = self.ignored_signals.best_replacement(held, blocked)
+            if replacement_signal is not None:
+                # The replacement is only worth its expected return after the costs of opening and closing it.
+                replacement_cost = replacement_costs.get(replacement_signal)
+                if replacement_cost is None:
+                    # A Signal that was revalidated in the meantime.
+                    replacement_cost = self.size_signals([replacement_signal])[1][0]
+                opportunity_cost = replacement_signal.deviation - replacement_cost / allocated_capital
             else:
-                print(f"""\033[32mPORTFOLIO MODEL\033[0m : {ticker_a} and {ticker_b} have no alternative signal""" \
-                    f""" as a replacement that is not their own signal.""" \
-                    f""" Opportinity Costs are therefore zero;""")
+                console.debug("%s have no alternative signal as a replacement that is not their own signal."
+                              " Opportinity Costs are therefore zero;", " and ".join(tickers))
                 opportunity_cost = 0
 
             for ticker in tickers:
                 visited_symbols.add(ticker)
-                index = symbols.index(ticker)
-
-                cost_to_trade = MINIMUM_TRADE_COST if MINIMUM_TRADE_COST >= (COST_PER_SHARE * self.tws_positions[index].position) \
-                                                                        else (COST_PER_SHARE * self.tws_positions[index].position)
-                
-                pnl_of_trade = self.tws_positions[index].unrealizedPNL
-
-                # Two transactions are necessary because we need to buy and sell.
-                absolute_earnings += 2 * cost_to_trade
-                absolute_earnings += pnl_of_trade
+                # A leg without a position was not filled yet, e.g. its Limit-Order is still working.
+                if ticker not in positions:
+                    continue
+                # The earnings of a position are its unrealized PnL minus what it costs to close it.
+                absolute_earnings += positions[ticker].unrealized_pnl - closing_costs[ticker]
 
             # Relative Earnings can now be compared if the match with the expected return so if the reversal is done or not.
             relative_earnings = absolute_earnings / allocated_capital
@@ -221,47 +406,43 @@ class Portfolio:
 
             if relative_earnings >= deviation:
 
-                print(f"""\033[32mPORTFOLIO MODEL\033[0m : Profitable trade of {ticker_a} and {ticker_b} will be liquidated """ \
-                      f"""as it surpassed it expected return;""")
+                console.info("Profitable trade of %s will be liquidated as it surpassed it expected return;",
+                             " and ".join(tickers))
 
                 # If the unrealized return tops or fulfills the expectations the position should be closed.
-                portfolio_adjustment[ticker_a] = 0
-                portfolio_adjustment[ticker_b] = 0
+                for ticker in tickers:
+                    portfolio_adjustment[ticker] = 0
                 # As the position should be clear we can increase the amount of free slots.
                 # If this program will ever run with some kind of concurrency, the state the program is in when this is changed
                 # needs to be taken into considreation.
                 self.empty_slots += 1  
 
                 # The Signal must be removed from the followed signals list.
-                self.followed_signals.pop(ticker_a)
-                self.followed_signals.pop(ticker_b)
+                for ticker in tickers:
+                    self.followed_signals.pop(ticker, None)
                 continue
 
             elif relative_earnings > 0 and potential < opportunity_cost:
-                print(f"""\033[32mPORTFOLIO MODEL\033[0m : Profitable trade of {ticker_a} and {ticker_b} will be liquidated """ \
-                      f"""because it blocks a more profitable trade;""")
+                console.info("Profitable trade of %s will be liquidated because it blocks a more profitable trade;",
+                             " and ".join(tickers))
 
                 # If the unrealized return tops or fulfills the prognosis the position should be cleared.
-                portfolio_adjustment[ticker_a] = 0
-                portfolio_adjustment[ticker_b] = 0
+                for ticker in tickers:
+                    portfolio_adjustment[ticker] = 0
                 self.empty_slots += 1  # As the position ought to be clear we can increase this.
 
+                # The replacement is only followed and removed from the ignored signals once analyze_signals below
+                # accepted it. Until then its stocks count as held, so no other position is replaced by it.
                 signals_to_follow.append(replacement_signal)
-                current_ignored_signals.remove(replacement_signal)
+                held.update(replacement_signal.tickers)
 
                 # The Signal must be removed from the followed signals list because it's not follwed anymore.
-                self.followed_signals.pop(ticker_a)
-                self.followed_signals.pop(ticker_b)
-
-                # The replacement Signal must be added to the followed signals list.
-                self.followed_signals[ignored_ticker_a] = self.ignored_signals[ignored_ticker_a]
-                self.followed_signals[ignored_ticker_b] = self.ignored_signals[ignored_ticker_a]
-
-                # The replacement Signal must be removed from the ignored signals list.
-                self.ignored_signals.pop(ignored_ticker_a)
-                self.ignored_signals.pop(ignored_ticker_b)
+                for ticker in tickers:
+                    self.followed_signals.pop(ticker, None)
                 continue
 
+        self.ignored_signals.restore(blocked)
+
         # The Model has to calculate the positions size for each signal that should be followed.
         # self.pairs_traded will be updated with {} because the Alpha Model added them already pairs_traded and
         # the purpose of pairs traded is to keep track of the data for each ticker.
@@ -269,6 +450,6 @@ class Portfolio:
                                               {}))  
         portfolio_adjustment.update(new_positions)  # This is not the only occasion portfolio_adjustment receives data.
 
-        print("\033[32mPORTFOLIO MODEL\033[0m : Portfolio optimization finished;")
+        console.debug("Portfolio optimization finished;")
 
         return portfolio_adjustment
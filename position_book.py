@@ -0,0 +1,179 @@
+"""
+This module contains the PositionBook, the Portfolio's own record of the positions of the account.
+
+The book is loaded once from ib.portfolio() and then kept up to date by the events of ib_insync, so the models
+never have to pull and scan the positions from TWS during a cycle:
+
+    execDetailsEvent        every fill changes quantity and average cost immediately
+    positionEvent           the quantity and average cost reported by TWS replace the booked values
+    updatePortfolioEvent    market price, realized PnL and (if the quantity agrees) the average cost
+    pendingTickersEvent     market price of the held stocks from the mid of their quotes
+
+Every event touches a single ticker, so an update takes constant time. The account updates behind
+updatePortfolioEvent can lag behind the fills, therefore they never change the quantity of a position.
+Positions are removed from the book when they are closed, just like from ib.portfolio().
+"""
+import math
+import logger as log
+from tws_connection import ib
+
+console = log.get_console("POSITION BOOK")
+
+
+class Position:
+    """
+    Position of a single stock.
+    """
+    __slots__ = ("ticker", "contract", "quantity", "average_cost", "market_price", "realized_pnl")
+
+    def __init__(self, ticker, contract=None, quantity: float = 0.0, average_cost: float = 0.0,
+                 market_price: float = math.nan, realized_pnl: float = 0.0):
+        self.ticker = ticker
+        self.contract = contract
+        self.quantity = quantity
+        self.average_cost = average_cost
+        self.market_price = market_price
+        self.realized_pnl = realized_pnl
+
+    @property
+    def market_value(self):
+        return self.quantity * self.market_price
+
+    @property
+    def unrealized_pnl(self):
+        """
+        Unrealized PnL at the last market price, as in the PortfolioItems of TWS.
+        """
+        return self.quantity * (self.market_price - self.average_cost)
+
+    def __repr__(self):
+        return f"Position({self.ticker}, {self.quantity} @ {self.average_cost}, market price {self.market_price})"
+
+
+class PositionBook:
+    """
+    Positions of one account by ticker, updated from the fill, position and portfolio events of ib_insync.
+
+    :param account: Only events of this account are booked. None books the events of all accounts.
+    """
+
+    def __init__(self, account: str = None):
+        self.account = account
+        self.positions = {}  # ticker -> Position with a quantity other than 0, in the order they were opened
+        self.executions = set()  # execIds that were booked already
+        self.started = False
+
+    def start(self):
+        if self.started:
+            return
+        ib.execDetailsEvent += self.on_exec_details
+        ib.positionEvent += self.on_position
+        ib.updatePortfolioEvent += self.on_portfolio_item
+        ib.pendingTickersEvent += self.on_pending_tickers
+        self.started = True
+
+    def stop(self):
+        if not self.started:
+            return
+        ib.execDetailsEvent -= self.on_exec_details
+        ib.positionEvent -= self.on_position
+        ib.updatePortfolioEvent -= self.on_portfolio_item
+        ib.pendingTickersEvent -= self.on_pending_tickers
+        self.started = False
+
+    def __contains__(self, ticker):
+        return ticker in self.positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def quantity(self, ticker):
+        position = self.positions.get(ticker)
+        return position.quantity if position is not None else 0
+
+    def quantities(self):
+        """
+        :return: Dictionary ticker -> quantity of all positions in the book.
+        """
+        return {ticker: position.quantity for ticker, position in self.positions.items()}
+
+    def sync(self, portfolio_items):
+        """
+        Replace the book with the positions reported by TWS, e.g. ib.portfolio() at the start.
+        """
+        self.positions = {}
+        for item in portfolio_items:
+            position = self._position(item.contract)
+            position.average_cost = item.averageCost
+            position.market_price = item.marketPrice
+            position.realized_pnl = item.realizedPNL
+            self._set_quantity(position, item.position)
+
+    def _position(self, contract):
+        """
+        The Position of a contract. A new Position is only added to the book once its quantity is set.
+        """
+        position = self.positions.get(contract.symbol)
+        return position if position is not None else Position(contract.symbol, contract)
+
+    def _set_quantity(self, position, quantity):
+        position.quantity = quantity
+        if quantity:
+            self.positions[position.ticker] = position
+        else:
+            self.positions.pop(position.ticker, None)
+
+    def on_exec_details(self, trade, fill):
+        execution = fill.execution
+        if (self.account and execution.acctNumber != self.account) or execution.execId in self.executions:
+            return
+        self.executions.add(execution.execId)
+        position = self._position(fill.contract)
+        signed = execution.shares if execution.side == "BOT" else -execution.shares
+        quantity, price = position.quantity, execution.price
+
+        if quantity == 0 or (quantity > 0) == (signed > 0):
+            position.average_cost = (position.average_cost * abs(quantity) + price * abs(signed)) / (abs(quantity) + abs(signed))
+        else:
+            closed = min(abs(signed), abs(quantity))
+            position.realized_pnl += closed * (price - position.average_cost) * (1 if quantity > 0 else -1)
+            if abs(signed) > abs(quantity):
+                position.average_cost = price  # The position flipped its side.
+        if math.isnan(position.market_price):
+            position.market_price = price
+        self._set_quantity(position, quantity + signed)
+        console.debug("Fill of %s shares of %s booked - position %s;", signed, position.ticker, position.quantity)
+
+    def on_position(self, reported):
+        if self.account and reported.account != self.account:
+            return
+        position = self._position(reported.contract)
+        if position.quantity != reported.position:
+            console.debug("Position of %s corrected from %s to %s by TWS;", position.ticker, position.quantity,
+                          reported.position)
+        position.average_cost = reported.avgCost
+        self._set_quantity(position, reported.position)
+
+    def on_portfolio_item(self, item):
+        if (self.account and item.account != self.account) or item.contract.symbol not in self.positions:
+            return
+        position = self.positions[item.contract.symbol]
+        position.market_price = item.marketPrice
+        position.realized_pnl = item.realizedPNL
+        if item.position == position.quantity:
+            position.average_cost = item.averageCost
+
+    def on_pending_tickers(self, tickers):
+        """
+        Mark the held stocks to the mid of their latest quotes, which is more recent than the account updates.
+        """
+        if not self.positions:
+            return
+        for ticker in tickers:
+            position = self.positions.get(ticker.contract.symbol)
+            if position is None:
+                continue
+            if ticker.bid > 0 and ticker.ask > 0:
+                position.market_price = (ticker.bid + ticker.ask) / 2
+            elif ticker.last > 0:
+                position.market_price = ticker.last
@@ -0,0 +1,163 @@
+"""
+This module replays recorded quotes through the unchanged models with a SimulatedIB instead of TWS.
+
+Usage: python replay.py quotes.csv --pairs AAPL/MSFT:0.5:1.2 GM/TSLA [--speed 0] [--mode EVENT]
+
+Each Pair is given as ticker_a/ticker_b with an optional :const:slope, otherwise (1, 1) is assumed.
+A Basket of more legs is given the same way, e.g. XLK/AAPL/MSFT:0:1.1:0.9 (const and one coefficient per leg after
+the first).
+Instead of a CSV file the directory of a day of the tick recording can be replayed, e.g. ./pairs-trading/ticks/2024-11-21
+(see tick_recorder.py).
+The signals and trades of a replay are logged to REPLAY_DATABASE_NAME, so the trading log used
+to recover the Portfolio on a live start is not touched.
+"""
+import argparse
+import importlib
+import os
+import time
+import constants
+import tws_connection
+from simulated_ib import SimulatedIB, ReplayFinished, load_quotes
+
+_simulated_ib = None
+
+
+def parse_pair(text: str):
+    tickers, _, equation = text.partition(":")
+    tickers = tuple(tickers.split("/"))
+    equation = tuple(float(value) for value in equation.split(":")) if equation else (1.0,) * len(tickers)
+    return tickers, equation
+
+
+def read_quotes(source: str):
+    """
+    Load the quotes of a CSV file or of a day directory of the tick recording.
+    :return: List of tuples (time, symbol, bid, ask, last, bid_size, ask_size) sorted by time.
+    """
+    if not os.path.isdir(source):
+        return load_quotes(source)
+    # The tick_recorder binds the connection on import as well.
+    install_simulation()
+    tick_recorder = importlib.import_module("tick_recorder")
+    source = os.path.normpath(source)
+    return tick_recorder.load_quotes(os.path.basename(source), os.path.dirname(source))
+
+
+def install_simulation(speed: float = 0):
+    """
+    Install one SimulatedIB as the shared connection of this process. Later replays in the same process reuse it,
+    because the models bind the connection when they are imported.
+    """
+    global _simulated_ib
+    if _simulated_ib is None:
+        constants.DATABASE_NAME = constants.REPLAY_DATABASE_NAME
+        # A replay starts from an empty Portfolio and must not overwrite the checkpoint of the live trading.
+        constants.CHECKPOINT_NAME = None
+        _simulated_ib = SimulatedIB([], speed=speed)
+        tws_connection.install(_simulated_ib)
+        _simulated_ib.connect()
+    _simulated_ib.speed = speed
+    return _simulated_ib
+
+
+def run(quotes, pair_specs, speed: float = 0, mode: str = "EVENT",
+        budget: float = constants.BUDGET, slots: int = constants.PAIRS_TRADED, order_type: str = constants.ORDER_TYPE,
+        threshold: float = None, cost_model=None):
+    """
+    Replay quotes through the alpha_model, Portfolio and execution_model.
+    :param quotes: Quotes as returned by simulated_ib.load_quotes.
+    :param pair_specs: List of tuples (tickers, equation), e.g. ((ticker_a, ticker_b), (const, slope)).
+    :param speed: Replay speed, see SimulatedIB.
+    :param mode: "EVENT" or "POLLING" as EVALUATION_MODE in constants.py.
+    :param order_type: "MARKET" or "LIMIT" as ORDER_TYPE in constants.py.
+    :param threshold: Threshold of the THRESHOLD_MODE, by default THRESHOLD or Z_SCORE_THRESHOLD.
+    :param cost_model: transaction_costs.CostModel for the decisions of the Portfolio and the fees of the fills.
+    :return: Dictionary with the statistics of the replay.
+    """
+    simulated_ib = install_simulation(speed)
+    simulated_ib.reset(quotes)
+
+    # The models can only be imported after the simulation is installed.
+    alpha_model = importlib.import_module("alpha_model")
+    data_connector = importlib.import_module("data_connector")
+    execution_model = importlib.import_module("execution_model")
+    order_manager = importlib.import_module("order_manager")
+    instrumentation = importlib.import_module("instrumentation")
+    log = importlib.import_module("logger")
+    portfolio_model = importlib.import_module("portfolio_model")
+    trading_loop = importlib.import_module("trading_loop")
+    transaction_costs = importlib.import_module("transaction_costs")
+
+    os.makedirs(constants.PATH, exist_ok=True)
+    log.initialize_logger()
+
+    # The fees of the simulated fills and the cost estimates of the Portfolio come from the same CostModel.
+    cost_model = cost_model if cost_model is not None else transaction_costs.CostModel()
+    simulated_ib.cost_model = cost_model
+    trading_loop.THRESHOLD = constants.THRESHOLD if threshold is None else threshold
+    trading_loop.Z_SCORE_THRESHOLD = constants.Z_SCORE_THRESHOLD if threshold is None else threshold
+    portfolio = portfolio_model.Portfolio(account_number=simulated_ib.account, slots=slots, budget=budget,
+                                          cost_model=cost_model)
+    # Ignored Signals expire in simulated time, so the replay does not depend on its speed.
+    portfolio.ignored_signals.clock = lambda: simulated_ib.clock
+    # Limit-Orders are repriced in simulated time as well. Orders of an earlier replay are forgotten.
+    execution_model.order_manager.stop()
+    execution_model.order_manager = order_manager.OrderManager(clock=lambda: simulated_ib.clock)
+    execution_model.ORDER_TYPE = order_type
+    pairs = [data_connector.create_basket(tickers, constants.CURRENCY, equation) for tickers, equation in pair_specs]
+    data_connector.connect_pairs(pairs)
+    signal_engine = alpha_model.SignalEngine(pairs)
+
+    start = time.perf_counter()
+    try:
+        if mode == "POLLING":
+            trading_loop.run_polling(signal_engine, portfolio, constants.POLLING_INTERVAL)
+        else:
+            trading_loop.run_event_driven(signal_engine, portfolio, constants.DEBOUNCE_WINDOW)
+    except ReplayFinished:
+        pass
+    elapsed = time.perf_counter() - start
+    log.flush()
+
+    for pair in pairs:
+        pair.disconnect_data()
+    # The PositionBook of this replay must not keep booking the events of a later replay.
+    portfolio.position_book.stop()
+
+    items = simulated_ib.portfolio()
+    fills = simulated_ib.fills()
+    realized_pnl = sum(entry[3] for entry in simulated_ib.positions_.values())
+    unrealized_pnl = sum(item.unrealizedPNL for item in items)
+    return {
+        "ticks": simulated_ib.ticks_replayed,
+        "seconds": elapsed,
+        "ticks_per_second": simulated_ib.ticks_replayed / elapsed if elapsed > 0 else float("inf"),
+        "orders": len(simulated_ib.trades()),
+        "fills": len(fills),
+        "shares_traded": sum(fill.execution.shares for fill in fills),
+        "turnover": sum(fill.execution.shares * fill.execution.price for fill in fills),
+        "commissions": simulated_ib.commissions,
+        "realized_pnl": realized_pnl,
+        "unrealized_pnl": unrealized_pnl,
+        "net_pnl": realized_pnl + unrealized_pnl - simulated_ib.commissions,
+        "positions": {item.contract.symbol: item.position for item in items},
+        # stage -> (count, p50, p99, max) in microseconds since the last export.
+        "latency": instrumentation.summary(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded quotes through the trading models.")
+    parser.add_argument("quotes", help="CSV file with the columns time,symbol,bid,ask,last,bid_size,ask_size "
+                                       "or a day directory of the tick recording")
+    parser.add_argument("--pairs", nargs="+", required=True,
+                        help="Pairs as ticker_a/ticker_b[:const:slope], Baskets with more tickers and coefficients")
+    parser.add_argument("--speed", type=float, default=0, help="0 = as fast as possible, 1 = real time, 10 = ten times faster")
+    parser.add_argument("--mode", choices=("EVENT", "POLLING"), default=constants.EVALUATION_MODE)
+    parser.add_argument("--order-type", choices=("MARKET", "LIMIT"), default=constants.ORDER_TYPE)
+    arguments = parser.parse_args()
+
+    result = run(read_quotes(arguments.quotes), [parse_pair(text) for text in arguments.pairs],
+                 speed=arguments.speed, mode=arguments.mode, order_type=arguments.order_type)
+    for key, value in result.items():
+        print(f"\033[32mREPLAY\033[0m : {key} = {value};")
@@ -0,0 +1,256 @@
+"""
+This module spreads the evaluation of the Pairs over several worker processes.
+
+Every worker connects to TWS with its own client id, subscribes only to the market data of its shard of the Pairs
+and runs its own SignalEngine. The Signals it generates are sent as plain tuples over a multiprocessing queue.
+The coordinator in the main process owns the only Portfolio and the execution: it turns the candidates back into
+Signals of its own Pair objects and runs the rest of the trading cycle. Since the slots are only ever counted in
+the coordinator, the slot allocation is the same as in a single process.
+
+Pairs that share a symbol are kept in the same shard where possible, so a symbol is subscribed by as few
+clients as possible. The quotes of a symbol are recorded only by the first shard that subscribes it.
+"""
+import math
+import multiprocessing
+import queue
+import alpha_model
+import instrumentation
+import logger as log
+import trading_loop
+from tick_recorder import TickRecorder
+from data_connector import connect_pairs, create_basket, wait_for_quotes
+from signal_store import Signal
+from tws_connection import ib, build_connection
+from constants import CLIENT_ID, CURRENCY, DEBOUNCE_WINDOW, EVALUATION_MODE, POLLING_INTERVAL, SHARD_POLL_INTERVAL
+from constants import TICK_PATH
+
+console = log.get_console("SHARDING")
+
+
+def partition(pair_specs, shards: int):
+    """
+    Split the Pairs into shards of at most ceil(len(pair_specs) / shards) Pairs.
+    A Pair goes to the shard that already holds one of its symbols if that shard has room, otherwise to the smallest.
+    :param pair_specs: List of tuples (tickers, equation), e.g. ((ticker_a, ticker_b), (const, slope)).
+    :param shards: Amount of shards.
+    :return: List of lists of pair specs.
+    """
+    capacity = math.ceil(len(pair_specs) / shards)
+    parts = [[] for _ in range(shards)]
+    owner = {}  # symbol -> shard that subscribed it first
+    for spec in pair_specs:
+        tickers = spec[0]
+        shard = next((owner[symbol] for symbol in tickers
+                      if symbol in owner and len(parts[owner[symbol]]) < capacity), None)
+        if shard is None:
+            shard = min(range(shards), key=lambda index: len(parts[index]))
+        parts[shard].append(spec)
+        for symbol in tickers:
+            owner.setdefault(symbol, shard)
+    return parts
+
+
+def to_candidate(signal):
+    """
+    Picklable form of a Signal without its Pair, which holds the live ib_insync objects of the worker.
+    The residual statistics of the Pair are sent along, since only the worker records the quotes of the Pair.
+    """
+    return (signal.tickers, signal.deviation, signal.sign, signal.quotes, signal.equation, signal.threshold,
+            signal.zscore, signal.pair.history.residuals.statistics())
+
+
+def record_owners(parts):
+    """
+    :return: For every shard the set of symbols whose quotes it records, each symbol in exactly one shard.
+    """
+    owned = [set() for _ in parts]
+    seen = set()
+    for index, shard in enumerate(parts):
+        for tickers, _ in shard:
+            for symbol in tickers:
+                if symbol not in seen:
+                    seen.add(symbol)
+                    owned[index].add(symbol)
+    return owned
+
+
+def run_shard(index: int, pair_specs, recorded, candidates, stop):
+    """
+    Body of a worker process. Evaluates its Pairs until stop is set.
+    :param index: Number of the shard. The worker connects with the client id CLIENT_ID + 1 + index.
+    :param pair_specs: List of tuples (tickers, equation), e.g. ((ticker_a, ticker_b), (const, slope)).
+    :param recorded: Symbols whose quotes this worker records, see record_owners.
+    :param candidates: multiprocessing.Queue for batches (index, first_tick, [candidate, ...]).
+    :param stop: multiprocessing.Event to end the worker.
+    """
+    build_connection(CLIENT_ID + 1 + index)
+    recorder = TickRecorder(source=f"shard-{index}", symbols=recorded) if TICK_PATH else None
+    if recorder is not None:
+        recorder.start()
+    pairs = connect_pairs(create_basket(tickers, CURRENCY, equation) for tickers, equation in pair_specs)
+    wait_for_quotes(pairs)
+    signal_engine = alpha_model.SignalEngine(pairs)
+    signal_engine.refresh_quotes()
+    console.info("Shard %s evaluates %s Pairs;", index, len(pairs))
+
+    ib.pendingTickersEvent += signal_engine.on_pending_tickers
+    try:
+        while not stop.is_set():
+            if EVALUATION_MODE == "POLLING":
+                ib.sleep(POLLING_INTERVAL)
+                signal_engine.refresh_quotes()
+                first_tick, rows = None, None
+            else:
+                ib.waitOnUpdate(timeout=SHARD_POLL_INTERVAL)
+                if not signal_engine.dirty_rows:
+                    continue
+                ib.sleep(DEBOUNCE_WINDOW)
+                first_tick, rows = signal_engine.first_tick, signal_engine.pop_dirty_rows()
+            new_signals, _ = trading_loop.evaluate(signal_engine, rows)
+            if new_signals:
+                candidates.put((index, first_tick, [to_candidate(signal) for signal in new_signals.values()]))
+    finally:
+        ib.pendingTickersEvent -= signal_engine.on_pending_tickers
+        # Candidates the coordinator did not take anymore must not keep the worker from exiting.
+        candidates.cancel_join_thread()
+        for pair in pairs:
+            pair.disconnect_data()
+        if recorder is not None:
+            recorder.stop()
+        ib.disconnect()
+
+
+class Coordinator:
+    """
+    Starts the shard workers and feeds their candidates into the Portfolio of the main process.
+    """
+
+    def __init__(self, portfolio, pairs, workers: int):
+        self.portfolio = portfolio
+        self.pairs = {pair.tickers: pair for pair in pairs}  # tickers -> Pair of the coordinator
+        self.workers = workers
+        self.connected = set()  # Pairs that collect connected and release has not disconnected yet.
+        # spawn, because the event loop of ib_insync must not be inherited by a fork.
+        self.context = multiprocessing.get_context("spawn")
+        self.candidates = self.context.Queue()
+        self.stop = self.context.Event()
+        self.processes = []
+
+    def start(self):
+        specs = [(tickers, pair.equation) for tickers, pair in self.pairs.items()]
+        parts = partition(specs, self.workers)
+        for index, (shard, recorded) in enumerate(zip(parts, record_owners(parts))):
+            if not shard:
+                continue
+            process = self.context.Process(target=run_shard, args=(index, shard, recorded, self.candidates, self.stop),
+                                           name=f"shard-{index}", daemon=True)
+            process.start()
+            self.processes.append(process)
+        console.info("%s shard workers started for %s Pairs;", len(self.processes), len(specs))
+
+    def shutdown(self, timeout: float = 10):
+        self.stop.set()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+
+    def reattach(self, candidate):
+        """
+        Turn a candidate of a worker back into a Signal of the Pair object of the coordinator.
+        A Pair the Portfolio already trades (e.g. recovered from the database) is preferred.
+        """
+        tickers, deviation, sign, quotes, equation, threshold, zscore, residuals = candidate
+        pair = self.portfolio.pairs_traded.get(tickers[0])
+        if pair is None or pair.tickers != tickers:
+            pair = self.pairs[tickers]
+        # Sizing uses the equation the worker estimated when the Signal was generated. A followed Pair keeps the
+        # equation it was opened with, so its position is still closed and sized the way it was entered.
+        followed_signals = self.portfolio.followed_signals
+        if not any(ticker in followed_signals and followed_signals[ticker].pair is pair for ticker in tickers):
+            pair.equation = equation
+        # The Pair of the coordinator records no quotes. In the ZSCORE mode an ignored Signal is revalidated
+        # with the z-score of the Pair, so it takes the residual statistics of the worker.
+        pair.history.residuals.adopt(*residuals)
+        return Signal(deviation, sign, pair, quotes, equation, threshold, zscore)
+
+    def collect(self):
+        """
+        Take all waiting batches from the queue.
+        :return: Tuple of the earliest first tick of the batches and the signals in the format of generate_signals.
+        """
+        new_signals = {}
+        first_ticks = []
+        while True:
+            try:
+                index, first_tick, batch = self.candidates.get_nowait()
+            except queue.Empty:
+                break
+            if first_tick is not None:
+                first_ticks.append(first_tick)
+            # A later candidate of the same Pair replaces an earlier one.
+            for candidate in batch:
+                signal = self.reattach(candidate)
+                new_signals[signal.tickers] = signal
+
+        pairs_traded = {}
+        for signal in new_signals.values():
+            for ticker in signal.tickers:
+                pairs_traded[ticker] = signal.pair
+        # Only the Pairs with a Signal need contracts and quotes in the coordinator, e.g. for the execution.
+        self.connected.update(connect_pairs({signal.pair for signal in new_signals.values()}))
+        return (min(first_ticks) if first_ticks else None), (new_signals, pairs_traded)
+
+    def release(self):
+        """
+        Disconnect the Pairs collect connected that the Portfolio does not need anymore, so the coordinator
+        does not keep the market data lines of every Pair that was ever signalled. A Pair is still needed while
+        it is followed, while the Portfolio trades one of its held stocks through it or while it has an ignored
+        Signal that optimize may take as a replacement.
+        """
+        held = self.portfolio.position_book.positions.keys() | self.portfolio.followed_signals.keys()
+        for pair in [pair for pair in self.connected if not self._needed(pair, held)]:
+            pair.disconnect_data()
+            self.connected.discard(pair)
+
+    def _needed(self, pair, held):
+        portfolio = self.portfolio
+        for ticker in pair.tickers:
+            # The execution finds the contract of a held stock through pairs_traded.
+            if ticker in held and portfolio.pairs_traded.get(ticker) is pair:
+                return True
+            for signal in (portfolio.followed_signals.get(ticker), portfolio.ignored_signals.get(ticker)):
+                if signal is not None and signal.pair is pair:
+                    return True
+        return False
+
+    def check_workers(self):
+        for process in self.processes:
+            if not process.is_alive():
+                raise RuntimeError(f"Shard worker {process.name} stopped with exit code {process.exitcode}")
+
+
+def run_sharded(portfolio, pairs, workers: int):
+    """
+    Trading loop of the sharded mode. The coordinator keeps serving its own connection while it waits for candidates.
+    :param portfolio: The Portfolio of the main process.
+    :param pairs: All Pairs of the universe. They do not have to be connected.
+    :param workers: Amount of worker processes.
+    """
+    coordinator = Coordinator(portfolio, pairs, workers)
+    coordinator.start()
+    try:
+        while True:
+            ib.waitOnUpdate(timeout=SHARD_POLL_INTERVAL)
+            coordinator.check_workers()
+            first_tick, signals = coordinator.collect()
+            if not signals[0]:
+                continue
+            # The workers generated the Signals already, so the cycle reaches tick_to_signal with their arrival.
+            instrumentation.start_cycle(first_tick)
+            instrumentation.since_cycle("tick_to_signal")
+            trading_loop.portfolio_cycle(portfolio, signals)
+            coordinator.release()
+    finally:
+        coordinator.shutdown()
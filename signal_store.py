@@ -0,0 +1,217 @@
+"""
+This module contains the records the models use to pass Signals around and the book of ignored Signals.
+
+A Signal only keeps a snapshot of the quotes it was generated from (bid, ask, last and time) instead
+of a copy of the ib_insync Tickers. Ignored Signals expire after a while and their amount is bounded,
+so the memory of the Portfolio stays flat over a trading day.
+"""
+import heapq
+import itertools
+import math
+import time
+
+
+class QuoteSnapshot:
+    """
+    The part of an ib_insync Ticker a Signal needs to remember.
+    """
+    __slots__ = ("bid", "ask", "last", "time")
+
+    def __init__(self, bid: float, ask: float, last: float, time=None):
+        self.bid = bid
+        self.ask = ask
+        self.last = last
+        self.time = time
+
+    @classmethod
+    def from_ticker(cls, ticker):
+        if ticker is None:
+            return cls(math.nan, math.nan, math.nan)
+        return cls(ticker.bid, ticker.ask, ticker.last, ticker.time)
+
+    def __repr__(self):
+        return f"QuoteSnapshot(bid={self.bid}, ask={self.ask}, last={self.last}, time={self.time})"
+
+
+class Signal:
+    """
+    A trading opportunity of a Basket (or Pair) as detected by the alpha_model.
+
+    :param deviation: The absolute delta of the first leg from its estimate, the expected return.
+    :param sign: The sign of the delta, which determines the direction of the trade.
+    :param pair: The Basket or Pair the Signal belongs to.
+    :param quotes: Tuple with one QuoteSnapshot per leg when the Signal was generated, or None.
+    :param equation: The equation (const, coefficient_1, ...) the delta was calculated with.
+    :param threshold: The threshold the Signal crossed.
+    :param zscore: True if the threshold was compared with the z-score of the delta instead of the delta.
+    """
+    __slots__ = ("deviation", "sign", "pair", "quotes", "equation", "threshold", "zscore", "created")
+
+    def __init__(self, deviation, sign, pair, quotes, equation, threshold, zscore=False):
+        self.deviation = deviation
+        self.sign = sign
+        self.pair = pair
+        self.quotes = quotes
+        self.equation = equation
+        self.threshold = threshold
+        self.zscore = zscore
+        self.created = None  # Set by the SignalBook.
+
+    @property
+    def tickers(self):
+        return self.pair.tickers
+
+    def __repr__(self):
+        return f"Signal({self.pair.tickers}, deviation={self.deviation}, sign={self.sign})"
+
+
+def live_signal(pair, threshold: float, zscore: bool = False):
+    """
+    Evaluate a Basket against the threshold with its live quotes and equation, like the alpha_model does.
+    :return: A new Signal or None if the Basket does not cross the threshold (anymore).
+    """
+    if pair.quotes[0] is None:
+        return None
+    equation = pair.equation
+    estimate = equation[0]
+    for leg in range(1, len(equation)):
+        estimate += equation[leg] * pair.quotes[leg].ask
+    if not estimate:
+        return None
+    delta = (pair.quotes[0].ask - estimate) / estimate
+    score = pair.history.residuals.zscore(delta) if zscore else delta
+    if not score > threshold:
+        return None
+    return Signal(abs(delta), math.copysign(1, delta), pair,
+                  tuple(map(QuoteSnapshot.from_ticker, pair.quotes)), equation, threshold, zscore)
+
+
+class SignalBook:
+    """
+    The Signals the Portfolio had to ignore, indexed by ticker and ordered by deviation.
+
+    Each Signal is stored once per ticker in the index and once in a max-heap of (-deviation, sequence, Signal)
+    entries. Entries whose Signal left the book are stale and dropped lazily. Signals older than ttl seconds
+    are expired and, if more than max_size Signals are stored, the oldest ones are evicted. Before a Signal
+    older than revalidate_after seconds is handed out as a replacement, it is checked against the live quotes.
+
+    :param clock: Function returning the current time in seconds, time.monotonic by default.
+    """
+
+    def __init__(self, ttl: float, max_size: int, revalidate_after: float, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.revalidate_after = revalidate_after
+        self.clock = clock
+        self.index = {}  # ticker -> Signal
+        self.signals = {}  # id(Signal) -> Signal in the order they were added, the oldest first.
+        self.heap = []
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.signals)
+
+    def __bool__(self):
+        return bool(self.signals)
+
+    def __contains__(self, signal):
+        return id(signal) in self.signals
+
+    def get(self, ticker, default=None):
+        return self.index.get(ticker, default)
+
+    def values(self):
+        return list(self.signals.values())
+
+    def add(self, signal):
+        """
+        Store a Signal. A Signal that was stored before for one of its tickers is replaced.
+        """
+        for ticker in signal.tickers:
+            previous = self.index.get(ticker)
+            if previous is not None and previous is not signal:
+                self.remove(previous)
+        self.signals.pop(id(signal), None)
+
+        signal.created = self.clock()
+        self.signals[id(signal)] = signal
+        for ticker in signal.tickers:
+            self.index[ticker] = signal
+        heapq.heappush(self.heap, (-signal.deviation, next(self._sequence), signal))
+
+        while len(self.signals) > self.max_size:
+            self.remove(next(iter(self.signals.values())))
+        if len(self.heap) > 2 * len(self.signals) + 64:
+            self._compact()
+
+    def remove(self, signal):
+        if self.signals.pop(id(signal), None) is None:
+            return
+        for ticker in signal.tickers:
+            if self.index.get(ticker) is signal:
+                del self.index[ticker]
+
+    def expire(self):
+        """
+        Remove all Signals older than the ttl.
+        """
+        oldest = self.clock() - self.ttl
+        while self.signals:
+            signal = next(iter(self.signals.values()))
+            if signal.created > oldest:
+                break
+            self.remove(signal)
+
+    def best_replacement(self, symbols, blocked):
+        """
+        Return the Signal with the highest deviation that involves no stock of symbols, or None.
+        Entries that overlap symbols are moved from the heap to blocked, so each entry is looked at only once
+        per optimization. They have to be handed back with restore afterwards.
+        """
+        while self.heap:
+            deviation, _, signal = self.heap[0]
+            if id(signal) not in self.signals or -deviation != signal.deviation:
+                heapq.heappop(self.heap)
+                continue
+            if any(ticker in symbols for ticker in signal.tickers):
+                blocked.append(heapq.heappop(self.heap))
+                continue
+            if self.clock() - signal.created > self.revalidate_after:
+                heapq.heappop(self.heap)
+                self._revalidate(signal)
+                continue
+            return signal
+        return None
+
+    def best_replacements(self, symbols, blocked, count: int):
+        """
+        Return up to count Signals in the order best_replacement hands them out if each of them is taken,
+        e.g. to size them all at once. The Signals stay in the book.
+        """
+        signals = []
+        taken = []
+        while len(signals) < count:
+            signal = self.best_replacement(symbols, blocked)
+            if signal is None:
+                break
+            signals.append(signal)
+            taken.append(heapq.heappop(self.heap))
+        for entry in taken:
+            heapq.heappush(self.heap, entry)
+        return signals
+
+    def restore(self, blocked):
+        for entry in blocked:
+            heapq.heappush(self.heap, entry)
+        blocked.clear()
+
+    def _revalidate(self, signal):
+        # The Signal is replaced by a fresh one if the Pair still crosses the threshold, otherwise it is dropped.
+        self.remove(signal)
+        fresh = live_signal(signal.pair, signal.threshold, signal.zscore)
+        if fresh is not None:
+            self.add(fresh)
+
+    def _compact(self):
+        self.heap = [entry for entry in self.heap if id(entry[2]) in self.signals and -entry[0] == entry[2].deviation]
+        heapq.heapify(self.heap)
@@ -0,0 +1,387 @@
+"""
+This module contains a local stand-in for the ib_insync.IB connection to TWS.
+
+The SimulatedIB replays recorded quotes instead of receiving them from TWS and fills orders against
+those quotes. It offers the part of the IB interface the models use, so the unchanged alpha_model,
+Portfolio and execution_model can run without a broker. The simulated clock only moves in sleep
+and waitOnUpdate, which makes every replay of the same file deterministic.
+
+Quote files are CSV files with the header time,symbol,bid,ask,last,bid_size,ask_size
+where time is a UNIX timestamp in seconds. Quotes that are already stored in a NumPy array can be replayed
+through a QuoteArray without turning them into a list first.
+"""
+import csv
+import datetime
+import itertools
+import math
+import time
+import ib_insync
+from transaction_costs import CostModel
+
+
+class ReplayFinished(Exception):
+    """
+    Raised by sleep and waitOnUpdate when all quotes were replayed and nothing is left to happen.
+    """
+
+
+def load_quotes(path: str):
+    """
+    Read a quote file.
+    :param path: Path of the CSV file.
+    :return: List of tuples (time, symbol, bid, ask, last, bid_size, ask_size) sorted by time.
+    """
+    with open(path, newline="") as file:
+        quotes = [(float(row["time"]), row["symbol"], float(row["bid"]), float(row["ask"]), float(row["last"] or "nan"),
+                   float(row["bid_size"] or "nan"), float(row["ask_size"] or "nan"))
+                  for row in csv.DictReader(file)]
+    quotes.sort(key=lambda quote: quote[0])
+    return quotes
+
+
+class QuoteArray:
+    """
+    Quotes in a structured NumPy array, e.g. a read-only memory map that several processes share.
+    A record is only turned into a quote tuple when it is replayed, so the array is never copied.
+
+    :param records: Array with the fields time, symbol, bid, ask, last, bid_size and ask_size in this order,
+                    sorted by time. symbol is the index of the symbol in symbols.
+    :param symbols: List of the symbols.
+    """
+    __slots__ = ("records", "symbols")
+
+    def __init__(self, records, symbols):
+        self.records = records
+        self.symbols = list(symbols)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        timestamp, symbol, bid, ask, last, bid_size, ask_size = self.records[index].item()
+        return timestamp, self.symbols[symbol], bid, ask, last, bid_size, ask_size
+
+
+class SimulatedIB:
+    """
+    Replays quotes and simulates fills, positions and the portfolio of one account.
+
+    :param quotes: List of tuples (time, symbol, bid, ask, last, bid_size, ask_size) sorted by time or a QuoteArray.
+    :param speed: 0 replays as fast as possible, 1 in real time and any other value that many times faster.
+    :param account: Account number reported in positions and fills.
+    The fees of the fills are calculated by cost_model and can be changed by replacing it.
+    """
+    events = ib_insync.IB.events
+
+    def __init__(self, quotes, speed: float = 0, account: str = "REPLAY"):
+        for name in self.events:
+            setattr(self, name, ib_insync.Event(name))
+
+        self.speed = speed
+        self.account = account
+        self.connected = False
+        self.tickers = {}  # symbol -> subscribed ib_insync Ticker
+        self.contract_ids = {}
+        self.cost_model = CostModel()  # Fees charged for each fill.
+        self.reset(quotes)
+
+    def reset(self, quotes):
+        """
+        Start a new replay of the given quotes with an empty account. Subscriptions are kept.
+        """
+        self.quotes = quotes
+        self.cursor = 0  # Index of the next quote to replay.
+        self.clock = quotes[0][0] if quotes else 0.0
+
+        self.latest = {}  # symbol -> latest quote, also for symbols without subscription
+        self.positions_ = {}  # symbol -> [contract, position, average cost, realized pnl]
+        self.trades_ = []
+        self.working = []  # Trades that are not done yet.
+        self.order_ids = itertools.count(1)
+
+        self.ticks_replayed = 0
+        self.commissions = 0.0
+        self._wall_start = None
+
+    # Connection
+    # ----------
+
+    def connect(self, host="127.0.0.1", port=7497, clientId=1, timeout=4, readonly=False, account=""):
+        self.connected = True
+        self.connectedEvent.emit()
+        return self
+
+    def disconnect(self):
+        self.connected = False
+        self.disconnectedEvent.emit()
+
+    def isConnected(self):
+        return self.connected
+
+    # Contracts and market data
+    # -------------------------
+
+    def qualifyContracts(self, *contracts):
+        for contract in contracts:
+            contract.conId = self.contract_ids.setdefault(contract.symbol, len(self.contract_ids) + 1)
+            contract.primaryExchange = contract.primaryExchange or "SIMULATED"
+        return list(contracts)
+
+    async def qualifyContractsAsync(self, *contracts):
+        return self.qualifyContracts(*contracts)
+
+    def reqMarketDataType(self, marketDataType):
+        pass
+
+    def reqMktData(self, contract, genericTickList="", snapshot=False, regulatorySnapshot=False, mktDataOptions=None):
+        ticker = self.tickers.get(contract.symbol)
+        if ticker is None:
+            ticker = ib_insync.Ticker(contract=contract)
+            self.tickers[contract.symbol] = ticker
+            if contract.symbol in self.latest:
+                self._update_ticker(ticker, self.latest[contract.symbol])
+        return ticker
+
+    def cancelMktData(self, contract):
+        self.tickers.pop(contract.symbol, None)
+
+    def ticker(self, contract):
+        return self.tickers.get(contract.symbol)
+
+    # Orders
+    # ------
+
+    def placeOrder(self, contract, order):
+        if not order.orderId:
+            order.orderId = next(self.order_ids)
+        for trade in self.working:
+            if trade.order.orderId == order.orderId:
+                # Modification of a working order, e.g. a new limit price.
+                trade.order = order
+                self.orderModifyEvent.emit(trade)
+                return trade
+
+        status = ib_insync.OrderStatus(orderId=order.orderId, status="Submitted", remaining=order.totalQuantity)
+        trade = ib_insync.Trade(contract, order, status)
+        self.trades_.append(trade)
+        self.working.append(trade)
+        self.newOrderEvent.emit(trade)
+        return trade
+
+    def cancelOrder(self, order, manualCancelOrderTime=""):
+        for trade in self.working:
+            if trade.order.orderId == order.orderId:
+                self.working.remove(trade)
+                trade.orderStatus.status = "Cancelled"
+                self._emit_status(trade)
+                self.cancelOrderEvent.emit(trade)
+                return trade
+        return None
+
+    def trades(self):
+        return list(self.trades_)
+
+    def openTrades(self):
+        return list(self.working)
+
+    def fills(self):
+        return [fill for trade in self.trades_ for fill in trade.fills]
+
+    # Account
+    # -------
+
+    def positions(self, account=""):
+        return [ib_insync.Position(self.account, contract, position, average_cost)
+                for contract, position, average_cost, _ in self.positions_.values() if position != 0]
+
+    def portfolio(self, account=""):
+        return [self._portfolio_item(symbol) for symbol, entry in self.positions_.items() if entry[1] != 0]
+
+    def managedAccounts(self):
+        return [self.account]
+
+    # Event loop
+    # ----------
+
+    def sleep(self, *seconds):
+        """
+        Advance the simulated clock by the given seconds and replay all quotes in between.
+        """
+        target = self.clock + (seconds[0] if seconds else 0)
+        if self.cursor >= len(self.quotes) and not self.working:
+            raise ReplayFinished()
+        self._match_orders()
+        while self.cursor < len(self.quotes) and self.quotes[self.cursor][0] <= target:
+            self._replay_next()
+        self.clock = max(self.clock, target)
+        self._pace(self.clock)
+        return True
+
+    def waitOnUpdate(self, timeout: float = 0):
+        """
+        Replay the quotes of the next point in time. With a timeout the clock moves at most timeout seconds.
+        :return: False if the timeout passed without an update.
+        """
+        if self._match_orders():
+            return True
+        if self.cursor >= len(self.quotes):
+            raise ReplayFinished()
+        if timeout and self.quotes[self.cursor][0] > self.clock + timeout:
+            self.clock += timeout
+            self._pace(self.clock)
+            return False
+        self._replay_next()
+        return True
+
+    def run(self, *awaitables, timeout=None):
+        return ib_insync.util.run(*awaitables, timeout=timeout)
+
+    # Internals
+    # ---------
+
+    def _pace(self, simulated_time):
+        if not self.speed or not self.quotes:
+            return
+        if self._wall_start is None:
+            self._wall_start = time.monotonic()
+        wait = self._wall_start + (simulated_time - self.quotes[0][0]) / self.speed - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _replay_next(self):
+        """
+        Replay all quotes with the timestamp of the next quote, fill what can be filled and emit the ticked Tickers.
+        """
+        now = self.quotes[self.cursor][0]
+        self._pace(now)
+        self.clock = max(self.clock, now)
+
+        pending = set()
+        while self.cursor < len(self.quotes) and self.quotes[self.cursor][0] == now:
+            quote = self.quotes[self.cursor]
+            self.cursor += 1
+            self.ticks_replayed += 1
+            self.latest[quote[1]] = quote
+            ticker = self.tickers.get(quote[1])
+            if ticker is not None:
+                self._update_ticker(ticker, quote)
+                pending.add(ticker)
+
+        self._match_orders()
+        if pending:
+            self.pendingTickersEvent.emit(pending)
+        self.updateEvent.emit()
+
+    @staticmethod
+    def _update_ticker(ticker, quote):
+        timestamp, _, bid, ask, last, bid_size, ask_size = quote
+        ticker.time = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+        ticker.prevBid, ticker.prevAsk, ticker.prevLast = ticker.bid, ticker.ask, ticker.last
+        ticker.bid, ticker.ask, ticker.last = bid, ask, last
+        ticker.bidSize, ticker.askSize = bid_size, ask_size
+
+    def _match_orders(self):
+        """
+        Fill all working orders that are marketable at the latest quotes.
+        Market orders are filled completely, limit orders at most with the displayed size.
+        :return: True if anything was filled.
+        """
+        filled_any = False
+        for trade in list(self.working):
+            quote = self.latest.get(trade.contract.symbol)
+            if quote is None:
+                continue
+            _, _, bid, ask, _, bid_size, ask_size = quote
+            order = trade.order
+            buy = order.action == "BUY"
+            price = ask if buy else bid
+            if not price > 0:
+                continue
+
+            remaining = order.totalQuantity - trade.orderStatus.filled
+            if order.orderType == "LMT":
+                if (buy and price > order.lmtPrice) or (not buy and price < order.lmtPrice):
+                    continue
+                size = ask_size if buy else bid_size
+                shares = min(remaining, size) if size > 0 else remaining
+            else:
+                shares = remaining
+
+            self._fill(trade, shares, price)
+            filled_any = True
+        return filled_any
+
+    def _fill(self, trade, shares, price):
+        contract = trade.contract
+        order = trade.order
+        status = trade.orderStatus
+        now = datetime.datetime.fromtimestamp(self.clock, datetime.timezone.utc)
+
+        signed = shares if order.action == "BUY" else -shares
+        # Commission and regulatory fees, as in the commission reports of TWS.
+        fee = float(self.cost_model.order_cost(signed, price))
+        self.commissions += fee
+        realized = self._book_position(contract, signed, price)
+
+        status.avgFillPrice = (status.avgFillPrice * status.filled + price * shares) / (status.filled + shares)
+        status.filled += shares
+        status.remaining = order.totalQuantity - status.filled
+        status.lastFillPrice = price
+        status.status = "Filled" if status.remaining <= 0 else "Submitted"
+
+        execution = ib_insync.Execution(execId=f"{order.orderId}.{len(trade.fills) + 1}", time=now, acctNumber=self.account,
+                                        exchange="SIMULATED", side="BOT" if signed > 0 else "SLD", shares=shares,
+                                        price=price, orderId=order.orderId, cumQty=status.filled, avgPrice=status.avgFillPrice)
+        report = ib_insync.CommissionReport(execId=execution.execId, commission=fee, currency=contract.currency,
+                                            realizedPNL=realized)
+        fill = ib_insync.Fill(contract, execution, report, now)
+        trade.fills.append(fill)
+
+        if status.remaining <= 0:
+            self.working.remove(trade)
+        self.execDetailsEvent.emit(trade, fill)
+        self.commissionReportEvent.emit(trade, fill, report)
+        trade.fillEvent.emit(trade, fill)
+        self._emit_status(trade)
+
+        entry = self.positions_[contract.symbol]
+        self.positionEvent.emit(ib_insync.Position(self.account, contract, entry[1], entry[2]))
+        self.updatePortfolioEvent.emit(self._portfolio_item(contract.symbol))
+
+    def _emit_status(self, trade):
+        trade.statusEvent.emit(trade)
+        if trade.orderStatus.status == "Filled":
+            trade.filledEvent.emit(trade)
+        elif trade.orderStatus.status == "Cancelled":
+            trade.cancelledEvent.emit(trade)
+        self.orderStatusEvent.emit(trade)
+
+    def _book_position(self, contract, signed, price):
+        """
+        Add a fill to the position of the contract.
+        :return: The realized PnL of the part of the fill that reduced the position.
+        """
+        entry = self.positions_.setdefault(contract.symbol, [contract, 0.0, 0.0, 0.0])
+        _, position, average_cost, _ = entry
+        realized = 0.0
+        if position == 0 or (position > 0) == (signed > 0):
+            entry[2] = (average_cost * abs(position) + price * abs(signed)) / (abs(position) + abs(signed))
+        else:
+            closed = min(abs(signed), abs(position))
+            realized = closed * (price - average_cost) * (1 if position > 0 else -1)
+            if abs(signed) > abs(position):
+                entry[2] = price  # The position flipped its side.
+        entry[1] = position + signed
+        entry[3] += realized
+        return realized
+
+    def _portfolio_item(self, symbol):
+        contract, position, average_cost, realized = self.positions_[symbol]
+        quote = self.latest.get(symbol)
+        market_price = math.nan
+        if quote is not None:
+            market_price = (quote[2] + quote[3]) / 2 if quote[2] > 0 and quote[3] > 0 else quote[4]
+        market_value = position * market_price
+        unrealized = market_value - position * average_cost
+        return ib_insync.PortfolioItem(contract, position, market_price, market_value, average_cost,
+                                       unrealized, realized, self.account)
@@ -0,0 +1,166 @@
+"""
+This module replays recorded quotes for every combination of a grid of parameters and collects the results in one table.
+
+Usage: python sweep.py quotes.csv --pairs AAPL/MSFT GM/TSLA --threshold 0 0.005 0.01 --slots 5 10
+                      [--budget 100000 500000] [--cost-per_share 0.005 0.0035] [--workers 8] [--output results.csv]
+
+Every value of THRESHOLD (or Z_SCORE_THRESHOLD in the ZSCORE mode), PAIRS_TRADED, BUDGET and of each parameter
+of transaction_costs.CostModel (--cost-<parameter>) can be given as a list; parameters that are not given keep
+their value from constants.py. Each combination is a complete replay (see replay.py) of the same quotes.
+
+The replays run in a pool of worker processes. The quotes are converted once into a NumPy file that every worker
+maps read-only, so the price data is shared instead of being parsed or sent to each worker. Every worker logs to its
+own database in a temporary directory, which is removed at the end.
+"""
+import argparse
+import csv
+import inspect
+import itertools
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import constants
+import replay
+from simulated_ib import QuoteArray
+from transaction_costs import CostModel
+
+QUOTE_DTYPE = np.dtype([("time", "<f8"), ("symbol", "<i4"), ("bid", "<f8"), ("ask", "<f8"), ("last", "<f8"),
+                        ("bid_size", "<f8"), ("ask_size", "<f8")])
+
+# Parameters of the CostModel that can be swept, in the order of its signature.
+COST_PARAMETERS = list(inspect.signature(CostModel).parameters)
+
+# Columns of the results table after the parameters.
+RESULTS = ("net_pnl", "realized_pnl", "unrealized_pnl", "commissions", "turnover", "shares_traded", "orders",
+           "fills", "seconds")
+
+# State of each worker process, set once by _initialize_worker.
+_quotes = None
+_pair_specs = None
+
+
+def write_quotes(quotes, path: str):
+    """
+    Store quotes as an array of QUOTE_DTYPE, with the symbols replaced by their index.
+    :return: The list of symbols.
+    """
+    symbols = sorted({quote[1] for quote in quotes})
+    index = {symbol: number for number, symbol in enumerate(symbols)}
+    records = np.empty(len(quotes), dtype=QUOTE_DTYPE)
+    for field, column in zip(QUOTE_DTYPE.names, zip(*quotes)):
+        records[field] = [index[symbol] for symbol in column] if field == "symbol" else column
+    np.save(path, records)
+    return symbols
+
+
+def read_quotes(path: str, symbols):
+    """
+    Map a file of write_quotes read-only. The SimulatedIB replays the mapped records directly, so the quotes
+    stay in the page cache that all workers share instead of being copied into every process.
+    """
+    return QuoteArray(np.load(path, mmap_mode="r"), symbols)
+
+
+def grid(thresholds, slots, budgets, costs):
+    """
+    All combinations of the parameters.
+    :param costs: Dictionary CostModel parameter -> list of values.
+    :return: List of dictionaries with the keys threshold, slots, budget and the CostModel parameters.
+    """
+    names = ["threshold", "slots", "budget"] + list(costs)
+    return [dict(zip(names, values)) for values in itertools.product(thresholds, slots, budgets, *costs.values())]
+
+
+def _initialize_worker(quote_path, symbols, pair_specs, directory):
+    global _quotes, _pair_specs
+    # Every worker writes its own trading log, next to the shared quotes.
+    constants.PATH = directory + os.sep
+    constants.REPLAY_DATABASE_NAME = f"sweep-{os.getpid()}.db"
+    # The replays of a sweep would flood the terminal with the messages of the models.
+    logging.disable(logging.INFO)
+    replay.install_simulation()
+    _quotes = read_quotes(quote_path, symbols)
+    _pair_specs = pair_specs
+
+
+def _run_configuration(configuration):
+    costs = {name: configuration[name] for name in COST_PARAMETERS if name in configuration}
+    result = replay.run(_quotes, _pair_specs, budget=configuration["budget"], slots=configuration["slots"],
+                        threshold=configuration["threshold"], cost_model=CostModel(**costs))
+    return {**configuration, **{column: result[column] for column in RESULTS}}
+
+
+def run_sweep(quotes, pair_specs, configurations, workers: int = None):
+    """
+    Replay the quotes once per configuration.
+    :param quotes: Quotes as returned by simulated_ib.load_quotes.
+    :param pair_specs: List of tuples (tickers, equation), e.g. ((ticker_a, ticker_b), (const, slope)).
+    :param configurations: List of dictionaries as returned by grid.
+    :param workers: Amount of worker processes. Defaults to the number of CPUs.
+    :return: List of result dictionaries (the configuration and the RESULTS), the highest net PnL first.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(configurations))
+    directory = tempfile.mkdtemp(prefix="sweep-")
+    try:
+        quote_path = os.path.join(directory, "quotes.npy")
+        symbols = write_quotes(quotes, quote_path)
+        # spawn, so no worker inherits the connection or the event loop of this process.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_initialize_worker,
+                                 initargs=(quote_path, symbols, pair_specs, directory)) as pool:
+            results = list(pool.map(_run_configuration, configurations))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    results.sort(key=lambda result: result["net_pnl"], reverse=True)
+    return results
+
+
+def print_table(results):
+    if not results:
+        return
+    columns = list(results[0])
+    rows = [[f"{value:.6g}" if isinstance(value, float) else str(value) for value in result.values()]
+            for result in results]
+    widths = [max(len(column), *(len(row[number]) for row in rows)) for number, column in enumerate(columns)]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded quotes for a grid of parameters.")
+    parser.add_argument("quotes", help="CSV file or day directory of the tick recording, see replay.py")
+    parser.add_argument("--pairs", nargs="+", required=True,
+                        help="Pairs as ticker_a/ticker_b[:const:slope], Baskets with more tickers and coefficients")
+    parser.add_argument("--threshold", nargs="+", type=float, default=[None],
+                        help="Thresholds of THRESHOLD_MODE, by default THRESHOLD or Z_SCORE_THRESHOLD")
+    parser.add_argument("--slots", nargs="+", type=int, default=[constants.PAIRS_TRADED])
+    parser.add_argument("--budget", nargs="+", type=float, default=[constants.BUDGET])
+    for name in COST_PARAMETERS:
+        parser.add_argument(f"--cost-{name}", nargs="+", type=float, dest=f"cost_{name}",
+                            help=f"Values of the CostModel parameter {name}")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", help="Write the results table to this CSV file")
+    arguments = parser.parse_args()
+
+    cost_grid = {name: getattr(arguments, f"cost_{name}") for name in COST_PARAMETERS
+                 if getattr(arguments, f"cost_{name}") is not None}
+    configurations = grid(arguments.threshold, arguments.slots, arguments.budget, cost_grid)
+
+    start = time.perf_counter()
+    results = run_sweep(replay.read_quotes(arguments.quotes), [replay.parse_pair(text) for text in arguments.pairs],
+                        configurations, arguments.workers)
+    elapsed = time.perf_counter() - start
+
+    print_table(results)
+    print(f"\033[32mSWEEP\033[0m : {len(results)} configurations in {elapsed:.1f} seconds;")
+    if arguments.output:
+        with open(arguments.output, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
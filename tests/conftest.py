@@ -0,0 +1,48 @@
+"""
+The modules of the project are flat and import each other by name, as when the program is started from the
+root of the repository. The tests do the same.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import checkpoint  # noqa: E402
+import data_connector  # noqa: E402
+import execution_model  # noqa: E402
+import instrumentation  # noqa: E402
+import logger  # noqa: E402
+import order_manager  # noqa: E402
+import portfolio_model  # noqa: E402
+import position_book  # noqa: E402
+from simulated_ib import SimulatedIB  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def discard_latencies():
+    # The latencies measured by a test must not be exported into the trading log when the tests end.
+    yield
+    instrumentation.histograms.clear()
+
+
+@pytest.fixture
+def simulated_ib(quotes, tmp_path, monkeypatch):
+    """
+    A SimulatedIB with the quotes of the test module instead of TWS, replayed up to the first timestamp.
+    The trading log is written to a temporary database and no checkpoint is read or written.
+    """
+    simulated = SimulatedIB(quotes)
+    simulated.connect()
+    for module in (data_connector, execution_model, order_manager, portfolio_model, position_book):
+        monkeypatch.setattr(module, "ib", simulated)
+    monkeypatch.setattr(data_connector, "all_data", {})
+    monkeypatch.setattr(execution_model, "order_manager", order_manager.OrderManager(clock=lambda: simulated.clock))
+    monkeypatch.setattr(checkpoint, "CHECKPOINT_NAME", None)
+    monkeypatch.setattr(logger, "PATH", str(tmp_path) + "/")
+    monkeypatch.setattr(logger, "DATABASE_NAME", "trading_log.db")
+    logger.initialize_logger()
+    simulated.sleep(0)
+    yield simulated
+    execution_model.order_manager.stop()
+    logger.shutdown_logger()
@@ -0,0 +1,106 @@
+import math
+import random
+import ib_insync
+import pytest
+import alpha_model
+from data_connector import Pair, create_basket
+
+
+def quote(symbol, ask):
+    return ib_insync.Ticker(contract=ib_insync.Stock(symbol, "SMART", "USD"), bid=ask - 0.01, ask=ask, last=ask)
+
+
+def online_pair(price_a, price_b):
+    pair = Pair(("AAA", "BBB"), "USD", (0.0, price_a / price_b), online=True)
+    pair.quotes_a, pair.quotes_b = quote("AAA", price_a), quote("BBB", price_b)
+    return pair
+
+
+def tick(signal_engine, ticker, ask):
+    ticker.ask = ask
+    signal_engine.on_pending_tickers({ticker})
+    return signal_engine.pop_dirty_rows()
+
+
+def test_jump_of_price_a_produces_the_full_delta():
+    pair = online_pair(100.0, 50.0)
+    signal_engine = alpha_model.SignalEngine([pair])
+    signal_engine.refresh_quotes()
+    signal_engine.generate_signals(threshold=0.01)
+
+    # Warm up the estimator with a stable relationship.
+    for step in range(50):
+        price_b = 50.0 + 0.1 * (step % 5)
+        pair.quotes_a.ask = 2.0 * price_b
+        signal_engine.generate_signals(threshold=0.01, rows=tick(signal_engine, pair.quotes_b, price_b))
+
+    const, slope = pair.equation
+    estimate = const + slope * pair.quotes_b.ask
+    jump = estimate * 1.05
+    new_signals, pairs_traded = signal_engine.generate_signals(threshold=0.01,
+                                                               rows=tick(signal_engine, pair.quotes_a, jump))
+
+    signal = new_signals[("AAA", "BBB")]
+    assert signal.deviation == pytest.approx(0.05)
+    assert signal.deviation == pytest.approx(pair.history.residuals.last())
+    assert signal.equation == pytest.approx((const, slope))
+    assert pairs_traded == {"AAA": pair, "BBB": pair}
+    # The estimator learns the jump only after the evaluation.
+    assert pair.equation != pytest.approx((const, slope))
+    assert not pair.observations
+
+
+def test_equation_is_not_updated_without_new_quotes():
+    pair = online_pair(100.0, 50.0)
+    signal_engine = alpha_model.SignalEngine([pair])
+    signal_engine.refresh_quotes()
+    signal_engine.generate_signals(threshold=0.01)
+    equation = pair.equation
+
+    signal_engine.generate_signals(threshold=0.01)
+
+    assert pair.equation == equation
+    assert tuple(signal_engine.coefficients[0]) == (equation[1],)
+
+
+def random_universe(generator, count):
+    symbols = [f"S{number}" for number in range(count // 2)]
+    quotes = {}
+    for symbol in symbols:
+        ask = generator.uniform(5.0, 200.0)
+        # Some stocks have no quotes yet.
+        ask = math.nan if generator.random() < 0.1 else ask
+        quotes[symbol] = ib_insync.Ticker(contract=ib_insync.Stock(symbol, "SMART", "USD"), bid=ask - 0.01, ask=ask)
+    pairs = []
+    for _ in range(count):
+        tickers = tuple(generator.sample(symbols, generator.choice((2, 2, 3, 4))))
+        equation = (generator.uniform(-2.0, 2.0),) + tuple(generator.uniform(0.1, 2.0) for _ in tickers[1:])
+        pair = create_basket(tickers, "USD", equation, online=False)
+        pair.quotes[:] = [quotes[ticker] for ticker in tickers]
+        pairs.append(pair)
+    return pairs
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_signal_engine_matches_generate_signals(seed):
+    generator = random.Random(seed)
+    pairs = random_universe(generator, 60)
+    threshold = generator.uniform(-0.5, 0.5)
+
+    expected_signals, expected_pairs = alpha_model.generate_signals(pairs, threshold)
+    signal_engine = alpha_model.SignalEngine(pairs)
+    signal_engine.refresh_quotes()
+    new_signals, pairs_traded = signal_engine.generate_signals(threshold)
+
+    assert expected_signals, "The universe should produce Signals"
+    assert new_signals.keys() == expected_signals.keys()
+    assert pairs_traded == expected_pairs
+    for tickers, expected in expected_signals.items():
+        signal = new_signals[tickers]
+        assert signal.pair is expected.pair and signal.tickers == tickers
+        assert signal.deviation == pytest.approx(expected.deviation, rel=1e-12)
+        assert signal.sign == expected.sign
+        assert signal.equation == pytest.approx(expected.equation, rel=1e-15)
+        assert len(signal.equation) == len(tickers)
+        assert signal.threshold == expected.threshold
+        assert [quote.ask for quote in signal.quotes] == [quote.ask for quote in expected.quotes]
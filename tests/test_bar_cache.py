@@ -0,0 +1,97 @@
+import datetime
+import numpy as np
+from bar_cache import BAR_DTYPE, DAY, BarCache, to_seconds
+
+MONDAY = to_seconds(datetime.date(2024, 11, 18))
+NOW = MONDAY + 30 * DAY + DAY // 2  # Midday, so the bar of the day is still running.
+
+
+class FakeFetcher:
+    """
+    Daily bars on weekdays with the close price time / DAY, recording every call.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, symbol, bar_size, start, end):
+        self.calls.append((symbol, bar_size, start, end))
+        times = [time for time in range(start - start % DAY, end, DAY)
+                 if time >= start and datetime.datetime.fromtimestamp(time, datetime.timezone.utc).weekday() < 5]
+        bars = np.zeros(len(times), dtype=BAR_DTYPE)
+        bars["time"] = times
+        bars["close"] = [time / DAY for time in times]
+        return bars
+
+
+def cache(path, fetcher=None, offline=False):
+    return BarCache(str(path), fetcher if fetcher is not None else FakeFetcher(), offline=offline, clock=lambda: NOW)
+
+
+def test_only_missing_ranges_are_fetched(tmp_path):
+    fetcher = FakeFetcher()
+    bar_cache = cache(tmp_path, fetcher)
+
+    first = bar_cache.get("AAA", MONDAY + 7 * DAY, MONDAY + 14 * DAY)
+    assert fetcher.calls == [("AAA", "1 day", MONDAY + 7 * DAY, MONDAY + 14 * DAY)]
+    assert len(first) == 5
+
+    again = bar_cache.get("AAA", MONDAY + 7 * DAY, MONDAY + 14 * DAY)
+    assert len(fetcher.calls) == 1
+    np.testing.assert_array_equal(again, first)
+
+    wider = bar_cache.get("AAA", MONDAY, MONDAY + 21 * DAY)
+    assert fetcher.calls[1:] == [("AAA", "1 day", MONDAY, MONDAY + 7 * DAY),
+                                 ("AAA", "1 day", MONDAY + 14 * DAY, MONDAY + 21 * DAY)]
+    assert len(wider) == 15
+    assert np.all(np.diff(wider["time"]) > 0)
+
+
+def test_ranges_without_bars_are_not_fetched_again(tmp_path):
+    fetcher = FakeFetcher()
+    bar_cache = cache(tmp_path, fetcher)
+    saturday = MONDAY + 5 * DAY
+
+    assert len(bar_cache.get("AAA", saturday, saturday + 2 * DAY)) == 0
+    assert len(bar_cache.get("AAA", saturday, saturday + 2 * DAY)) == 0
+    assert len(fetcher.calls) == 1
+
+
+def test_the_running_bar_is_not_cached(tmp_path):
+    fetcher = FakeFetcher()
+    today = NOW - NOW % DAY
+    clock = [NOW]
+    bar_cache = BarCache(str(tmp_path), fetcher, offline=False, clock=lambda: clock[0])
+
+    bar_cache.get("AAA", today - 2 * DAY, today + DAY)
+    bar_cache.get("AAA", today - 2 * DAY, today + DAY)
+    assert fetcher.calls == [("AAA", "1 day", today - 2 * DAY, today)]
+
+    # Once the day is completed its bar is fetched.
+    clock[0] += DAY
+    bar_cache.get("AAA", today - 2 * DAY, today + DAY)
+    assert fetcher.calls[1:] == [("AAA", "1 day", today, today + DAY)]
+
+
+def test_offline_serves_the_cached_bars_without_fetching(tmp_path):
+    cache(tmp_path).get("AAA", MONDAY, MONDAY + 7 * DAY)
+    fetcher = FakeFetcher()
+    offline = cache(tmp_path, fetcher, offline=True)
+
+    bars = offline.get("AAA", MONDAY, MONDAY + 14 * DAY)
+
+    assert fetcher.calls == []
+    assert offline.fetched == 0
+    assert bars["time"].tolist() == [MONDAY + day * DAY for day in range(5)]
+    assert len(offline.get("BBB", MONDAY, MONDAY + 7 * DAY)) == 0
+
+
+def test_closes_keeps_the_common_bar_times(tmp_path):
+    bar_cache = cache(tmp_path)
+    bar_cache.get("BBB", MONDAY + 2 * DAY, MONDAY + 7 * DAY)
+    bar_cache.get("AAA", MONDAY, MONDAY + 7 * DAY)
+
+    times, prices = cache(tmp_path, offline=True).closes(["AAA", "BBB"], MONDAY, MONDAY + 7 * DAY)
+
+    assert times.tolist() == [MONDAY + day * DAY for day in range(2, 5)]
+    np.testing.assert_array_equal(prices[:, 0], prices[:, 1])
@@ -0,0 +1,87 @@
+import pickle
+import ib_insync
+import pytest
+import checkpoint
+import data_connector
+import logger as log
+import portfolio_model
+from signal_store import Signal, QuoteSnapshot
+
+QUOTES = [(0.0, "AAA", 99.99, 100.01, 100.0, 100.0, 100.0),
+          (0.0, "BBB", 49.99, 50.01, 50.0, 100.0, 100.0),
+          (0.0, "CCC", 19.99, 20.01, 20.0, 100.0, 100.0),
+          (0.0, "DDD", 9.99, 10.01, 10.0, 100.0, 100.0)]
+
+
+@pytest.fixture
+def quotes():
+    return QUOTES
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint, "PATH", str(tmp_path) + "/")
+    monkeypatch.setattr(checkpoint, "CHECKPOINT_NAME", "portfolio.checkpoint")
+    return checkpoint.checkpoint_path()
+
+
+def trade(simulated_ib, portfolio, tickers, equation, shares):
+    pair = data_connector.create_basket(tickers, "USD", equation, online=True)
+    data_connector.connect_pairs([pair])
+    signal = Signal(0.05, 1.0, pair, tuple(map(QuoteSnapshot.from_ticker, pair.quotes)), pair.equation, 0.01)
+    for ticker, quantity in zip(tickers, shares):
+        simulated_ib.placeOrder(ib_insync.Stock(ticker, "SMART", "USD"),
+                                ib_insync.MarketOrder("BUY" if quantity > 0 else "SELL", abs(quantity)))
+        portfolio.followed_signals[ticker] = signal
+        portfolio.pairs_traded[ticker] = pair
+    simulated_ib.sleep(0)
+    portfolio.empty_slots -= 1
+    return signal
+
+
+def state(signal):
+    return signal.tickers, signal.deviation, signal.sign, signal.equation, signal.threshold, signal.zscore
+
+
+def test_restart_restores_the_followed_and_ignored_signals(simulated_ib, path):
+    portfolio = portfolio_model.Portfolio(simulated_ib.account, slots=10, budget=100_000)
+    followed = trade(simulated_ib, portfolio, ("AAA", "BBB"), (0.0, 2.0), (-100, 200))
+    followed.pair.estimator.update(50.0, 101.0)
+    ignored = Signal(0.03, -1.0, data_connector.create_basket(("CCC", "DDD"), "USD", (0.5, 1.9), online=False),
+                     (QuoteSnapshot(19.99, 20.01, 20.0), QuoteSnapshot(9.99, 10.01, 10.0)), (0.5, 1.9), 0.01)
+    portfolio.ignored_signals.add(ignored)
+    checkpoint.save(portfolio)
+
+    restarted = portfolio_model.Portfolio(simulated_ib.account, slots=10, budget=100_000)
+
+    assert restarted.followed_signals.keys() == {"AAA", "BBB"}
+    restored = restarted.followed_signals["AAA"]
+    assert restarted.followed_signals["BBB"] is restored
+    assert state(restored) == state(followed)
+    assert restored.pair.equation == pytest.approx(followed.pair.equation)
+    assert [state(signal) for signal in restarted.ignored_signals.values()] == [state(ignored)]
+    assert restarted.empty_slots == portfolio.empty_slots == 9
+
+
+@pytest.mark.parametrize("content", [
+    b"",
+    checkpoint.MAGIC[:5],
+    checkpoint.HEADER.pack(b"PAIRSXXX", checkpoint.FORMAT_VERSION) + pickle.dumps({}),
+    checkpoint.HEADER.pack(checkpoint.MAGIC, checkpoint.FORMAT_VERSION + 1) + pickle.dumps({}),
+    checkpoint.HEADER.pack(checkpoint.MAGIC, checkpoint.FORMAT_VERSION) + pickle.dumps({"account": "REPLAY"})[:10],
+])
+def test_unreadable_checkpoint_falls_back_to_the_trading_log(simulated_ib, path, content):
+    portfolio = portfolio_model.Portfolio(simulated_ib.account, slots=10, budget=100_000)
+    trade(simulated_ib, portfolio, ("AAA", "BBB"), (0.0, 2.0), (-100, 200))
+    log.log_signal(0.05, 1, "AAA", "BBB", 0.0, 2.0, 0.01)
+    log.flush()
+    with open(path, "wb") as file:
+        file.write(content)
+
+    restarted = portfolio_model.Portfolio(simulated_ib.account, slots=10, budget=100_000)
+
+    recovered = restarted.followed_signals["AAA"]
+    assert restarted.followed_signals["BBB"] is recovered
+    assert (recovered.tickers, recovered.deviation, recovered.equation) == (("AAA", "BBB"), 0.05, (0.0, 2.0))
+    assert len(restarted.ignored_signals) == 0
+    assert restarted.empty_slots == 9
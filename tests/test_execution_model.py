@@ -0,0 +1,70 @@
+import pytest
+import data_connector
+import execution_model
+import portfolio_model
+from signal_store import Signal, QuoteSnapshot
+
+# The sell order of AAA is filled at the first tick, the buy order of BBB never reaches the rising ask.
+QUOTES = [(0.0, "AAA", 99.99, 100.01, 100.0, 1000.0, 1000.0),
+          (0.0, "BBB", 49.99, 50.01, 50.0, 1000.0, 1000.0)]
+QUOTES += [(20.0 * step, "AAA", 100.05, 100.07, 100.06, 1000.0, 1000.0) for step in range(1, 5)]
+QUOTES += [(20.0 * step, "BBB", 49.99 + step, 50.01 + step, 50.0 + step, 1000.0, 1000.0) for step in range(1, 5)]
+QUOTES.sort(key=lambda quote: quote[0])
+
+
+@pytest.fixture
+def quotes():
+    return QUOTES
+
+
+def test_stale_leg_gives_up_the_signal_and_closes_the_filled_leg(simulated_ib):
+    portfolio = portfolio_model.Portfolio(simulated_ib.account, slots=10, budget=100_000)
+    pair = data_connector.create_basket(("AAA", "BBB"), "USD", (0.0, 2.0), online=False)
+    data_connector.connect_pairs([pair])
+    signal = Signal(0.05, 1.0, pair, tuple(map(QuoteSnapshot.from_ticker, pair.quotes)), pair.equation, 0.0)
+
+    adjustments = portfolio.analyze_signals(([signal], {"AAA": pair, "BBB": pair}))
+    execution_model.execute_portfolio_adjustments(portfolio, adjustments, "LIMIT")
+    assert portfolio.empty_slots == 9
+
+    simulated_ib.sleep(20)
+    shares = portfolio.position_book.quantity("AAA")
+    assert shares == adjustments["AAA"] and portfolio.position_book.quantity("BBB") == 0
+    assert portfolio.followed_signals == {"AAA": signal, "BBB": signal}
+
+    # The order of BBB goes stale after 60 seconds.
+    simulated_ib.sleep(20)
+    simulated_ib.sleep(20)
+    assert portfolio.followed_signals == {}
+    assert portfolio.empty_slots == 10
+    assert execution_model.order_manager.open_shares("AAA") == -shares
+    assert execution_model.order_manager.open_shares("BBB") == 0
+
+
+def test_later_targets_of_a_ticker_replace_earlier_ones():
+    netted = execution_model.net_adjustments({"AAA": -100, "BBB": 50}, {"AAA": 0, "CCC": 10}, {"AAA": 60})
+
+    assert netted == {"AAA": 60, "BBB": 50, "CCC": 10}
+
+
+def test_netting_without_adjustments():
+    assert execution_model.net_adjustments() == {}
+    assert execution_model.net_adjustments({}, {}) == {}
+
+
+def test_opposing_targets_of_a_cycle_send_one_order_per_ticker(simulated_ib):
+    portfolio = portfolio_model.Portfolio(simulated_ib.account, slots=10, budget=100_000)
+    pair = data_connector.create_basket(("AAA", "BBB"), "USD", (0.0, 2.0), online=False)
+    data_connector.connect_pairs([pair])
+    portfolio.pairs_traded.update({"AAA": pair, "BBB": pair})
+    execution_model.execute_portfolio_adjustments(portfolio, {"AAA": -100, "BBB": 50}, "MARKET")
+    orders = len(simulated_ib.trades())
+
+    # The position of AAA is closed and opened in the other direction, BBB is closed and opened again.
+    netted = execution_model.net_adjustments({"AAA": 0, "BBB": 0}, {"AAA": 40, "BBB": 50})
+    execution_model.execute_portfolio_adjustments(portfolio, netted, "MARKET")
+
+    trades = simulated_ib.trades()[orders:]
+    assert [(trade.contract.symbol, trade.order.action, trade.order.totalQuantity) for trade in trades] == [
+        ("AAA", "BUY", 140)]
+    assert portfolio.position_book.quantities() == {"AAA": 40, "BBB": 50}
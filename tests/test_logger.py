@@ -0,0 +1,86 @@
+import json
+import sqlite3
+import pytest
+import logger
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger, "PATH", str(tmp_path) + "/")
+    monkeypatch.setattr(logger, "DATABASE_NAME", "trading_log.db")
+    yield str(tmp_path / "trading_log.db")
+    logger.shutdown_logger()
+
+
+def test_every_leg_of_a_basket_is_recovered(database):
+    logger.initialize_logger()
+    logger.log_signal(1.5, 1, "AAA", "BBB", 0.0, 1.0, 2.0, (("AAA", "BBB", "CCC"), (0.0, 1.0, 0.5)))
+    logger.log_signal(-2.5, -1, "CCC", "DDD", 1.0, 0.8, 2.0)
+    logger.log_signal(-1.5, -1, "EEE", "FFF", 1.0, 0.8, 2.0)
+    logger.shutdown_logger()
+
+    latest = logger.fetch_latest_signals(["AAA", "BBB", "CCC", "DDD", "XXX"])
+    assert set(latest) == {"AAA", "BBB", "CCC", "DDD"}
+    assert json.loads(latest["AAA"][-1])["tickers"] == ["AAA", "BBB", "CCC"]
+    assert latest["BBB"] == latest["AAA"]
+    # The Pair CCC/DDD was logged after the Basket, so it is the latest Signal of CCC.
+    assert latest["CCC"][3:5] == ("CCC", "DDD") and latest["CCC"][-1] is None
+
+    assert logger.fetch_latest_signals(["EEE"])["EEE"][3:5] == ("EEE", "FFF")
+
+
+def test_migration_adds_the_legs_of_logged_signals(database):
+    # A database of the schema before SignalLegs, see MIGRATIONS.
+    with sqlite3.connect(database) as log:
+        log.execute("CREATE TABLE Signals(Time SmallDateTime, Deviation double, Sign int, Ticker_a char(15), "
+                    "Ticker_b Char(15), Const double, Slope double, Threshold double);")
+        log.execute("CREATE TABLE Trades(Time SmallDateTime, Type char(15), Action char(5), Quantity int, "
+                    "Stock char(15), Price double);")
+        for statements in logger.MIGRATIONS[:-1]:
+            for statement in statements:
+                log.execute(statement)
+        log.execute(f"PRAGMA user_version = {len(logger.MIGRATIONS) - 1};")
+        basket = json.dumps({"tickers": ["AAA", "BBB", "CCC"], "equation": [0.0, 1.0, 0.5]})
+        log.execute("INSERT INTO Signals VALUES ('2024-11-18 10:00:00', 1.5, 1, 'AAA', 'BBB', 0.0, 1.0, 2.0, ?);",
+                    (basket,))
+        log.execute("INSERT INTO Signals VALUES ('2024-11-18 11:00:00', 1.5, 1, 'DDD', 'EEE', 0.0, 1.0, 2.0, NULL);")
+    logger.migrate()
+
+    latest = logger.fetch_latest_signals(["CCC", "EEE"])
+    assert json.loads(latest["CCC"][-1])["tickers"] == ["AAA", "BBB", "CCC"]
+    assert latest["EEE"][3:5] == ("DDD", "EEE")
+
+    # New Signals are numbered after the migrated ones.
+    logger.log_signal(-1.5, -1, "CCC", "FFF", 1.0, 0.8, 2.0)
+    logger.shutdown_logger()
+    assert logger.fetch_latest_signals(["CCC"])["CCC"][3:5] == ("CCC", "FFF")
+
+
+def trades(database):
+    with sqlite3.connect(database) as log:
+        return log.execute("SELECT Action, Quantity, Stock, Price FROM Trades;").fetchall()
+
+
+def test_writer_survives_rows_that_can_not_be_written(database):
+    logger.initialize_logger()
+    logger.log_trade("MARKET", "BUY", 100, "AAA", object())
+    assert logger.flush(timeout=5)
+    assert logger._writer.is_alive()
+
+    logger.log_trade("MARKET", "SELL", 100, "AAA", 10.0)
+    logger.shutdown_logger()
+
+    assert trades(database) == [("SELL", 100, "AAA", 10.0)]
+
+
+def test_dead_writer_is_restarted(database):
+    logger.initialize_logger()
+    writer = logger._writer
+    logger._rows.put(logger._stop)
+    writer.join()
+
+    logger.log_trade("MARKET", "BUY", 100, "AAA", 10.0)
+    assert logger._writer is not writer
+    logger.shutdown_logger()
+
+    assert trades(database) == [("BUY", 100, "AAA", 10.0)]
@@ -0,0 +1,71 @@
+import ib_insync
+import pytest
+from order_manager import CANCELLED, FILLED, OrderManager
+
+# The quotes move up, away from buy orders at the mid price and through sell orders.
+QUOTES = [(float(time), "AAA", 100.0 + time / 10, 100.02 + time / 10, 100.0, 100.0, 100.0) for time in range(0, 70, 5)]
+
+
+@pytest.fixture
+def quotes():
+    return QUOTES
+
+
+@pytest.fixture
+def manager(simulated_ib):
+    # The orders are not repriced, so a buy order stays below the ask.
+    manager = OrderManager(reprice_interval=1000, max_reprices=4, stale_after=60, clock=lambda: simulated_ib.clock)
+    manager.start()
+    yield manager
+    manager.stop()
+
+
+@pytest.fixture
+def stock(simulated_ib):
+    contract = ib_insync.Stock("AAA", "SMART", "USD")
+    simulated_ib.qualifyContracts(contract)
+    return contract, simulated_ib.reqMktData(contract)
+
+
+def test_stale_order_is_reported_once(simulated_ib, manager, stock):
+    cancelled = []
+    managed = manager.submit("AAA", *stock, 100, on_cancel=cancelled.append)
+
+    for _ in range(11):
+        simulated_ib.sleep(5)
+    assert cancelled == [] and manager.open_shares("AAA") == 100
+
+    simulated_ib.sleep(5)
+    assert cancelled == ["AAA"]
+    assert managed.state == CANCELLED and manager.open_shares("AAA") == 0
+
+
+def test_order_cancelled_by_tws_is_reported(simulated_ib, manager, stock):
+    cancelled = []
+    managed = manager.submit("AAA", *stock, 100, on_cancel=cancelled.append)
+
+    simulated_ib.cancelOrder(managed.order)
+
+    assert cancelled == ["AAA"]
+    assert managed.state == CANCELLED
+
+
+def test_replaced_order_is_not_reported(simulated_ib, manager, stock):
+    cancelled = []
+    managed = manager.submit("AAA", *stock, 100, on_cancel=cancelled.append)
+
+    manager.adjust("AAA", *stock, -50, on_cancel=cancelled.append)
+
+    assert cancelled == []
+    assert managed.state == CANCELLED and manager.open_shares("AAA") == -50
+
+
+def test_filled_order_is_not_reported(simulated_ib, manager, stock):
+    cancelled = []
+    contract, quotes = stock
+    managed = manager.submit("AAA", contract, quotes, -100, on_cancel=cancelled.append)
+
+    simulated_ib.sleep(5)
+
+    assert managed.state == FILLED
+    assert cancelled == []
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+import pair_screening
+
+
+@pytest.mark.parametrize("workers", [1, None])
+def test_empty_universe_has_no_pairs(workers):
+    result = pair_screening.score_pairs(np.empty((250, 0)), workers=workers)
+
+    assert len(result) == 7
+    assert all(column.shape == (0,) for column in result)
+
+
+def test_cointegrated_pair_is_found():
+    generator = np.random.default_rng(5)
+    price_b = 50.0 + np.cumsum(generator.normal(0.0, 1.0, 500))
+    noise = np.zeros(500)
+    for day in range(1, 500):
+        noise[day] = 0.5 * noise[day - 1] + generator.normal(0.0, 0.5)
+    price_a = 3.0 + 1.5 * price_b + noise
+    unrelated = 80.0 + np.cumsum(generator.normal(0.0, 1.0, 500))
+
+    a, b, correlation, const, slope, adf, half_life = pair_screening.score_pairs(
+        np.column_stack([price_a, price_b, unrelated]), workers=1)
+
+    assert (a[0], b[0]) == (0, 1)
+    assert slope[0] == pytest.approx(1.5, abs=0.05)
+    assert half_life[0] < 5
@@ -0,0 +1,58 @@
+import math
+import numpy as np
+import pytest
+from pair_statistics import RecursiveLeastSquares, RollingWindow
+
+
+@pytest.mark.parametrize("count", [1, 7, 10, 11, 25, 1000])
+def test_rolling_window_matches_numpy_after_wrap_around(count):
+    values = np.random.default_rng(count).normal(100.0, 5.0, count)
+    window = RollingWindow(10)
+    for value in values:
+        window.push(value)
+
+    last = values[-10:]
+    assert window.count == len(last)
+    assert window.mean == pytest.approx(np.mean(last), rel=1e-12)
+    np.testing.assert_array_equal(window.ordered(), last)
+    assert window.last() == values[-1]
+    if len(last) < 2:
+        assert math.isnan(window.variance)
+    else:
+        assert window.variance == pytest.approx(np.var(last, ddof=1), rel=1e-9)
+        assert window.zscore(values[-1]) == pytest.approx((values[-1] - np.mean(last)) / np.std(last, ddof=1))
+
+
+def test_rolling_window_of_equal_values_has_no_zscore():
+    window = RollingWindow(5)
+    for _ in range(12):
+        window.push(0.1)
+
+    assert window.variance == pytest.approx(0.0, abs=1e-30)
+    assert math.isnan(window.zscore(0.2))
+
+
+def test_recursive_least_squares_converges_to_the_equation():
+    generator = np.random.default_rng(1)
+    estimator = RecursiveLeastSquares(0.0, 1.0, forgetting=1.0, uncertainty=1e6)
+    for price_b in generator.uniform(40.0, 60.0, 5000):
+        estimator.update(price_b, 3.0 + 1.8 * price_b + generator.normal(0.0, 0.05))
+
+    assert estimator.const == pytest.approx(3.0, abs=0.05)
+    assert estimator.slope == pytest.approx(1.8, abs=1e-3)
+
+
+def test_forgetting_follows_a_drifting_slope():
+    generator = np.random.default_rng(2)
+    forgetting = RecursiveLeastSquares(0.0, 1.0, forgetting=0.99, uncertainty=1e6)
+    remembering = RecursiveLeastSquares(0.0, 1.0, forgetting=1.0, uncertainty=1e6)
+    slopes = np.linspace(1.5, 2.5, 5000)
+    for slope, price_b in zip(slopes, generator.uniform(40.0, 60.0, len(slopes))):
+        price_a = 3.0 + slope * price_b + generator.normal(0.0, 0.05)
+        forgetting.update(price_b, price_a)
+        remembering.update(price_b, price_a)
+
+    # The estimate lags about 1 / (1 - forgetting) observations behind the drift.
+    assert forgetting.slope == pytest.approx(2.5, abs=0.05)
+    # Without forgetting the estimate stays near the average slope of the whole day.
+    assert abs(remembering.slope - 2.5) > 5 * abs(forgetting.slope - 2.5)
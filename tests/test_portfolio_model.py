@@ -0,0 +1,166 @@
+import ib_insync
+import numpy as np
+import pytest
+import data_connector
+import logger as log
+import portfolio_model
+from data_connector import create_basket
+from signal_store import Signal, QuoteSnapshot
+
+QUOTES = [(0.0, "AAA", 99.99, 100.01, 100.0, 100.0, 100.0),
+          (0.0, "BBB", 49.99, 50.01, 50.0, 100.0, 100.0),
+          (0.0, "CCC", 19.99, 20.01, 20.0, 100.0, 100.0),
+          (0.0, "DDD", 9.99, 10.01, 10.0, 100.0, 100.0),
+          (10.0, "AAA", 89.99, 90.01, 90.0, 100.0, 100.0)]
+
+
+@pytest.fixture
+def quotes():
+    return QUOTES
+
+
+def fill(simulated_ib, ticker, shares):
+    action = "BUY" if shares > 0 else "SELL"
+    simulated_ib.placeOrder(ib_insync.Stock(ticker, "SMART", "USD"), ib_insync.MarketOrder(action, abs(shares)))
+    simulated_ib.sleep(0)
+
+
+def ignored_signal(tickers, deviation):
+    pair = create_basket(tickers, "USD", (0.0, 1.0), online=False)
+    return Signal(deviation, 1.0, pair, tuple(QuoteSnapshot(9.99, 10.01, 10.0) for _ in tickers), pair.equation, 0.0)
+
+
+def test_recovered_pair_is_followed_by_both_legs_if_one_is_held(simulated_ib):
+    fill(simulated_ib, "AAA", -100)
+    log.log_signal(0.01, 1, "AAA", "BBB", 0.0, 2.0, 0.0)
+    log.flush()
+
+    portfolio = portfolio_model.Portfolio(simulated_ib.account, slots=10, budget=100_000)
+
+    assert portfolio.followed_signals["AAA"] is portfolio.followed_signals["BBB"]
+    assert portfolio.followed_signals["AAA"].tickers == ("AAA", "BBB")
+    assert portfolio.empty_slots == 9
+
+    # The short AAA position gains 10% and the Signal is liquidated, although BBB has no position.
+    portfolio.ignored_signals.add(ignored_signal(("CCC", "DDD"), 0.001))
+    simulated_ib.sleep(10)
+    assert portfolio.optimize() == {"AAA": 0, "BBB": 0}
+    assert portfolio.followed_signals == {}
+    assert portfolio.empty_slots == 10
+
+
+def followed_pair(portfolio, tickers, deviation=0.05):
+    pair = create_basket(tickers, "USD", (0.0, 2.0), online=False)
+    signal = Signal(deviation, 1.0, pair, None, pair.equation, 0.0)
+    for ticker in tickers:
+        portfolio.followed_signals[ticker] = signal
+    portfolio.empty_slots -= 1
+    return signal
+
+
+def test_unfilled_signal_gives_back_its_slot(simulated_ib):
+    portfolio = portfolio_model.Portfolio(simulated_ib.account, slots=10, budget=100_000)
+    followed_pair(portfolio, ("AAA", "BBB"))
+
+    assert portfolio.release_signal("BBB") == {"AAA": 0, "BBB": 0}
+    assert portfolio.followed_signals == {}
+    assert portfolio.empty_slots == 10
+    # The other leg is not released a second time.
+    assert portfolio.release_signal("AAA") == {}
+    assert portfolio.empty_slots == 10
+
+
+def test_half_filled_signal_closes_the_filled_leg(simulated_ib):
+    portfolio = portfolio_model.Portfolio(simulated_ib.account, slots=10, budget=100_000)
+    followed_pair(portfolio, ("AAA", "BBB"))
+    fill(simulated_ib, "AAA", -100)
+
+    assert portfolio.release_signal("BBB") == {"AAA": 0, "BBB": 0}
+    assert portfolio.followed_signals == {}
+    assert portfolio.empty_slots == 10
+
+
+def replaced_portfolio(simulated_ib):
+    # AAA/BBB gains about 10%, far less than its deviation, and blocks the much better CCC/DDD.
+    portfolio = portfolio_model.Portfolio(simulated_ib.account, slots=10, budget=100_000)
+    fill(simulated_ib, "AAA", -100)
+    fill(simulated_ib, "BBB", 200)
+    data_connector.connect_pairs([followed_pair(portfolio, ("AAA", "BBB"), deviation=0.5).pair])
+    replacement = ignored_signal(("CCC", "DDD"), 0.9)
+    portfolio.pairs_traded.update({"CCC": replacement.pair, "DDD": replacement.pair})
+    portfolio.ignored_signals.add(replacement)
+    simulated_ib.sleep(10)
+    return portfolio, replacement
+
+
+def test_replacement_is_followed_once_it_is_accepted(simulated_ib):
+    portfolio, replacement = replaced_portfolio(simulated_ib)
+
+    adjustments = portfolio.optimize()
+
+    assert adjustments["AAA"] == adjustments["BBB"] == 0
+    assert adjustments["CCC"] < 0 < adjustments["DDD"]
+    assert portfolio.followed_signals == {"CCC": replacement, "DDD": replacement}
+    assert replacement not in portfolio.ignored_signals
+    assert portfolio.empty_slots == 9
+
+
+def test_rejected_replacement_stays_ignored(simulated_ib):
+    portfolio, replacement = replaced_portfolio(simulated_ib)
+    # More Signals are followed than there are slots, so the slot of AAA/BBB does not make room for CCC/DDD.
+    portfolio.empty_slots = -1
+
+    adjustments = portfolio.optimize()
+
+    assert adjustments == {"AAA": 0, "BBB": 0}
+    assert portfolio.followed_signals == {}
+    assert replacement in portfolio.ignored_signals
+    assert portfolio.empty_slots == 0
+
+
+def test_solve_shares_of_pairs_matches_the_closed_form():
+    generator = np.random.default_rng(3)
+    asks = generator.uniform(5.0, 300.0, (50, 2))
+    equations = np.column_stack([generator.uniform(-5.0, 5.0, 50), generator.uniform(0.2, 3.0, 50)])
+    capital = 10_000.0
+
+    shares = portfolio_model.solve_shares(asks, equations, capital)
+
+    const, slope = equations[:, 0], equations[:, 1]
+    shares_b = (capital - const * asks[:, 0]) / (slope * asks[:, 0] + asks[:, 1])
+    np.testing.assert_allclose(shares[:, 1], shares_b)
+    np.testing.assert_allclose(shares[:, 0], const + slope * shares_b)
+
+
+def test_solve_shares_of_a_basket_invests_the_capital_with_its_hedge_ratios():
+    asks = np.array([[100.0, 40.0, 25.0]])
+    equations = np.array([[2.0, 1.5, 0.8]])
+
+    shares = portfolio_model.solve_shares(asks, equations, 10_000.0)[0]
+
+    assert asks[0] @ shares == pytest.approx(10_000.0)
+    assert shares[0] - 1.5 * shares[1] - 0.8 * shares[2] == pytest.approx(2.0)
+    assert shares[2] / shares[1] == pytest.approx(0.8 / 1.5)
+
+
+def test_solve_shares_rejects_singular_systems_and_invalid_quotes():
+    # The second Pair is singular (slope * ask_a + ask_b = 0), the third has no valid ask.
+    asks = np.array([[10.0, 20.0], [10.0, 20.0], [np.nan, 20.0], [50.0, 25.0]])
+    equations = np.array([[0.0, 1.0], [0.0, -2.0], [0.0, 1.0], [0.0, 2.0]])
+
+    shares = portfolio_model.solve_shares(asks, equations, 1000.0)
+
+    assert np.isnan(shares[1:3]).all()
+    np.testing.assert_allclose(shares[0], [1000.0 / 30.0] * 2)
+    np.testing.assert_allclose(shares[3], [16.0, 8.0])
+
+
+def test_signal_without_a_solution_is_rejected(simulated_ib):
+    portfolio = portfolio_model.Portfolio(simulated_ib.account, slots=10, budget=100_000)
+    pair = create_basket(("AAA", "BBB"), "USD", (0.0, -2.0), online=False)
+    quotes = (QuoteSnapshot(9.99, 10.0, 10.0), QuoteSnapshot(19.99, 20.0, 20.0))
+    signal = Signal(0.05, 1.0, pair, quotes, pair.equation, 0.0)
+
+    assert np.isnan(portfolio.size_signals([signal])[1]).all()
+    assert portfolio.analyze_signals(([signal], {"AAA": pair, "BBB": pair})) == {}
+    assert portfolio.followed_signals == {} and portfolio.empty_slots == 10
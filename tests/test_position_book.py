@@ -0,0 +1,131 @@
+import ib_insync
+import pytest
+from position_book import PositionBook
+
+ACCOUNT = "DU1"
+CONTRACT = ib_insync.Stock("AAA", "SMART", "USD")
+
+
+def execution(exec_id, shares, price, account=ACCOUNT):
+    side = "BOT" if shares > 0 else "SLD"
+    fill = ib_insync.Fill(CONTRACT, ib_insync.Execution(execId=exec_id, acctNumber=account, side=side,
+                                                        shares=abs(shares), price=price),
+                          ib_insync.CommissionReport(), None)
+    return None, fill
+
+
+def test_partial_fills_are_booked_as_they_arrive():
+    book = PositionBook(ACCOUNT)
+
+    book.on_exec_details(*execution("1.1", 100, 10.0))
+    assert book.quantity("AAA") == 100
+    book.on_exec_details(*execution("1.2", 300, 11.0))
+
+    position = book.positions["AAA"]
+    assert position.quantity == 400
+    assert position.average_cost == pytest.approx(10.75)
+    assert position.market_price == 10.0
+
+
+def test_fill_is_booked_once():
+    book = PositionBook(ACCOUNT)
+
+    book.on_exec_details(*execution("1.1", 100, 10.0))
+    book.on_exec_details(*execution("1.1", 100, 10.0))
+
+    assert book.quantity("AAA") == 100
+
+
+def test_fills_of_other_accounts_are_ignored():
+    book = PositionBook(ACCOUNT)
+
+    book.on_exec_details(*execution("1.1", 100, 10.0, account="DU2"))
+
+    assert "AAA" not in book
+
+
+def test_reducing_fill_realizes_pnl_and_keeps_the_average_cost():
+    book = PositionBook(ACCOUNT)
+    book.on_exec_details(*execution("1.1", 100, 10.0))
+
+    book.on_exec_details(*execution("2.1", -40, 12.0))
+
+    position = book.positions["AAA"]
+    assert position.quantity == 60
+    assert position.average_cost == 10.0
+    assert position.realized_pnl == pytest.approx(80.0)
+
+
+def test_closed_position_leaves_the_book():
+    book = PositionBook(ACCOUNT)
+    book.on_exec_details(*execution("1.1", -100, 10.0))
+
+    book.on_exec_details(*execution("2.1", 100, 9.0))
+
+    assert "AAA" not in book and len(book) == 0
+    assert book.quantity("AAA") == 0
+
+
+@pytest.mark.parametrize("opening, flipping, realized", [(100, -150, 200.0), (-100, 150, -200.0)])
+def test_fill_through_zero_flips_the_side(opening, flipping, realized):
+    book = PositionBook(ACCOUNT)
+    book.on_exec_details(*execution("1.1", opening, 10.0))
+
+    book.on_exec_details(*execution("2.1", flipping, 12.0))
+
+    position = book.positions["AAA"]
+    assert position.quantity == opening + flipping
+    # The remaining shares were opened at the price of the flipping fill.
+    assert position.average_cost == 12.0
+    assert position.realized_pnl == pytest.approx(realized)
+
+
+def test_position_reported_by_tws_replaces_the_booked_one():
+    book = PositionBook(ACCOUNT)
+    book.on_exec_details(*execution("1.1", 100, 10.0))
+
+    book.on_position(ib_insync.Position(ACCOUNT, CONTRACT, 150, 10.5))
+    assert book.quantity("AAA") == 150 and book.positions["AAA"].average_cost == 10.5
+
+    book.on_position(ib_insync.Position("DU2", CONTRACT, 0, 0.0))
+    assert book.quantity("AAA") == 150
+
+    book.on_position(ib_insync.Position(ACCOUNT, CONTRACT, 0, 0.0))
+    assert "AAA" not in book
+
+
+def test_portfolio_update_never_changes_the_quantity():
+    book = PositionBook(ACCOUNT)
+    book.on_exec_details(*execution("1.1", 100, 10.0))
+
+    # The account update still reports the position before the fill.
+    book.on_portfolio_item(ib_insync.PortfolioItem(CONTRACT, 50, 11.0, 550.0, 9.0, 100.0, 5.0, ACCOUNT))
+    position = book.positions["AAA"]
+    assert position.quantity == 100 and position.average_cost == 10.0
+    assert position.market_price == 11.0 and position.realized_pnl == 5.0
+
+    book.on_portfolio_item(ib_insync.PortfolioItem(CONTRACT, 100, 11.5, 1150.0, 10.1, 140.0, 5.0, ACCOUNT))
+    assert position.average_cost == 10.1
+    assert position.unrealized_pnl == pytest.approx(100 * (11.5 - 10.1))
+
+
+@pytest.fixture
+def quotes():
+    return [(0.0, "AAA", 9.99, 10.01, 10.0, 30.0, 30.0), (1.0, "AAA", 10.49, 10.51, 10.5, 30.0, 30.0)]
+
+
+def test_book_follows_the_fills_of_the_simulation(simulated_ib):
+    book = PositionBook(simulated_ib.account)
+    book.start()
+    # Only 30 shares are displayed, so the order is filled in parts.
+    simulated_ib.placeOrder(CONTRACT, ib_insync.LimitOrder("BUY", 100, 10.01))
+    simulated_ib.sleep(0)
+    assert book.quantity("AAA") == 30
+    simulated_ib.sleep(0)
+    simulated_ib.sleep(0)
+    simulated_ib.sleep(0)
+    book.stop()
+
+    item, = simulated_ib.portfolio()
+    assert book.quantity("AAA") == item.position == 100
+    assert book.positions["AAA"].average_cost == pytest.approx(item.averageCost)
@@ -0,0 +1,38 @@
+import pickle
+import pytest
+import data_connector
+import portfolio_model
+import sharding
+from data_connector import create_basket
+from signal_store import Signal, QuoteSnapshot, live_signal
+
+QUOTES = [(0.0, "AAA", 99.99, 100.01, 100.0, 100.0, 100.0),
+          (0.0, "BBB", 49.99, 50.01, 50.0, 100.0, 100.0)]
+
+
+@pytest.fixture
+def quotes():
+    return QUOTES
+
+
+def test_reattached_signal_is_revalidated_with_the_residuals_of_the_worker(simulated_ib):
+    worker_pair = create_basket(("AAA", "BBB"), "USD", (0.0, 2.0), online=False)
+    for residual in (-0.012, -0.010, -0.011, -0.009, -0.010, -0.008):
+        worker_pair.history.residuals.push(residual)
+    quotes = (QuoteSnapshot(99.99, 100.01, 100.0), QuoteSnapshot(49.99, 50.01, 50.0))
+    signal = Signal(0.0001, -1.0, worker_pair, quotes, worker_pair.equation, 2.0, zscore=True)
+    candidate = pickle.loads(pickle.dumps(sharding.to_candidate(signal)))
+
+    portfolio = portfolio_model.Portfolio(simulated_ib.account, slots=10, budget=100_000)
+    pair = create_basket(("AAA", "BBB"), "USD", (0.0, 1.0), online=False)
+    coordinator = sharding.Coordinator(portfolio, [pair], workers=1)
+    reattached = coordinator.reattach(candidate)
+
+    assert reattached.pair is pair and pair.equation == (0.0, 2.0)
+    residuals = pair.history.residuals
+    assert residuals.mean == pytest.approx(worker_pair.history.residuals.mean)
+    assert residuals.std == pytest.approx(worker_pair.history.residuals.std)
+    # The delta of the live quotes is far above the residuals the worker recorded, so the Signal is still valid.
+    data_connector.connect_pairs([pair])
+    fresh = live_signal(pair, reattached.threshold, reattached.zscore)
+    assert fresh is not None and fresh.zscore
@@ -0,0 +1,65 @@
+import random
+import pytest
+from data_connector import create_basket
+from signal_store import Signal, SignalBook
+
+SYMBOLS = [f"S{number}" for number in range(12)]
+
+
+def random_signal(generator):
+    tickers = tuple(generator.sample(SYMBOLS, generator.choice((2, 2, 3))))
+    pair = create_basket(tickers, "USD", (0.0,) + (1.0,) * (len(tickers) - 1), online=False)
+    return Signal(generator.uniform(0.001, 0.1), generator.choice((-1.0, 1.0)), pair, None, pair.equation, 0.0)
+
+
+def greedy_replacement(book, symbols):
+    # The replacement as optimize chose it before the heap: a scan of all ignored Signals.
+    candidates = [signal for signal in book.values() if not any(ticker in symbols for ticker in signal.tickers)]
+    return max(candidates, key=lambda signal: signal.deviation, default=None)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_best_replacement_matches_the_greedy_scan(seed):
+    generator = random.Random(seed)
+    book = SignalBook(ttl=float("inf"), max_size=20, revalidate_after=float("inf"))
+
+    for _ in range(10):
+        for _ in range(generator.randint(0, 8)):
+            book.add(random_signal(generator))
+        if book and generator.random() < 0.3:
+            book.remove(generator.choice(book.values()))
+
+        # One optimization: the held stocks stay the same, every replacement that is taken leaves the book.
+        held = set(generator.sample(SYMBOLS, generator.randint(0, 6)))
+        blocked = []
+        for _ in range(generator.randint(1, 5)):
+            expected = greedy_replacement(book, held)
+            assert book.best_replacement(held, blocked) is expected
+            if expected is None or generator.random() < 0.5:
+                continue
+            book.remove(expected)
+        book.restore(blocked)
+        assert len(book.heap) >= len(book)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_best_replacements_are_the_replacements_in_the_order_they_are_taken(seed):
+    generator = random.Random(seed)
+    book = SignalBook(ttl=float("inf"), max_size=20, revalidate_after=float("inf"))
+    for _ in range(generator.randint(0, 20)):
+        book.add(random_signal(generator))
+    held = set(generator.sample(SYMBOLS, generator.randint(0, 4)))
+    count = generator.randint(1, 6)
+
+    blocked = []
+    replacements = book.best_replacements(held, blocked, count)
+
+    taken = []
+    for _ in range(count):
+        signal = book.best_replacement(held, blocked)
+        if signal is None:
+            break
+        taken.append(signal)
+        book.remove(signal)
+    book.restore(blocked)
+    assert replacements == taken
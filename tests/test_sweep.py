@@ -0,0 +1,19 @@
+import numpy as np
+import sweep
+
+QUOTES = [(1.0, "BBB", 9.99, 10.01, 10.0, 100.0, 200.0),
+          (1.0, "AAA", 19.99, 20.01, float("nan"), 300.0, 400.0),
+          (2.5, "BBB", 10.09, 10.11, 10.1, 100.0, 100.0)]
+
+
+def test_read_quotes_maps_the_file_and_replays_the_same_quotes(tmp_path):
+    path = str(tmp_path / "quotes.npy")
+    symbols = sweep.write_quotes(QUOTES, path)
+
+    quotes = sweep.read_quotes(path, symbols)
+
+    assert isinstance(quotes.records, np.memmap)
+    assert len(quotes) == len(QUOTES)
+    for index, expected in enumerate(QUOTES):
+        np.testing.assert_equal(quotes[index], expected)
+        assert isinstance(quotes[index][0], float) and isinstance(quotes[index][1], str)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from transaction_costs import CostModel
+
+CAT = 0.0000729
+
+
+@pytest.mark.parametrize("shares, price, expected", [
+    (10, 50.0, 1.00),  # 0.05 per share, raised to the minimum of $1
+    (-10, 50.0, 1.00),
+    (1000, 50.0, 5.00),  # 0.005 per share
+    (100, 0.5, 0.50),  # the minimum would be more than 1% of the trade value of $50
+    (1000, 0.5, 5.00),  # 0.005 per share, just 1% of the trade value of $500
+    (10_000, 0.02, 2.00),  # 1% of $200 caps the $50 per share
+    (0, 50.0, 0.00),
+])
+def test_commission(shares, price, expected):
+    assert CostModel().commission(shares, price) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("shares, price, expected", [
+    (1000, 50.0, 1000 * CAT),  # buys only pay CAT
+    (-1000, 50.0, 0.0000278 * 50_000 + 0.000166 * 1000 + 1000 * CAT),  # sells pay SEC fee and TAF as well
+    (-100_000, 1.0, 0.0000278 * 100_000 + 8.30 + 100_000 * CAT),  # TAF of $16.60 capped at $8.30
+    (100_000, 1.0, 100_000 * CAT),
+    (0, 50.0, 0.0),
+])
+def test_regulatory_fees(shares, price, expected):
+    assert CostModel().regulatory_fees(shares, price) == pytest.approx(expected)
+
+
+def test_order_cost_is_commission_and_fees():
+    cost_model = CostModel()
+    assert cost_model.order_cost(-1000, 50.0) == pytest.approx(5.00 + 0.0000278 * 50_000 + 0.000166 * 1000 + 1000 * CAT)
+
+
+def test_round_trip_pays_both_sides():
+    cost_model = CostModel()
+    assert cost_model.round_trip(1000, 50.0) == pytest.approx(cost_model.order_cost(1000, 50.0)
+                                                              + cost_model.order_cost(-1000, 50.0))
+    assert cost_model.round_trip(1000, 50.0, exit_price=60.0) == pytest.approx(cost_model.order_cost(1000, 50.0)
+                                                                               + cost_model.order_cost(-1000, 60.0))
+
+
+def test_fees_can_be_overridden():
+    cost_model = CostModel(minimum=0.0, per_share=0.01, max_pct=1.0, sec_fee=0.0, taf_fee=0.0, cat_fee=0.0)
+    assert cost_model.order_cost(-10, 50.0) == pytest.approx(0.10)
+
+
+@pytest.mark.parametrize("method", ["commission", "regulatory_fees", "order_cost", "round_trip"])
+def test_arrays_match_scalars(method):
+    generator = np.random.default_rng(7)
+    shares = np.trunc(generator.uniform(-200_000, 200_000, 500))
+    shares[:10] = 0
+    prices = generator.uniform(0.01, 500.0, 500)
+    cost_model = CostModel()
+
+    vectorized = getattr(cost_model, method)(shares, prices)
+    scalars = [float(getattr(cost_model, method)(float(quantity), float(price))) for quantity, price in zip(shares, prices)]
+
+    assert vectorized.shape == shares.shape
+    np.testing.assert_allclose(vectorized, scalars, rtol=1e-12)
+
+
+def test_matrices_are_costed_element_wise():
+    shares = np.array([[-100.0, 200.0], [0.0, -50.0]])
+    prices = np.array([[10.0, 5.0], [20.0, 40.0]])
+    cost_model = CostModel()
+
+    costs = cost_model.order_cost(shares, prices)
+
+    assert costs.shape == (2, 2)
+    for index in np.ndindex(shares.shape):
+        assert costs[index] == pytest.approx(cost_model.order_cost(shares[index], prices[index]))
@@ -0,0 +1,289 @@
+"""
+This module records the quotes of all subscribed stocks into binary files and reads them back as NumPy arrays.
+
+Every update of a ib_insync Ticker is stored as one fixed-width record of TICK_DTYPE. The records of a stock
+are appended to segment files per UTC day:
+
+    TICK_PATH/2024-11-21/AAPL/main-0000.ticks
+    TICK_PATH/2024-11-21/AAPL/main-0001.ticks    (the next segment, once the first one is full)
+
+A segment starts with a header of HEADER_SIZE bytes (magic, format version, record size, amount of records)
+followed by the space for TICK_SEGMENT_RECORDS records. The file is memory-mapped and a record is written
+before the header count includes it, so a reader never sees a half written record. When a segment is closed
+it is truncated to its records. Segments are never reopened for writing; a restart begins a new segment.
+
+The trading loop only puts the quotes of each batch on a queue (see TickRecorder.on_pending_tickers).
+The files are written by a background thread. The reader functions return views of the mapped files
+without copying them, so a whole session is available for research or a replay within milliseconds.
+"""
+import datetime
+import glob
+import os
+import queue
+import threading
+import time
+import numpy as np
+import logger as log
+from tws_connection import ib
+from constants import TICK_PATH, TICK_SEGMENT_RECORDS, TICK_FLUSH_INTERVAL
+
+console = log.get_console("TICK RECORDER")
+
+TICK_DTYPE = np.dtype([("time", "<f8"), ("bid", "<f8"), ("ask", "<f8"), ("last", "<f8"),
+                       ("bid_size", "<f8"), ("ask_size", "<f8")])
+
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("record_size", "<u4"), ("count", "<u8")])
+
+# Bytes before the first record. The rest of the header is reserved.
+HEADER_SIZE = 64
+
+MAGIC = b"PAIRTICK"
+
+# Increase with every change of TICK_DTYPE or of the header.
+FORMAT_VERSION = 1
+
+SUFFIX = ".ticks"
+
+_stop = object()
+
+
+def day_of(timestamp: float):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+class Segment:
+    """
+    A segment file that is open for writing.
+    """
+
+    def __init__(self, path: str, capacity: int):
+        self.path = path
+        self.capacity = capacity
+        with open(path, "xb") as file:
+            file.truncate(HEADER_SIZE + capacity * TICK_DTYPE.itemsize)
+        self.header = np.memmap(path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+        self.records = np.memmap(path, dtype=TICK_DTYPE, mode="r+", offset=HEADER_SIZE, shape=(capacity,))
+        self.header[0] = (MAGIC, FORMAT_VERSION, TICK_DTYPE.itemsize, 0)
+        self.count = 0
+
+    def append(self, records):
+        """
+        Write as many records as fit into the segment.
+        :return: The amount of records written.
+        """
+        written = min(len(records), self.capacity - self.count)
+        self.records[self.count:self.count + written] = records[:written]
+        self.count += written
+        self.header["count"] = self.count
+        return written
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    def flush(self):
+        self.records.flush()
+        self.header.flush()
+
+    def close(self):
+        self.flush()
+        del self.records, self.header
+        os.truncate(self.path, HEADER_SIZE + self.count * TICK_DTYPE.itemsize)
+
+
+class TickRecorder:
+    """
+    Records the quotes of every ib.pendingTickersEvent on a background thread.
+
+    :param path: Directory of the recording. Segments of the same day are placed in a subdirectory.
+    :param source: Name of the recording process, part of the file names. Processes that record at the same time,
+                   e.g. the shard workers, need different sources.
+    :param symbols: Only these symbols are recorded. None records all subscribed symbols.
+    """
+
+    def __init__(self, path: str = TICK_PATH, source: str = "main", symbols=None,
+                 segment_records: int = TICK_SEGMENT_RECORDS, flush_interval: float = TICK_FLUSH_INTERVAL):
+        self.path = path
+        self.source = source
+        self.symbols = set(symbols) if symbols is not None else None
+        self.segment_records = segment_records
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.segments = {}  # symbol -> (day, Segment) that is open for writing
+        self.writer = None
+        self.recorded = 0
+
+    def start(self):
+        if self.writer is not None:
+            return
+        self.writer = threading.Thread(target=self._write_ticks, name=f"tick recorder {self.source}", daemon=True)
+        self.writer.start()
+        ib.pendingTickersEvent += self.on_pending_tickers
+        console.info("Quotes are recorded to %s;", self.path)
+
+    def stop(self):
+        """
+        Write all remaining quotes and close the segments.
+        """
+        if self.writer is None:
+            return
+        ib.pendingTickersEvent -= self.on_pending_tickers
+        self.queue.put(_stop)
+        self.writer.join()
+        self.writer = None
+
+    def flush(self, timeout: float = None):
+        """
+        Block until all quotes that were recorded so far are written.
+        """
+        if self.writer is None:
+            return True
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def on_pending_tickers(self, tickers):
+        # Only the values are copied here; everything else happens on the writer thread.
+        now = time.time()
+        batch = [(ticker.contract.symbol, ticker.time.timestamp() if ticker.time else now,
+                  ticker.bid, ticker.ask, ticker.last, ticker.bidSize, ticker.askSize)
+                 for ticker in tickers
+                 if self.symbols is None or ticker.contract.symbol in self.symbols]
+        if batch:
+            self.queue.put(batch)
+
+    def _write_ticks(self):
+        """
+        Body of the writer thread. Collects the batches from the queue and appends them per symbol.
+        """
+        pending = {}  # symbol -> list of records
+        deadline = time.monotonic() + self.flush_interval
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    item = None
+
+                if item is _stop:
+                    break
+                if isinstance(item, threading.Event):
+                    self._write(pending)
+                    self._flush_segments()
+                    item.set()
+                    continue
+                if item is not None:
+                    for symbol, *record in item:
+                        pending.setdefault(symbol, []).append(tuple(record))
+                    # Everything that is waiting already is written in the same batch.
+                    if not self.queue.empty():
+                        continue
+                self._write(pending)
+
+                if time.monotonic() >= deadline:
+                    self._flush_segments()
+                    deadline = time.monotonic() + self.flush_interval
+        finally:
+            self._write(pending)
+            for _, segment in self.segments.values():
+                segment.close()
+            self.segments = {}
+
+    def _write(self, pending):
+        for symbol, records in pending.items():
+            records = np.array(records, dtype=TICK_DTYPE)
+            self.recorded += len(records)
+            # The records are sorted by time, so a batch around midnight is split at the first record of the new day.
+            day_numbers = records["time"] // 86400
+            for part in np.split(records, np.flatnonzero(np.diff(day_numbers)) + 1):
+                day = day_of(part["time"][0])
+                while len(part):
+                    segment = self._segment(symbol, day)
+                    part = part[segment.append(part):]
+        pending.clear()
+
+    def _segment(self, symbol, day):
+        """
+        The open segment of a symbol for a day. Full segments and segments of an earlier day are closed.
+        """
+        current = self.segments.get(symbol)
+        if current is not None:
+            current_day, segment = current
+            if current_day == day and not segment.full:
+                return segment
+            segment.close()
+
+        directory = os.path.join(self.path, day, symbol)
+        os.makedirs(directory, exist_ok=True)
+        number = len(glob.glob(os.path.join(directory, f"{self.source}-*{SUFFIX}")))
+        segment = Segment(os.path.join(directory, f"{self.source}-{number:04d}{SUFFIX}"), self.segment_records)
+        self.segments[symbol] = (day, segment)
+        console.debug("Segment %s opened;", segment.path)
+        return segment
+
+    def _flush_segments(self):
+        for _, segment in self.segments.values():
+            segment.flush()
+
+
+def read_segment(path: str):
+    """
+    Map a segment file without copying it. Segments that are still being written can be read as well.
+    :return: Read-only array of TICK_DTYPE with the records of the segment.
+    """
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header["magic"][0] != MAGIC or header["version"][0] != FORMAT_VERSION:
+        raise ValueError(f"{path} is not a tick segment of version {FORMAT_VERSION}")
+    count = int(header["count"][0])
+    if count == 0:
+        return np.empty(0, dtype=TICK_DTYPE)
+    return np.memmap(path, dtype=TICK_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+
+def days(path: str = TICK_PATH):
+    """
+    :return: The recorded days, oldest first.
+    """
+    return sorted(entry for entry in os.listdir(path) if os.path.isdir(os.path.join(path, entry)))
+
+
+def symbols(day: str, path: str = TICK_PATH):
+    """
+    :return: The symbols recorded on a day.
+    """
+    directory = os.path.join(path, day)
+    return sorted(entry for entry in os.listdir(directory) if os.path.isdir(os.path.join(directory, entry)))
+
+
+def read(symbol: str, day: str, path: str = TICK_PATH):
+    """
+    All records of a symbol on a day, sorted by time.
+    A single segment is returned as a view of the file, several segments are merged into a new array.
+    """
+    segments = [read_segment(file) for file in sorted(glob.glob(os.path.join(path, day, symbol, "*" + SUFFIX)))]
+    segments = [segment for segment in segments if len(segment)]
+    if not segments:
+        return np.empty(0, dtype=TICK_DTYPE)
+    if len(segments) == 1:
+        return segments[0]
+    records = np.concatenate(segments)
+    return records[np.argsort(records["time"], kind="stable")]
+
+
+def load_quotes(day: str, path: str = TICK_PATH, symbol_filter=None):
+    """
+    Load a recorded day in the format of simulated_ib.load_quotes, e.g. for a replay.
+    :param symbol_filter: Only these symbols are loaded. None loads all symbols of the day.
+    :return: List of tuples (time, symbol, bid, ask, last, bid_size, ask_size) sorted by time.
+    """
+    names = [symbol for symbol in symbols(day, path) if symbol_filter is None or symbol in symbol_filter]
+    arrays = [read(symbol, day, path) for symbol in names]
+    if not arrays:
+        return []
+    records = np.concatenate(arrays)
+    owners = np.repeat(np.arange(len(names)), [len(array) for array in arrays])
+    order = np.argsort(records["time"], kind="stable")
+    records, owners = records[order], owners[order]
+    return list(zip(records["time"].tolist(), [names[owner] for owner in owners.tolist()],
+                    records["bid"].tolist(), records["ask"].tolist(), records["last"].tolist(),
+                    records["bid_size"].tolist(), records["ask_size"].tolist()))
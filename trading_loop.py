@@ -0,0 +1,75 @@
+"""
+This module contains the loops that drive the models, either with live data from TWS or with a replay.
+"""
+import checkpoint
+import execution_model
+import instrumentation
+from tws_connection import ib
+from constants import THRESHOLD, THRESHOLD_MODE, Z_SCORE_THRESHOLD
+
+
+def trading_cycle(signal_engine, portfolio, rows=None):
+    """
+    The logic follows iteratively that same pattern.
+
+    1. Generate new Signals for each of the Pairs that are currently traded (or only those in rows).
+    2. The Signals generated in 1. have to be evaulated by the portfolio.analyze_signals method.
+    3. During the analysis, instructions about what the new positions should look like, were created.
+    4. Current positions and Signals that could not be followed, because the maximum amount of trades 
+       we want to be in at the same time was reached, will be analyzed and the portfolio adjusted if a position fullfilled its
+       predicted potential or if the position is blocking a better opportunity.
+    5. In the last step the instructions of 3. and 4. are netted and directed to the Execution Model at once.
+
+    The latency of every step is recorded by the instrumentation, measured from the first tick of the cycle.
+    """
+    instrumentation.start_cycle(signal_engine.first_tick if rows is not None else None)
+    signals = evaluate(signal_engine, rows)
+    instrumentation.since_cycle("tick_to_signal")
+    portfolio_cycle(portfolio, signals)
+
+
+def evaluate(signal_engine, rows=None):
+    """
+    Generate the Signals of the given rows with the threshold of THRESHOLD_MODE.
+    """
+    if THRESHOLD_MODE == "ZSCORE":
+        return signal_engine.generate_signals(threshold=Z_SCORE_THRESHOLD, rows=rows, zscore=True)
+    return signal_engine.generate_signals(threshold=THRESHOLD, rows=rows)
+
+
+def portfolio_cycle(portfolio, signals):
+    """
+    Steps 2. to 5. of trading_cycle for Signals that were already generated, e.g. by the shard workers.
+    :param signals: Tuple of new signals and pairs traded as returned by SignalEngine.generate_signals.
+    """
+    with instrumentation.Span("analyze_signals"):
+        portfolio_changes = portfolio.analyze_signals(signals)
+    with instrumentation.Span("optimize"):
+        new_adjustments = portfolio.optimize(pending=portfolio_changes)
+    # Both adjustments are netted and executed together, so every ticker gets at most one order per cycle.
+    execution_model.execute_portfolio_adjustments(portfolio,
+                                                  execution_model.net_adjustments(portfolio_changes, new_adjustments))
+    instrumentation.export()
+    checkpoint.save_if_due(portfolio)
+
+
+def run_polling(signal_engine, portfolio, interval):
+    # Fallback mode: all Pairs are evaluated every interval seconds, whether their quotes changed or not.
+    while True:
+        ib.sleep(interval)
+        signal_engine.refresh_quotes()
+        trading_cycle(signal_engine, portfolio)
+
+
+def run_event_driven(signal_engine, portfolio, window):
+    # Only Pairs with a leg that ticked are evaluated. Ticks arriving within the window are coalesced into one cycle.
+    ib.pendingTickersEvent += signal_engine.on_pending_tickers
+    try:
+        while True:
+            ib.waitOnUpdate()
+            if not signal_engine.dirty_rows:
+                continue
+            ib.sleep(window)
+            trading_cycle(signal_engine, portfolio, signal_engine.pop_dirty_rows())
+    finally:
+        ib.pendingTickersEvent -= signal_engine.on_pending_tickers
@@ -0,0 +1,71 @@
+"""
+This module contains the cost model for stock orders at IBKR, see the Trading Cost section of constants.py.
+
+All methods take scalars or NumPy arrays of signed share quantities (positive = buy, negative = sell) and prices,
+so the costs of thousands of candidate trades are calculated in one call. The defaults come from constants.py,
+but every fee can be overridden, e.g. to compare different cost assumptions in a replay.
+"""
+import numpy as np
+from constants import MINIMUM_TRADE_COST, COST_PER_SHARE, MAX_TRADE_COST_PCT, MAX_TRADE_COST_ABS
+from constants import SEC_TRANS_FEE, FINRA_TRADING_ACTIVITY_FEE, FINRA_AUDIT_FEES
+
+
+class CostModel:
+    """
+    IBKR fixed pricing plus the US regulatory fees.
+
+    commission      per share, at least the minimum per order, at most a percentage of the trade value
+    SEC fee         percentage of the value of sales
+    FINRA TAF       per share sold, capped per trade
+    FINRA CAT       per share, on both sides
+    """
+
+    def __init__(self,
+                 minimum: float = MINIMUM_TRADE_COST,
+                 per_share: float = COST_PER_SHARE,
+                 max_pct: float = MAX_TRADE_COST_PCT,
+                 sec_fee: float = SEC_TRANS_FEE,
+                 taf_fee: float = FINRA_TRADING_ACTIVITY_FEE,
+                 taf_cap: float = MAX_TRADE_COST_ABS,
+                 cat_fee: float = FINRA_AUDIT_FEES):
+
+        self.minimum = minimum
+        self.per_share = per_share
+        self.max_pct = max_pct
+        self.sec_fee = sec_fee
+        self.taf_fee = taf_fee
+        self.taf_cap = taf_cap
+        self.cat_fee = cat_fee
+
+    def commission(self, shares, price):
+        """
+        Commission of orders. Orders of zero shares cost nothing.
+        """
+        shares = np.abs(shares)
+        commission = np.minimum(np.maximum(self.minimum, self.per_share * shares), self.max_pct * shares * price)
+        return np.where(shares > 0, commission, 0.0)
+
+    def regulatory_fees(self, shares, price):
+        """
+        Regulatory fees of orders. SEC fee and FINRA TAF are only charged on the sell side.
+        """
+        quantity = np.abs(shares)
+        sell_side = self.sec_fee * quantity * price + np.minimum(self.taf_fee * quantity, self.taf_cap)
+        return np.where(np.asarray(shares) < 0, sell_side, 0.0) + self.cat_fee * quantity
+
+    def order_cost(self, shares, price):
+        """
+        Complete cost of orders in USD.
+        :param shares: Signed quantities, negative for sales.
+        :param price: Expected execution prices.
+        """
+        return self.commission(shares, price) + self.regulatory_fees(shares, price)
+
+    def round_trip(self, shares, price, exit_price=None):
+        """
+        Cost of opening positions of the given signed size and closing them again.
+        :param exit_price: Expected prices when the positions are closed. By default the entry prices.
+        """
+        if exit_price is None:
+            exit_price = price
+        return self.order_cost(shares, price) + self.order_cost(np.negative(shares), exit_price)
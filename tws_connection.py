@@ -3,11 +3,25 @@ This module enables the program to share the connection to tws.
 """
 
 from ib_insync import IB
+from constants import CLIENT_ID
 
 
 ib = IB()
 
-def build_connection():
-    # Connect to TWS through ib_insync.
-    connection = ib.connect("127.0.0.1", 7497, clientId=15)
+def build_connection(client_id: int = CLIENT_ID):
+    # Connect to TWS through ib_insync. Every process needs its own client id, see sharding.py.
+    # Importing the models does not connect, so the program has to call this once before it trades.
+    if not ib.isConnected():
+        ib.connect("127.0.0.1", 7497, clientId=client_id)
+    return ib
 
+
+
+def install(backend):
+    """
+    Replace the connection that is shared by all modules, e.g. with a simulated_ib.SimulatedIB for replays.
+    This has to happen before any of the models is imported, because they bind tws_connection.ib at import.
+    :param backend: An object offering the ib_insync.IB interface.
+    """
+    global ib
+    ib = backend